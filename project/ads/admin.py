@@ -1,8 +1,10 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Product, Category, Shop, Order, ProductInfo, Contact, OrderItem, Parameter, ProductParameter, ProductImage
+from .models import User, Product, Category, Shop, Order, ProductInfo, Contact, OrderItem, Parameter, ProductParameter, ProductImage, ImportJob, ShopFeed
 from imagekit.admin import AdminThumbnail
+from django.contrib.postgres.search import SearchQuery
+from .search import SEARCH_CONFIG
         
 admin.site.register(User)
 # Базовые товары
@@ -29,6 +31,13 @@ class ProductAdmin(admin.ModelAdmin):
     def product_count(self, obj):
         return obj.product_infos.count()
     product_count.short_description = 'Количество предложений'
+    
+    # Поиск по полнотекстовому индексу вместо icontains по трём полям
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        query = SearchQuery(search_term, config=SEARCH_CONFIG, search_type='websearch')
+        return queryset.filter(search_vector=query), False
 # Категории товаров
 admin.site.register(Category) 
 # Магазины-поставщики
@@ -59,4 +68,8 @@ admin.site.register(OrderItem)
 # Параметры товаров
 admin.site.register(Parameter)
 # Значения параметров товаров
-admin.site.register(ProductParameter)
\ No newline at end of file
+admin.site.register(ProductParameter)
+# Задания импорта каталога
+admin.site.register(ImportJob)
+# Последние загруженные прайс-листы
+admin.site.register(ShopFeed)
\ No newline at end of file
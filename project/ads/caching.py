@@ -1,47 +1,379 @@
+from contextlib import contextmanager
 from functools import wraps
 from django.core.cache import cache
-from django.db.models import QuerySet
+from django.db.models import Model, QuerySet
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete
+from django.apps import apps
+from django.core.exceptions import EmptyResultSet
+from django.db import transaction
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework.response import Response
 import hashlib
 import json
-def cache_query(timeout=300):
+import threading
+import time
+
+
+DEFAULT_TIMEOUT = 300
+LOCK_TIMEOUT = 10
+LOCK_POLL_INTERVAL = 0.05
+
+_state = threading.local()
+
+# Модели, от которых зависят закэшированные данные: при их изменении поколение увеличивается.
+# Модели приложения ads отслеживаются всегда, чтобы процесс, ещё не заполнявший кэш,
+# тоже сбрасывал записи других процессов
+TRACKED_APPS = {'ads'}
+_tracked_models = set()
+
+
+def _key_default(value):
+    if isinstance(value, Model):
+        return [value._meta.label, value.pk]
+    if isinstance(value, QuerySet):
+        try:
+            sql, params = value.query.sql_with_params()
+        except EmptyResultSet:
+            sql, params = '', ()
+        return [value.model._meta.label, value.db, sql, [str(param) for param in params]]
+    if isinstance(value, (set, frozenset)):
+        return sorted(repr(item) for item in value)
+    return repr(value)
+
+
+# Ключ не зависит от порядка именованных аргументов и адресов объектов в памяти
+def make_key(prefix, *args, **kwargs):
+    payload = json.dumps({'args': args, 'kwargs': kwargs}, default=_key_default, sort_keys=True, ensure_ascii=False)
+    return f'{prefix}:{hashlib.md5(payload.encode()).hexdigest()}'
+
+
+def _generation_key(model):
+    return f'generation:{model._meta.label_lower}'
+
+
+def _tag_key(tag):
+    return f'generation:tag:{tag}'
+
+
+def track_models(*models):
+    _tracked_models.update(model._meta.label_lower for model in models)
+
+
+# Начальное значение берётся из времени, чтобы после вытеснения счётчика из кэша
+# не вернуться к поколению, под которым уже лежат устаревшие записи
+def _bump(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), None)
+
+
+def bump_generation(*models):
+    _bump(_generation_key(model) for model in models)
+
+
+# Теги позволяют сбрасывать часть записей, например только каталог одного магазина
+def bump_tags(*tags):
+    _bump(_tag_key(tag) for tag in set(tags))
+
+
+def generations(models=(), tags=()):
+    keys = [_generation_key(model) for model in models] + [_tag_key(tag) for tag in tags]
+    current = cache.get_many(keys)
+    for key in keys:
+        if key not in current:
+            cache.add(key, time.time_ns(), None)
+            current[key] = cache.get(key)
+    return '.'.join(str(current[key]) for key in keys)
+
+
+# Массовые операции (импорт каталога) отключают сброс по сигналам для каждой строки
+# и сбрасывают нужные поколения и теги сами после завершения
+@contextmanager
+def invalidation_suppressed():
+    previous = getattr(_state, 'suppressed', False)
+    _state.suppressed = True
+    try:
+        yield
+    finally:
+        _state.suppressed = previous
+
+
+def _invalidation_suppressed():
+    return getattr(_state, 'suppressed', False)
+
+
+# Сброс по сигналам откладывается до фиксации транзакции записи: иначе параллельный запрос
+# успеет закэшировать ещё не изменённые строки под новым поколением. Вне транзакции
+# сброс выполняется сразу
+def _after_commit(func, *args):
+    transaction.on_commit(lambda: func(*args))
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_model_cache(sender, **kwargs):
+    if _invalidation_suppressed():
+        return
+    if sender._meta.app_label in TRACKED_APPS or sender._meta.label_lower in _tracked_models:
+        _after_commit(bump_generation, sender)
+
+
+# Значение берётся из кэша, а при промахе вычисляется одним процессом:
+# остальные ждут, пока оно появится, вместо одновременного обращения к базе.
+# Если владелец блокировки снял её, ничего не сохранив (результат не кэшируется
+# или вычисление упало), ожидающие сразу вычисляют значение сами
+def get_or_set(key, compute, timeout=DEFAULT_TIMEOUT, models=(), should_cache=None, tags=()):
+    track_models(*models)
+    if models or tags:
+        key = f'{key}:{generations(models, sorted(tags))}'
+
+    cached = cache.get(key)
+    if cached is not None:
+        return cached[0]
+
+    lock_key = f'{key}:lock'
+    locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+    if not locked:
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached[0]
+            if cache.get(lock_key) is None:
+                break
+
+    try:
+        value = compute()
+        if should_cache is None or should_cache(value):
+            cache.set(key, (value,), timeout)
+        return value
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+
+def cache_query(timeout=DEFAULT_TIMEOUT, models=()):
+    track_models(*models)
+
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            cache_key = f'{func.__module__}.{func.__name__}:{hashlib.md5(json.dump({'args':args, 'kwargs': kwargs}).encode()).hexdigest()}'
-            
-            cached_data = cache.get(cache_key)
-            if cached_data is not None:
-                return cached_data
-            
-            
-            result = func(*args, **kwargs)
-            cache.set(cache_key, result, timeout)
-            
-            return result
-        
+            cache_key = make_key(f'{func.__module__}.{func.__qualname__}', *args, **kwargs)
+            return get_or_set(cache_key, lambda: func(*args, **kwargs), timeout, models)
+
         return wrapper
-    
+
     return decorator
 
+
+# Кэширование данных ответа метода list представления: ключом служит полный адрес запроса,
+# в кэш попадают только успешные ответы. tags — функция (view, request), возвращающая теги записи
+def cache_response(timeout=DEFAULT_TIMEOUT, models=(), tags=None):
+    track_models(*models)
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            cache_key = make_key(f'response.{type(view).__name__}', request.build_absolute_uri())
+            uncached = []
+
+            def compute():
+                response = method(view, request, *args, **kwargs)
+                if isinstance(response, Response) and response.status_code == 200:
+                    return response.data
+                uncached.append(response)
+                return None
+
+            data = get_or_set(
+                cache_key, compute, timeout, models,
+                should_cache=lambda data: not uncached,
+                tags=tags(view, request) if tags else (),
+            )
+            return uncached[0] if uncached else Response(data)
+
+        return wrapper
+
+    return decorator
+
+
+# Кэш готовых ответов для публичных представлений, ответ которых не зависит от пользователя.
+# Хранятся уже отрисованные байты JSON вместе с сильным ETag, поэтому при попадании
+# не выполняются ни аутентификация, ни запросы к базе, ни сериализация,
+# а при совпадении If-None-Match клиент получает 304 без тела
+class RenderedResponseCacheMixin:
+    response_cache_timeout = DEFAULT_TIMEOUT
+    response_cache_models = ()
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+
+        # Полный адрес со схемой и хостом: ссылки next/previous в теле ответа абсолютные
+        cache_key = make_key(
+            f'rendered.{type(self).__name__}', request.build_absolute_uri(), request.META.get('HTTP_ACCEPT', '')
+        )
+        uncached = []
+
+        def compute():
+            response = super(RenderedResponseCacheMixin, self).dispatch(request, *args, **kwargs)
+            renderer = getattr(response, 'accepted_renderer', None)
+            if response.status_code == 200 and renderer is not None and renderer.format == 'json':
+                response.render()
+                etag = f'"{hashlib.sha256(response.content).hexdigest()}"'
+                return response.content, response['Content-Type'], etag
+            uncached.append(response)
+            return None
+
+        cached = get_or_set(
+            cache_key, compute, self.response_cache_timeout, self.response_cache_models,
+            should_cache=lambda value: not uncached,
+        )
+        if uncached:
+            return uncached[0]
+
+        content, content_type, etag = cached
+        # If-None-Match сравнивается слабо: W/"..." совпадает с тем же сильным тегом
+        if_none_match = {tag.removeprefix('W/') for tag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))}
+        if {etag, '*'} & if_none_match:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        patch_vary_headers(response, ['Accept'])
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+
+def queryset_models(queryset):
+    tables = {alias.table_name for alias in queryset.query.alias_map.values()} | {queryset.model._meta.db_table}
+    return [model for model in apps.get_models(include_auto_created=True) if model._meta.db_table in tables]
+
+
 class CachedQuerySet(QuerySet):
     def __init__(self, model = None, query = None, using = None, hints = None):
         super().__init__(model, query, using, hints)
         self._cache_key = None
-        
+
     def _get_cache_key(self):
         if not self._cache_key:
-            query_string = str(self.query)
-            self._cache_key = f'queryset:{hashlib.md5(query_string.encode()).hexdigest()}'
-        
+            self._cache_key = make_key('queryset', self)
+
         return self._cache_key
-    
-    def get_from_cache(self, timeout=300):
-        cache_key = self._get_cache_key()
-        cached_data = cache.get(cache_key)
-        if cached_data is not None:
-            return cached_data
-        
-        result = list(self)
-        cache.set(cache_key, result, timeout)
-        
-        return result
\ No newline at end of file
+
+    # Ключ учитывает поколения всех таблиц запроса, поэтому после изменения данных
+    # закэшированный результат больше не используется
+    def get_from_cache(self, timeout=DEFAULT_TIMEOUT):
+        return get_or_set(self._get_cache_key(), lambda: list(self), timeout, queryset_models(self))
+
+
+# Теги каталога: записи, отфильтрованные по магазину или категории, зависят только от них,
+# записи без фильтров — от общего тега каталога
+CATALOG_TAG = 'catalog'
+
+
+def shop_tag(shop_id):
+    return f'shop:{shop_id}'
+
+
+def category_tag(category_id):
+    return f'category:{category_id}'
+
+
+def catalog_read_tags(shop_id=None, category_id=None):
+    if shop_id:
+        return [shop_tag(shop_id)] + ([category_tag(category_id)] if category_id else [])
+    if category_id:
+        return [category_tag(category_id)]
+    return [CATALOG_TAG]
+
+
+def invalidate_catalog(shop_id, category_ids=()):
+    bump_tags(CATALOG_TAG, shop_tag(shop_id), *(category_tag(category_id) for category_id in category_ids))
+
+
+# Затронутые категории определяются сразу, пока строки ещё не удалены каскадом,
+# а сам сброс выполняется после фиксации
+def invalidate_shop_catalog(shop_id):
+    from ads.models import ProductInfo
+
+    category_ids = ProductInfo.objects.filter(shop_id=shop_id).values_list('product__category_id', flat=True).distinct()
+    _after_commit(invalidate_catalog, shop_id, list(category_ids))
+
+
+def _invalidate_offer(offer_id=None, shop_id=None, product_id=None):
+    from ads.models import Product, ProductInfo
+
+    if offer_id is not None:
+        shop_id, product_id = ProductInfo.objects.filter(pk=offer_id).values_list('shop_id', 'product_id').first() or (None, None)
+    if shop_id is None:
+        return
+    category_ids = Product.objects.filter(pk=product_id).values_list('category_id', flat=True)
+    _after_commit(invalidate_catalog, shop_id, list(category_ids))
+
+
+@receiver(post_save, sender='ads.ProductInfo')
+@receiver(post_delete, sender='ads.ProductInfo')
+def invalidate_offer_cache(sender, instance, **kwargs):
+    if not _invalidation_suppressed():
+        _invalidate_offer(shop_id=instance.shop_id, product_id=instance.product_id)
+
+
+# При каскадном удалении предложения его параметры сбрасываются вместе с ним
+@receiver(post_save, sender='ads.ProductParameter')
+@receiver(post_delete, sender='ads.ProductParameter')
+def invalidate_offer_parameter_cache(sender, instance, **kwargs):
+    if not _invalidation_suppressed():
+        _invalidate_offer(offer_id=instance.product_info_id)
+
+
+# Категории магазина ищутся по его предложениям, поэтому при удалении — до каскада
+@receiver(post_save, sender='ads.Shop')
+@receiver(pre_delete, sender='ads.Shop')
+def invalidate_shop_cache(sender, instance, **kwargs):
+    if not _invalidation_suppressed():
+        invalidate_shop_catalog(instance.pk)
+
+
+# Товар и его изображения попадают в каталог через предложения: сбрасываются магазины,
+# где товар продаётся, и его категории
+def invalidate_product_catalog(product_id, category_ids=()):
+    from ads.models import Product, ProductInfo
+
+    category_ids = set(category_ids) | set(Product.objects.filter(pk=product_id).values_list('category_id', flat=True))
+    for shop_id in ProductInfo.objects.filter(product_id=product_id).values_list('shop_id', flat=True).distinct():
+        _after_commit(invalidate_catalog, shop_id, category_ids)
+
+
+# При переносе товара в другую категорию сбрасывается и прежняя
+@receiver(pre_save, sender='ads.Product')
+def remember_product_category(sender, instance, **kwargs):
+    if instance.pk and not _invalidation_suppressed():
+        instance._previous_category_id = sender.objects.filter(pk=instance.pk).values_list('category_id', flat=True).first()
+
+
+@receiver(post_save, sender='ads.Product')
+@receiver(pre_delete, sender='ads.Product')
+def invalidate_product_cache(sender, instance, **kwargs):
+    if not _invalidation_suppressed():
+        previous = getattr(instance, '_previous_category_id', None)
+        invalidate_product_catalog(instance.pk, [previous] if previous else ())
+
+
+# Изображения товара кэшируются по тегу товара; сброс снятия признака главного
+# у остальных изображений (update в ProductImage.save) покрывается тем же тегом
+def product_images_tag(product_id):
+    return f'product-images:{product_id}'
+
+
+@receiver(post_save, sender='ads.ProductImage')
+@receiver(post_delete, sender='ads.ProductImage')
+def invalidate_product_images_cache(sender, instance, **kwargs):
+    if not _invalidation_suppressed():
+        _after_commit(bump_tags, product_images_tag(instance.product_id))
+        invalidate_product_catalog(instance.product_id)
@@ -0,0 +1,91 @@
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import F, Case, When, Value, PositiveIntegerField, Subquery, OuterRef, Sum
+from django.db.models.functions import Coalesce
+from ads.caching import invalidate_catalog
+from ads.models import Order, OrderItem, ProductInfo
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCart(CheckoutError):
+    pass
+
+
+# Нехватка товара: по каждой позиции запрошенное и доступное количество
+class InsufficientStock(CheckoutError):
+
+    def __init__(self, shortages):
+        super().__init__('Insufficient stock')
+        self.shortages = shortages
+
+
+# Нехватка по каждой позиции по текущим остаткам; удалённое предложение считается пустым
+def find_shortages(requested):
+    available = dict(ProductInfo.objects.filter(id__in=requested).values_list('id', 'quantity'))
+    return [
+        {'product_id': product_id, 'requested': quantity, 'available': available.get(product_id, 0)}
+        for product_id, quantity in sorted(requested.items())
+        if available.get(product_id, 0) < quantity
+    ]
+
+
+# Резервирование остатков под позиции заказа одним условным UPDATE:
+# SET quantity = quantity - n WHERE quantity >= n. Блокируются только строки заказанных предложений,
+# поэтому оформления разных товаров не ждут друг друга. Подзапрос берёт блокировки в порядке id,
+# и заказы с общими товарами не взаимоблокируются
+def reserve_stock(order):
+    requested = dict(order.order_items.values_list('product_id', 'quantity'))
+    if not requested:
+        raise EmptyCart('Cart is empty')
+
+    needed = Case(
+        *[When(id=product_id, then=Value(quantity)) for product_id, quantity in requested.items()],
+        output_field=PositiveIntegerField()
+    )
+    with transaction.atomic():
+        locked = ProductInfo.objects.filter(id__in=requested).order_by('id').select_for_update().values('id')
+        reserved = ProductInfo.objects.filter(id__in=Subquery(locked), quantity__gte=needed).update(
+            quantity=F('quantity') - needed
+        )
+        if reserved < len(requested):
+            # Хотя бы одной позиции не хватило: списание откатывается до точки сохранения
+            transaction.set_rollback(True)
+    if reserved < len(requested):
+        raise InsufficientStock(find_shortages(requested))
+
+    # update() не отправляет сигналы, поэтому каталог сбрасывается явно
+    categories = defaultdict(set)
+    for shop_id, category_id in ProductInfo.objects.filter(id__in=requested).values_list('shop_id', 'product__category_id'):
+        categories[shop_id].add(category_id)
+    transaction.on_commit(lambda: [invalidate_catalog(shop_id, ids) for shop_id, ids in categories.items()])
+
+
+# Сумма заказа пересчитывается в базе одним UPDATE по зафиксированным ценам позиций
+def update_order_total(order_id):
+    totals = OrderItem.objects.filter(order_id=OuterRef('pk')).values('order_id').annotate(
+        total=Sum(F('quantity') * F('price'))
+    ).values('total')
+    Order.objects.filter(id=order_id).update(total=Coalesce(Subquery(totals), 0))
+
+
+# Фиксация текущих цен предложений в позициях заказа
+def snapshot_prices(order_id):
+    OrderItem.objects.filter(order_id=order_id).update(
+        price=Subquery(ProductInfo.objects.filter(id=OuterRef('product_id')).values('price'))
+    )
+
+
+# Оформление корзины: корзина блокируется, поэтому повторная отправка того же заказа
+# дождётся первой и не найдёт корзину
+def checkout(user_id, order_id):
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(user_id=user_id, id=order_id, status='cart')
+        reserve_stock(order)
+        snapshot_prices(order.id)
+        update_order_total(order.id)
+        order.status = 'new'
+        order.save(update_fields=['status'])
+    return order
@@ -0,0 +1,75 @@
+from collections import defaultdict
+from django.db.models import Count
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from ads.caching import _invalidation_suppressed
+from ads.models import ProductParameter, ProductFacet
+
+
+FACET_QUERY_PARAM = 'param'
+
+
+# Пересборка индекса фасетов для указанных предложений по их текущим параметрам
+def rebuild_facets(offer_ids):
+    offer_ids = list(offer_ids)
+    ProductFacet.objects.filter(product_info_id__in=offer_ids).delete()
+    ProductFacet.objects.bulk_create([
+        ProductFacet(product_info_id=offer_id, parameter_id=parameter_id, name=name, value=value)
+        for offer_id, parameter_id, name, value in ProductParameter.objects.filter(
+            product_info_id__in=offer_ids
+        ).values_list('product_info_id', 'parameter_id', 'parameter__name', 'value')
+    ])
+
+
+# Индекс поддерживается сигналами, поэтому удаление через queryset (в том числе
+# массовое удаление в админке) тоже его обновляет. Импорт каталога пересобирает индекс сам
+@receiver(post_save, sender=ProductParameter)
+def update_parameter_facet(sender, instance, **kwargs):
+    if not _invalidation_suppressed():
+        rebuild_facets([instance.product_info_id])
+
+
+@receiver(post_delete, sender=ProductParameter)
+def delete_parameter_facet(sender, instance, **kwargs):
+    if not _invalidation_suppressed():
+        ProductFacet.objects.filter(product_info_id=instance.product_info_id, parameter_id=instance.parameter_id).delete()
+
+
+# Фильтры вида ?param=Цвет:черный&param=Цвет:белый&param=Память:64.
+# Значения одного параметра объединяются через ИЛИ, разные параметры через И
+def parse_facet_filters(query_params):
+    filters = defaultdict(set)
+    for item in query_params.getlist(FACET_QUERY_PARAM):
+        name, separator, value = item.partition(':')
+        if separator and name and value:
+            filters[name].add(value)
+    return filters
+
+
+def filter_by_facets(queryset, filters):
+    for name, values in filters.items():
+        queryset = queryset.filter(id__in=ProductFacet.objects.filter(
+            name=name, value__in=values
+        ).values('product_info_id'))
+    return queryset
+
+
+# Количество предложений по каждому значению каждого параметра. queryset — каталог без фильтров
+# по параметрам: значения параметра из filters считаются без его собственного фильтра,
+# чтобы к выбранному значению можно было добавить другие. Параметры без фильтра
+# считаются одним запросом, каждый отфильтрованный — отдельным
+def facet_counts(queryset, filters=None):
+    filters = filters or {}
+    groups = [(filter_by_facets(queryset, filters), ProductFacet.objects.exclude(name__in=filters))]
+    for name in filters:
+        others = {other: values for other, values in filters.items() if other != name}
+        groups.append((filter_by_facets(queryset, others), ProductFacet.objects.filter(name=name)))
+
+    facets = defaultdict(dict)
+    for offers, facet_rows in groups:
+        counts = facet_rows.filter(
+            product_info_id__in=offers.order_by().values('id')
+        ).values_list('name', 'value').annotate(count=Count('id')).order_by('name', '-count', 'value')
+        for name, value, count in counts:
+            facets[name][value] = count
+    return {name: facets[name] for name in sorted(facets)}
@@ -0,0 +1,192 @@
+import codecs
+import hashlib
+import json
+import yaml
+from urllib.parse import urlparse
+from requests import get
+from yaml.composer import Composer
+from yaml.constructor import SafeConstructor
+from yaml.resolver import Resolver
+
+
+FEED_CHUNK_SIZE = 64 * 1024
+FEED_TIMEOUT = (10, 60)
+# Предел длины одного значения JSON (позиции, списка категорий): битый или обрезанный
+# прайс-лист не должен целиком оказаться в памяти, пока разбор ждёт конца значения
+FEED_MAX_VALUE_SIZE = 4 * 1024 * 1024
+
+
+# Разбор событий через libyaml, сборка узлов по одному через Composer
+try:
+    from yaml.cyaml import CParser
+
+    class FeedLoader(CParser, Composer, SafeConstructor, Resolver):
+
+        def __init__(self, stream):
+            CParser.__init__(self, stream)
+            Composer.__init__(self)
+            SafeConstructor.__init__(self)
+            Resolver.__init__(self)
+except ImportError:
+    FeedLoader = yaml.SafeLoader
+
+
+# Скачивание прайс-листа по частям во временный файл с подсчётом хэша содержимого.
+# При ответе 304 Not Modified файл остаётся пустым
+def download_feed(url, spool, headers=None, chunk_size=FEED_CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with get(url, stream=True, headers=headers, timeout=FEED_TIMEOUT) as response:
+        response.raise_for_status()
+        if response.status_code != 304:
+            for chunk in response.iter_content(chunk_size):
+                digest.update(chunk)
+                spool.write(chunk)
+    spool.seek(0)
+    return response, digest.hexdigest()
+
+
+def feed_format(fp, url='', content_type=''):
+    if 'json' in content_type or urlparse(url).path.endswith('.json'):
+        return 'json'
+    if 'yaml' in content_type or urlparse(url).path.endswith(('.yaml', '.yml')):
+        return 'yaml'
+
+    position = fp.tell()
+    head = fp.read(1024).lstrip()
+    fp.seek(position)
+    return 'json' if head.startswith(b'{') else 'yaml'
+
+
+# Потоковое чтение прайс-листа: верхнеуровневые ключи отдаются по мере разбора,
+# вместо списка goods возвращается генератор, читающий позиции по одной
+def read_feed(fp, url='', content_type='', chunk_size=FEED_CHUNK_SIZE):
+    if feed_format(fp, url, content_type) == 'json':
+        return JsonFeedReader(fp, chunk_size).entries()
+    return iter_yaml_feed(fp)
+
+
+def iter_yaml_feed(fp):
+    loader = FeedLoader(fp)
+    try:
+        loader.get_event()
+        if loader.check_event(yaml.StreamEndEvent):
+            return
+        loader.get_event()
+        if not loader.check_event(yaml.MappingStartEvent):
+            raise ValueError('Прайс-лист должен быть словарём')
+        loader.get_event()
+
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = _construct_yaml(loader, loader.compose_node(None, None))
+            if key == 'goods' and loader.check_event(yaml.SequenceStartEvent):
+                loader.get_event()
+                items = _iter_yaml_sequence(loader)
+                yield key, items
+                for _ in items:
+                    pass
+                loader.get_event()
+            else:
+                yield key, _construct_yaml(loader, loader.compose_node(None, None))
+    finally:
+        loader.dispose()
+
+
+# Якоря действуют в пределах одной позиции, иначе они копились бы за весь прайс-лист
+def _iter_yaml_sequence(loader):
+    while not loader.check_event(yaml.SequenceEndEvent):
+        item = _construct_yaml(loader, loader.compose_node(None, None))
+        loader.anchors = {}
+        yield item
+
+
+# Разобранные узлы не накапливаются в загрузчике между позициями
+def _construct_yaml(loader, node):
+    value = loader.construct_object(node, deep=True)
+    loader.constructed_objects.clear()
+    return value
+
+
+class JsonFeedReader:
+
+    def __init__(self, fp, chunk_size=FEED_CHUNK_SIZE, max_value_size=FEED_MAX_VALUE_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.max_value_size = max_value_size
+        self.text = codecs.getincrementaldecoder('utf-8-sig')()
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def entries(self):
+        self.expect('{')
+        if self.peek() == '}':
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            if key == 'goods' and self.peek() == '[':
+                self.pos += 1
+                items = self.items()
+                yield key, items
+                for _ in items:
+                    pass
+            else:
+                yield key, self.value()
+
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect('}')
+                return
+
+    def items(self):
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect(']')
+                return
+
+    def fill(self):
+        chunk = self.fp.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.pos:] + self.text.decode(chunk, final=self.eof)
+        self.pos = 0
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                raise ValueError('Неожиданный конец прайс-листа')
+            self.fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'Ожидался символ {char!r}, получен {self.buffer[self.pos]!r}')
+        self.pos += 1
+
+    # Значение считается прочитанным, только если после него в буфере есть ещё данные,
+    # иначе число на границе блока могло бы быть обрезано
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            if len(self.buffer) - self.pos > self.max_value_size:
+                raise ValueError(f'Значение прайс-листа длиннее {self.max_value_size} символов')
+            self.fill()
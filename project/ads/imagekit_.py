@@ -1,6 +1,20 @@
+from functools import lru_cache, partial
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import File
+from django.db import transaction
 from imagekit import ImageSpec
-from imagekit.registry import register
-from imagekit.processors import ResizeToFill, ResizeToFit
+from imagekit.cachefiles.backends import CacheFileState
+from imagekit.registry import register, generator_registry
+from imagekit.processors import ResizeToFill, ResizeToFit, SmartResize, ProcessorPipeline
+from imagekit.utils import img_to_fobj
+from PIL import Image, ImageOps
+import hashlib
+import logging
+import math
+import sentry_sdk
+
+logger = logging.getLogger(__name__)
 
 class ProductThumbnail(ImageSpec):
     processors = [ResizeToFill(100, 100)]
@@ -25,4 +39,155 @@ class ProductWebP(ImageSpec):
 class AdminThumbnail(ImageSpec):
     processors = [ResizeToFill(50, 50)]
     format = 'JPEG'
-    options = {'quality': 60}
\ No newline at end of file
+    options = {'quality': 60}
+
+register.generator('ads:product_thumbnail', ProductThumbnail)
+register.generator('ads:product_medium', ProductMedium)
+register.generator('ads:product_large', ProductLarge)
+register.generator('ads:product_webp', ProductWebP)
+register.generator('ads:admin_thumbnail', AdminThumbnail)
+
+
+# Варианты изображения создаются задачей Celery после сохранения исходника.
+# Обращение к .url в запросе не проверяет наличие файла и не запускает PIL:
+# до завершения задачи адрес варианта просто ещё не отдаётся хранилищем.
+# Файл создаётся на месте только при явном чтении его содержимого
+class Background:
+
+    def on_source_saved(self, file):
+        instance = file.generator.source.instance
+        # Сигнал приходит для каждой спецификации, задача на изображение нужна одна
+        if not getattr(instance, '_renditions_scheduled', False):
+            instance._renditions_scheduled = True
+            transaction.on_commit(partial(schedule_renditions, instance))
+
+    def on_content_required(self, file):
+        file.generate()
+
+    def should_verify_existence(self, file):
+        return False
+
+
+def schedule_renditions(instance):
+    from ads.tasks import generate_image_renditions
+
+    instance._renditions_scheduled = False
+    try:
+        generate_image_renditions.delay(instance.pk)
+    except Exception as ex:
+        # Без брокера варианты досоздаются командой generate_image_renditions
+        logger.warning('Could not schedule renditions for image %s: %s', instance.pk, ex)
+        sentry_sdk.capture_exception(ex)
+
+
+def _resize_processor(spec):
+    return next((
+        processor for processor in reversed(spec.processors)
+        if isinstance(processor, (ResizeToFit, ResizeToFill, SmartResize))
+    ), None)
+
+
+# Ширина входного изображения с пропорциями исходника, при которой спецификации не нужно
+# увеличение: для вписывания считается по меньшему из размеров цели, для заполнения
+# и умной обрезки — по большему. None — спецификации нужен исходник целиком
+def required_width(spec, aspect):
+    resize = _resize_processor(spec)
+    if resize is None or resize.width is None or resize.height is None:
+        return None
+    pick = min if isinstance(resize, ResizeToFit) else max
+    return math.ceil(pick(resize.width, resize.height * aspect))
+
+
+def _processors_signature(spec):
+    return tuple((type(processor).__name__, repr(sorted(vars(processor).items()))) for processor in spec.processors)
+
+
+# Создание всех вариантов одного исходника за одно декодирование. JPEG декодируется
+# в уменьшенном масштабе (draft), достаточном для самого большого варианта, каждый вариант
+# строится из ближайшего большего промежуточного изображения (результаты вписывания
+# сохраняют пропорции и переиспользуются), одинаковые обработки выполняются один раз
+def render_renditions(files, force=False):
+    files = [file for file in files if force or not file.cachefile_backend.exists(file)]
+    if not files:
+        return
+
+    source = files[0].generator.source
+    source.open('rb')
+    try:
+        with Image.open(source) as img:
+            aspect = img.width / img.height
+            widths = [required_width(file.generator, aspect) for file in files]
+            if None not in widths:
+                img.draft('RGB', (max(widths), math.ceil(max(widths) / aspect)))
+            base = ImageOps.exif_transpose(img)
+            base.load()
+    finally:
+        source.close()
+
+    intermediates = [base]
+    processed = {}
+    for width, file in sorted(zip(widths, files), key=lambda item: -(item[0] or math.inf)):
+        spec = file.generator
+        if width is None:
+            start = base
+        else:
+            start = min((image for image in intermediates if image.width >= width), key=lambda image: image.width, default=base)
+
+        key = (id(start), _processors_signature(spec))
+        if key not in processed:
+            processed[key] = ProcessorPipeline(spec.processors).process(start)
+            resize = _resize_processor(spec)
+            if isinstance(resize, ResizeToFit) and resize.mat_color is None and processed[key].width <= base.width:
+                intermediates.append(processed[key])
+
+        content = img_to_fobj(processed[key], spec.format or 'JPEG', spec.autoconvert, **(spec.options or {}))
+        if file.storage.exists(file.name):
+            file.storage.delete(file.name)
+        file.storage.save(file.name, File(content))
+        file.cachefile_backend.set_state(file, CacheFileState.EXISTS)
+
+
+# Версия набора спецификаций: при изменении обработки меняются и имена кэш-файлов,
+# поэтому сохранённые ранее имена перестают использоваться
+@lru_cache
+def _variants_version(model, names):
+    specs = [(name, generator_registry.get(getattr(model, name).spec_id, source=None)) for name in names]
+    signature = repr([
+        (name, _processors_signature(spec), spec.format, spec.options, spec.autoconvert) for name, spec in specs
+    ])
+    return hashlib.md5(signature.encode()).hexdigest()[:12]
+
+
+def _variant_names_key(model, names, source_name):
+    return f'variants:{_variants_version(model, names)}:{source_name}'
+
+
+# Адреса всех вариантов для пачки изображений (например, страницы каталога).
+# Имена кэш-файлов зависят только от имени исходника и спецификации, поэтому вычисляются
+# один раз и хранятся в кэше imagekit без срока; на всю пачку — одно обращение к кэшу.
+# Наличие файлов в хранилище не проверяется (см. стратегию Background)
+def resolve_variant_urls(images, names):
+    images = [image for image in images if image.image]
+    if not images:
+        return {}
+
+    model, names = type(images[0]), tuple(names)
+    cache = caches[settings.IMAGEKIT_CACHE_BACKEND]
+    keys = {image.pk: _variant_names_key(model, names, image.image.name) for image in images}
+    stored = cache.get_many(set(keys.values()))
+
+    missing = {}
+    for image in images:
+        if keys[image.pk] not in stored:
+            missing[keys[image.pk]] = {name: getattr(image, name).name for name in names}
+    if missing:
+        cache.set_many(missing, None)
+        stored.update(missing)
+
+    storage = images[0].image.storage
+    return {
+        image.pk: {
+            'original': image.image.url,
+            **{name: storage.url(file_name) for name, file_name in stored[keys[image.pk]].items()},
+        } for image in images
+    }
@@ -0,0 +1,134 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+try:
+    # Pillow до 11.2 поддерживает AVIF только через этот плагин
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'webp']
+MAX_IMAGE_SIZE = (1200, 1200)
+IMAGE_QUALITY = 85
+
+_pool = None
+
+
+# Подготовка загруженного изображения за одно декодирование и одно кодирование:
+# поворот по EXIF, уменьшение до MAX_IMAGE_SIZE и сохранение в JPEG
+def process_image(data, max_size=MAX_IMAGE_SIZE, quality=IMAGE_QUALITY):
+    with Image.open(BytesIO(data)) as img:
+        img.draft('RGB', max_size)
+        img = ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if img.width > max_size[0] or img.height > max_size[1]:
+            img.thumbnail(max_size, Image.Resampling.LANCZOS)
+
+        output = BytesIO()
+        img.save(output, format='JPEG', quality=quality, optimize=True)
+        return output.getvalue()
+
+
+def jpeg_name(name):
+    return f'{os.path.splitext(os.path.basename(name))[0]}.jpg'
+
+
+# Результат для каждого файла: готовые байты или текст ошибки
+def _process_or_error(data):
+    try:
+        return process_image(data), None
+    except Exception as ex:
+        return None, str(ex)
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+    return _pool
+
+
+# Обработка пачки изображений в пуле процессов по числу ядер; одно изображение
+# обрабатывается на месте, чтобы не платить за передачу данных в другой процесс
+def process_images(contents):
+    if len(contents) < 2:
+        return [_process_or_error(data) for data in contents]
+    return list(get_pool().map(_process_or_error, contents))
+
+
+# Адаптивные изображения: ширина приводится к ближайшей большей ступени лестницы,
+# формат выбирается по заголовку Accept из поддерживаемых установленным Pillow
+RESPONSIVE_WIDTHS = (160, 320, 480, 640, 960, 1200)
+RESPONSIVE_DEFAULT_WIDTH = 640
+RESPONSIVE_FORMATS = (
+    ('image/avif', 'AVIF', 'avif', {'quality': 60}),
+    ('image/webp', 'WEBP', 'webp', {'quality': 80}),
+    ('image/jpeg', 'JPEG', 'jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+)
+
+
+def snap_width(width):
+    if not width:
+        return RESPONSIVE_DEFAULT_WIDTH
+    return next((step for step in RESPONSIVE_WIDTHS if step >= width), RESPONSIVE_WIDTHS[-1])
+
+
+def supported_formats():
+    Image.init()
+    return [item for item in RESPONSIVE_FORMATS if item[1] in Image.SAVE]
+
+
+# Первый по нашему предпочтению формат, который клиент принимает с ненулевым q; JPEG — всегда
+def negotiate_format(accept):
+    accepted = set()
+    for part in (accept or '').split(','):
+        media_type, *params = [item.strip() for item in part.split(';')]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if quality > 0:
+            accepted.add(media_type.lower())
+    formats = supported_formats()
+    return next((item for item in formats if item[0] in accepted), formats[-1])
+
+
+# Версия исходника в адресе: при замене файла адрес меняется, поэтому ответы можно кэшировать навсегда
+def source_version(name):
+    return hashlib.md5(name.encode()).hexdigest()[:10]
+
+
+# Адрес адаптивного изображения; ширину клиент может передать сам (?w=)
+def responsive_image_url(image, width=None):
+    url = reverse('responsive-image', args=[image.pk, source_version(image.image.name)])
+    return f'{url}?w={width}' if width else url
+
+
+def responsive_name(source_name, width, extension):
+    stem = os.path.splitext(source_name)[0]
+    return os.path.join(settings.IMAGEKIT_CACHEFILE_DIR, 'responsive', f'{stem}.{width}.{extension}')
+
+
+def render_responsive(source, width, image_format, options):
+    with Image.open(source) as img:
+        img.draft('RGB', (width, max(1, round(width * img.height / img.width))))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'RGBA') or (img.mode == 'RGBA' and image_format == 'JPEG'):
+            img = img.convert('RGB')
+        if img.width > width:
+            img.thumbnail((width, img.height), Image.Resampling.LANCZOS)
+
+        output = BytesIO()
+        img.save(output, format=image_format, **options)
+        return output.getvalue()
@@ -0,0 +1,394 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from ads.caching import bump_generation, invalidate_catalog, invalidation_suppressed
+from ads.search import update_search_vectors
+from ads.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, ProductFacet, OrderItem
+
+
+REQUIRED_ITEM_FIELDS = ('name', 'category', 'price', 'price_rrc', 'quantity')
+OFFER_FIELDS = ('product_id', 'name', 'price', 'price_rrc', 'quantity')
+DIFF_COUNTS = ('created', 'updated', 'unchanged', 'parameters_updated', 'deleted', 'delisted')
+IMPORT_MODES = ('sync', 'replace')
+CATALOG_CHANGES = ('created', 'updated', 'parameters_updated', 'deleted', 'delisted')
+MAX_REPORTED_ERRORS = 100
+
+
+# Позиция прайс-листа идентифицируется внешним id, а при его отсутствии артикулом
+def offer_key(item):
+    for field in ('id', 'sku'):
+        if item.get(field) not in (None, ''):
+            return str(item[field])
+    return None
+
+
+def chunked(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Пакетный импорт каталога магазина из прайс-листа.
+# В режиме sync предложения сопоставляются по (магазин, external_id) и изменяются
+# только отличающиеся строки, в режиме replace каталог магазина пересоздаётся целиком
+class CatalogImporter:
+
+    def __init__(self, user, batch_size=None, progress=None, mode='sync'):
+        if mode not in IMPORT_MODES:
+            raise ValueError(f'Неизвестный режим импорта: {mode}')
+        self.user = user
+        self.mode = mode
+        self.batch_size = batch_size or getattr(settings, 'CATALOG_IMPORT_BATCH_SIZE', 1000)
+        self.progress = progress
+        self.shop = None
+        self.category_ids = set()
+        self.parameters = {}
+        self.seen_keys = set()
+        self.touched_categories = set()
+        self.shop_created = False
+        self.errors = []
+        self.counts = defaultdict(int)
+        self.timings = defaultdict(float)
+
+    @contextmanager
+    def phase(self, name):
+        if self.progress:
+            self.progress(name, self.counts['goods'])
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - started
+
+    def run(self, data):
+        return self.run_stream((key, data[key]) for key in ('shop', 'categories', 'goods') if key in data)
+
+    # Разделы прайс-листа обрабатываются по мере чтения, goods может быть генератором
+    def run_stream(self, entries):
+        with transaction.atomic(), invalidation_suppressed():
+            transaction.on_commit(self.invalidate_cache)
+            for key, value in entries:
+                if key == 'shop':
+                    self.import_shop(value)
+                elif key == 'categories':
+                    self.require_shop()
+                    self.import_categories(value)
+                elif key == 'goods':
+                    self.require_shop()
+                    if self.mode == 'replace':
+                        self.clear_offers()
+                    self.import_goods(value)
+                    if self.mode == 'sync':
+                        self.remove_stale_offers()
+            self.require_shop()
+        return self.stats()
+
+    # Сбрасывается кэш только этого магазина и затронутых категорий, и только если каталог изменился
+    def invalidate_cache(self):
+        if self.shop_created:
+            bump_generation(Shop)
+        if self.counts['categories_created']:
+            bump_generation(Category)
+        if self.shop and any(self.counts[name] for name in CATALOG_CHANGES):
+            invalidate_catalog(self.shop.id, self.touched_categories)
+
+    def require_shop(self):
+        if self.shop is None:
+            raise ValueError('Название магазина должно быть указано до категорий и товаров')
+
+    def stats(self):
+        return {
+            'shop': self.shop.name if self.shop else None,
+            'mode': self.mode,
+            'counts': dict(self.counts),
+            'diff': {name: self.counts[name] for name in DIFF_COUNTS},
+            'errors': self.errors,
+            'timings': {name: round(value, 3) for name, value in self.timings.items()},
+        }
+
+    def import_shop(self, name):
+        with self.phase('shop'):
+            self.shop, self.shop_created = Shop.objects.get_or_create(name=name, user_id=self.user.id)
+
+    def import_categories(self, categories):
+        with self.phase('categories'):
+            names = {category['id']: category['name'] for category in categories}
+            existing = set(Category.objects.filter(id__in=names).values_list('id', flat=True))
+            created = Category.objects.bulk_create(
+                [Category(id=category_id, name=name) for category_id, name in names.items() if category_id not in existing]
+            )
+            linked = set(Category.shops.through.objects.filter(
+                shop_id=self.shop.id, category_id__in=names
+            ).values_list('category_id', flat=True))
+            Category.shops.through.objects.bulk_create(
+                [Category.shops.through(category_id=category_id, shop_id=self.shop.id)
+                 for category_id in names if category_id not in linked],
+                ignore_conflicts=True
+            )
+            self.category_ids.update(names)
+            self.counts['categories'] += len(names)
+            self.counts['categories_created'] += len(created)
+
+    def clear_offers(self):
+        with self.phase('cleanup'):
+            self.touched_categories.update(
+                ProductInfo.objects.filter(shop_id=self.shop.id).values_list('product__category_id', flat=True).distinct()
+            )
+            _, deleted = ProductInfo.objects.filter(shop_id=self.shop.id).delete()
+            self.counts['deleted'] += deleted.get(ProductInfo._meta.label, 0)
+
+    def import_goods(self, goods):
+        for batch in chunked(goods, self.batch_size):
+            self.import_batch(batch)
+
+    def import_batch(self, batch):
+        with self.phase('validation'):
+            batch = self.validate_batch(batch)
+        with self.phase('products'):
+            products = self.resolve_products(batch)
+        with self.phase('parameters'):
+            self.resolve_parameters(batch)
+
+        offers = [(item, self.offer_values(item, products), self.offer_parameters(item)) for item in batch]
+        if self.mode == 'sync':
+            self.sync_offers(offers)
+        else:
+            self.create_offers(offers)
+
+        self.counts['goods'] += len(batch)
+        if self.progress:
+            self.progress('offers', self.counts['goods'])
+
+    def offer_values(self, item, products):
+        return {
+            'product_id': products[(item['name'], item['category'])],
+            'name': item['name'],
+            'price': item['price'],
+            'price_rrc': item['price_rrc'],
+            'quantity': item['quantity'],
+        }
+
+    def offer_parameters(self, item):
+        return {self.parameters[name]: str(value) for name, value in item.get('parameters', {}).items()}
+
+    def create_offers(self, offers):
+        self.touched_categories.update(item['category'] for item, _, _ in offers)
+        with self.phase('offers'):
+            created = ProductInfo.objects.bulk_create([
+                ProductInfo(shop_id=self.shop.id, external_id=offer_key(item), **values)
+                for item, values, _ in offers
+            ])
+        with self.phase('offer_parameters'):
+            self.create_parameters(
+                (offer.id, parameters) for offer, (_, _, parameters) in zip(created, offers)
+            )
+        self.counts['offers'] += len(created)
+        self.counts['created'] += len(created)
+        return created
+
+    # Вместе с параметрами заполняется индекс фасетов, названия берутся из кэша параметров
+    def create_parameters(self, offers):
+        names = {parameter_id: name for name, parameter_id in self.parameters.items()}
+        created = ProductParameter.objects.bulk_create([
+            ProductParameter(product_info_id=offer_id, parameter_id=parameter_id, value=value)
+            for offer_id, parameters in offers
+            for parameter_id, value in parameters.items()
+        ])
+        ProductFacet.objects.bulk_create([
+            ProductFacet(
+                product_info_id=parameter.product_info_id, parameter_id=parameter.parameter_id,
+                name=names[parameter.parameter_id], value=parameter.value
+            ) for parameter in created
+        ])
+        self.counts['offer_parameters'] += len(created)
+
+    # Сравнение с текущим состоянием: новые строки создаются, изменённые обновляются,
+    # параметры пересоздаются только у предложений, где они действительно поменялись
+    def sync_offers(self, offers):
+        with self.phase('diff'):
+            existing = {
+                offer.external_id: offer for offer in ProductInfo.objects.filter(
+                    shop_id=self.shop.id,
+                    external_id__in=[offer_key(item) for item, _, _ in offers]
+                ).only('id', 'external_id', *OFFER_FIELDS).annotate(category_id=F('product__category_id'))
+            }
+            current_parameters = defaultdict(dict)
+            for offer_id, parameter_id, value in ProductParameter.objects.filter(
+                product_info_id__in=[offer.id for offer in existing.values()]
+            ).values_list('product_info_id', 'parameter_id', 'value'):
+                current_parameters[offer_id][parameter_id] = value
+
+            new, changed, changed_parameters = [], [], []
+            for item, values, parameters in offers:
+                offer = existing.get(offer_key(item))
+                if offer is None:
+                    new.append((item, values, parameters))
+                    continue
+
+                offer_changed = any(getattr(offer, field) != value for field, value in values.items())
+                parameters_changed = current_parameters.get(offer.id, {}) != parameters
+                if offer_changed or parameters_changed:
+                    self.touched_categories.update((offer.category_id, item['category']))
+                if offer_changed:
+                    for field, value in values.items():
+                        setattr(offer, field, value)
+                    changed.append(offer)
+                if parameters_changed:
+                    changed_parameters.append((offer.id, parameters))
+                if not offer_changed and not parameters_changed:
+                    self.counts['unchanged'] += 1
+
+        if new:
+            self.create_offers(new)
+        with self.phase('offers'):
+            ProductInfo.objects.bulk_update(changed, OFFER_FIELDS)
+            self.counts['offers'] += len(offers) - len(new)
+            self.counts['updated'] += len(changed)
+        with self.phase('offer_parameters'):
+            if changed_parameters:
+                offer_ids = [offer_id for offer_id, _ in changed_parameters]
+                ProductParameter.objects.filter(product_info_id__in=offer_ids).delete()
+                ProductFacet.objects.filter(product_info_id__in=offer_ids).delete()
+                self.create_parameters(changed_parameters)
+            self.counts['parameters_updated'] += len(changed_parameters)
+
+    # Предложения, пропавшие из прайс-листа, удаляются; если на них ссылаются заказы,
+    # они остаются в базе с нулевым остатком, чтобы не терять историю заказов
+    def remove_stale_offers(self):
+        with self.phase('cleanup'):
+            stale = [
+                offer_id for offer_id, key in ProductInfo.objects.filter(shop_id=self.shop.id).values_list('id', 'external_id')
+                if key not in self.seen_keys
+            ]
+            for ids in chunked(stale, self.batch_size):
+                self.touched_categories.update(
+                    ProductInfo.objects.filter(id__in=ids).values_list('product__category_id', flat=True).distinct()
+                )
+                ordered = set(OrderItem.objects.filter(product_id__in=ids).values_list('product_id', flat=True))
+                self.counts['delisted'] += ProductInfo.objects.filter(id__in=ordered).exclude(quantity=0).update(quantity=0)
+                _, deleted = ProductInfo.objects.filter(id__in=set(ids) - ordered).delete()
+                self.counts['deleted'] += deleted.get(ProductInfo._meta.label, 0)
+
+    def add_error(self, item, message):
+        self.counts['skipped'] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'id': item.get('id') if isinstance(item, dict) else None, 'error': message})
+
+    # Позиции без обязательных полей, с некорректными значениями, неизвестной категорией
+    # или повторяющимся идентификатором пропускаются. Идентификатор пропущенной позиции
+    # всё равно считается встреченным, чтобы ошибка в прайс-листе не удаляла предложение
+    def validate_batch(self, batch):
+        valid = []
+        for item in batch:
+            key = offer_key(item) if isinstance(item, dict) else None
+            if key is not None:
+                if key in self.seen_keys:
+                    self.add_error(item, f'Повторяющийся идентификатор позиции: {key}')
+                    continue
+                self.seen_keys.add(key)
+
+            missing = [field for field in REQUIRED_ITEM_FIELDS if not isinstance(item, dict) or item.get(field) is None]
+            if missing:
+                self.add_error(item, f'Не указаны поля: {", ".join(missing)}')
+                continue
+            if not isinstance(item.get('parameters', {}), dict):
+                self.add_error(item, 'Параметры должны быть словарём')
+                continue
+
+            if key is None and self.mode == 'sync':
+                self.add_error(item, 'Не указан id или sku позиции')
+                continue
+
+            try:
+                item = dict(item, name=str(item['name']), **{
+                    field: ProductInfo._meta.get_field(field).to_python(item[field])
+                    for field in ('price', 'price_rrc', 'quantity')
+                })
+            except ValidationError as err:
+                self.add_error(item, '; '.join(err.messages))
+                continue
+
+            too_long = self.overlong_fields(item, key)
+            if too_long:
+                self.add_error(item, f'Превышена длина полей: {", ".join(too_long)}')
+                continue
+            valid.append(item)
+
+        unknown = {item['category'] for item in valid} - self.category_ids
+        if unknown:
+            self.category_ids.update(Category.objects.filter(id__in=unknown).values_list('id', flat=True))
+            unknown -= self.category_ids
+
+        batch = []
+        for item in valid:
+            if item['category'] in unknown:
+                self.add_error(item, f'Неизвестная категория: {item["category"]}')
+            else:
+                batch.append(item)
+        return batch
+
+    # Длины сверяются с колонками, куда попадут значения: иначе bulk_create упадёт с DataError
+    # и откатит весь импорт вместо пропуска одной позиции
+    def overlong_fields(self, item, key):
+        def max_length(model, field):
+            return model._meta.get_field(field).max_length
+
+        name_length = min(max_length(Product, 'name'), max_length(ProductInfo, 'name'))
+        too_long = []
+        if len(item['name']) > name_length:
+            too_long.append(f'name (не более {name_length})')
+        if key is not None and len(key) > max_length(ProductInfo, 'external_id'):
+            too_long.append(f'id/sku (не более {max_length(ProductInfo, "external_id")})')
+        for name, value in item.get('parameters', {}).items():
+            if len(str(name)) > max_length(Parameter, 'name'):
+                too_long.append(f'параметр {name} (не более {max_length(Parameter, "name")})')
+            elif len(str(value)) > max_length(ProductParameter, 'value'):
+                too_long.append(f'значение параметра {name} (не более {max_length(ProductParameter, "value")})')
+        return too_long
+
+    # Товары ищутся по паре (название, категория), недостающие создаются одним запросом,
+    # поисковый вектор заполняется только для созданных
+    def resolve_products(self, batch):
+        keys = {(item['name'], item['category']) for item in batch}
+        products = {}
+        existing = Product.objects.filter(
+            name__in={name for name, _ in keys},
+            category_id__in={category_id for _, category_id in keys}
+        ).values_list('name', 'category_id', 'id')
+        for name, category_id, product_id in existing:
+            if (name, category_id) in keys:
+                products.setdefault((name, category_id), product_id)
+
+        created = Product.objects.bulk_create(
+            [Product(name=name, category_id=category_id) for name, category_id in keys if (name, category_id) not in products]
+        )
+        for product in created:
+            products[(product.name, product.category_id)] = product.id
+        if created:
+            update_search_vectors([product.id for product in created])
+        self.counts['products_created'] += len(created)
+        return products
+
+    # Имена параметров кэшируются на всё время импорта
+    def resolve_parameters(self, batch):
+        names = {name for item in batch for name in item.get('parameters', {})} - self.parameters.keys()
+        if not names:
+            return
+        for parameter_id, name in Parameter.objects.filter(name__in=names).values_list('id', 'name'):
+            self.parameters.setdefault(name, parameter_id)
+
+        created = Parameter.objects.bulk_create(
+            [Parameter(name=name) for name in names if name not in self.parameters]
+        )
+        for parameter in created:
+            self.parameters[parameter.name] = parameter.id
+        self.counts['parameters_created'] += len(created)
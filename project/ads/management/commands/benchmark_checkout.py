@@ -0,0 +1,118 @@
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from cachalot.api import cachalot_disabled
+from ads.checkout import checkout, InsufficientStock
+from ads.models import User, Shop, Category, Product, ProductInfo, Order, OrderItem
+
+
+# Оформление с блокировкой всей таблицы остатков — для сравнения с построчным резервированием
+def checkout_table_lock(user_id, order_id):
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {ProductInfo._meta.db_table} IN SHARE ROW EXCLUSIVE MODE')
+        return checkout(user_id, order_id)
+
+
+# Оформление пачки корзин в отдельном процессе; все процессы стартуют одновременно в start_at
+def checkout_chunk(strategy, carts, start_at):
+    shortages = 0
+    time.sleep(max(start_at - time.time(), 0))
+    for user_id, order_id in carts:
+        try:
+            STRATEGIES[strategy](user_id, order_id)
+        except InsufficientStock:
+            shortages += 1
+    connections.close_all()
+    return time.time(), shortages
+
+
+STRATEGIES = {
+    'update': checkout,
+    'table-lock': checkout_table_lock,
+}
+
+
+# Пропускная способность оформления заказов при росте числа параллельных покупателей (процессов).
+# Данные создаются перед замерами и удаляются после, поэтому нужна отдельная база
+class Command(BaseCommand):
+    help = 'Замер пропускной способности оформления заказов при параллельных покупателях'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', default='1,2,4,8,16', help='Числа параллельных процессов через запятую')
+        parser.add_argument('--checkouts', type=int, default=50, help='Оформлений на один процесс')
+        parser.add_argument('--offers', type=int, default=20, help='Количество «горячих» предложений')
+        parser.add_argument('--items', type=int, default=3, help='Позиций в одном заказе')
+        parser.add_argument('--strategy', choices=[*STRATEGIES, 'all'], default='all')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Замер поддерживается только для PostgreSQL')
+        try:
+            worker_counts = [int(value) for value in options['workers'].split(',')]
+        except ValueError:
+            raise CommandError('--workers: ожидаются целые числа через запятую')
+
+        self.random = random.Random(options['seed'])
+        strategies = list(STRATEGIES) if options['strategy'] == 'all' else [options['strategy']]
+        with cachalot_disabled():
+            self.seed(options['offers'], max(worker_counts) * options['checkouts'])
+            try:
+                for strategy in strategies:
+                    self.stdout.write(self.style.MIGRATE_HEADING(f'=== {strategy} ==='))
+                    for workers in worker_counts:
+                        self.run(strategy, workers, options['checkouts'], options['items'])
+            finally:
+                self.cleanup()
+
+    def seed(self, offers_count, users_count):
+        self.shop = Shop.objects.create(name='Benchmark checkout')
+        self.category = Category.objects.create(name='Benchmark checkout')
+        products = Product.objects.bulk_create(
+            [Product(name=f'Товар {index}', category=self.category) for index in range(offers_count)]
+        )
+        self.offers = ProductInfo.objects.bulk_create([
+            ProductInfo(product=product, shop=self.shop, name=product.name, price=100, price_rrc=120, quantity=0)
+            for product in products
+        ])
+        self.users = User.objects.bulk_create(
+            [User(email=f'checkout-benchmark{index}@example.com', password='!') for index in range(users_count)]
+        )
+
+    def prepare(self, users, items):
+        # Остатков хватает на все заказы раунда: мерится конкуренция за строки, а не нехватка
+        ProductInfo.objects.filter(shop=self.shop).update(quantity=len(users) * items)
+        Order.objects.filter(user__in=users).delete()
+        carts = Order.objects.bulk_create([Order(user=user, status='cart') for user in users])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=cart, product=offer, shop=self.shop, quantity=1)
+            for cart in carts for offer in self.random.sample(self.offers, min(items, len(self.offers)))
+        ])
+        return carts
+
+    def run(self, strategy, workers, checkouts, items):
+        carts = self.prepare(self.users[:workers * checkouts], items)
+        chunks = [[(cart.user_id, cart.id) for cart in carts[index::workers]] for index in range(workers)]
+        # Дочерние процессы открывают собственные соединения с базой
+        connections.close_all()
+        start_at = time.time() + 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(checkout_chunk, [strategy] * workers, chunks, [start_at] * workers))
+        elapsed = max(result[0] for result in results) - start_at
+
+        done = Order.objects.filter(id__in=[cart.id for cart in carts], status='new').count()
+        shortages = sum(result[1] for result in results)
+        self.stdout.write(
+            f'процессов: {workers:>3}  оформлено: {done:>5}  нехватка: {shortages:>3}  '
+            f'{elapsed:.2f} c  {done / elapsed:.0f} заказов/с'
+        )
+
+    def cleanup(self):
+        Order.objects.filter(user__in=self.users).delete()
+        User.objects.filter(id__in=[user.id for user in self.users]).delete()
+        self.shop.delete()
+        Product.objects.filter(category=self.category).delete()
+        self.category.delete()
@@ -0,0 +1,100 @@
+import random
+import re
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from cachalot.api import cachalot_disabled
+from ads.models import User, Shop, Category, Product, ProductInfo, Order
+
+
+STATUSES = ('new', 'confirmed', 'assembled', 'sent', 'delivered', 'canceled')
+
+
+def execution_time(plan):
+    match = re.search(r'Execution Time: ([\d.]+) ms', plan)
+    return match.group(1) if match else '?'
+
+
+# Планы горячих запросов каталога и заказов до и после индексов из ads/models.py.
+# Данные создаются в транзакции, которая откатывается после замеров
+class Command(BaseCommand):
+    help = 'Сравнение планов запросов каталога и заказов без индексов и с индексами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--offers', type=int, default=100000, help='Количество предложений магазинов')
+        parser.add_argument('--orders', type=int, default=20000, help='Количество заказов')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Сравнение планов поддерживается только для PostgreSQL')
+
+        self.random = random.Random(options['seed'])
+        with cachalot_disabled(), transaction.atomic():
+            self.seed(options['offers'], options['orders'])
+            after = self.explain_all()
+            self.drop_indexes()
+            before = self.explain_all()
+            transaction.set_rollback(True)
+
+        for name in after:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'=== {name} ==='))
+            self.stdout.write(self.style.WARNING('До:'))
+            self.stdout.write(before[name])
+            self.stdout.write(self.style.SUCCESS('После:'))
+            self.stdout.write(after[name] + '\n')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('=== Время выполнения, мс ==='))
+        for name in after:
+            self.stdout.write(f'{name}: {execution_time(before[name])} -> {execution_time(after[name])}')
+
+    def seed(self, offers_count, orders_count):
+        users_count = max(orders_count // 10, 1)
+        users = User.objects.bulk_create(
+            [User(email=f'benchmark{index}@example.com', password='!') for index in range(users_count)]
+        )
+        shops = Shop.objects.bulk_create([Shop(name=f'Магазин {index}') for index in range(50)])
+        categories = Category.objects.bulk_create([Category(name=f'Категория {index}') for index in range(100)])
+        products = Product.objects.bulk_create([
+            Product(name=f'Товар {index}', category=self.random.choice(categories))
+            for index in range(max(offers_count // 2, 1))
+        ], batch_size=5000)
+        ProductInfo.objects.bulk_create([
+            ProductInfo(
+                product=product, shop=self.random.choice(shops), name=product.name,
+                price=100, price_rrc=120,
+                quantity=self.random.choice((0, 0, 0, self.random.randint(1, 100))),
+            ) for product in (self.random.choice(products) for _ in range(offers_count))
+        ], batch_size=5000)
+
+        orders = [Order(user=user, status='cart') for user in users]
+        orders += [
+            Order(user=self.random.choice(users), status=self.random.choice(STATUSES))
+            for _ in range(max(orders_count - users_count, 0))
+        ]
+        Order.objects.bulk_create(orders, batch_size=5000)
+
+        self.user = users[0]
+        self.shop = shops[0]
+        self.category = categories[0]
+        with connection.cursor() as cursor:
+            for model in (Product, ProductInfo, Order):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+    def queries(self):
+        in_stock = ProductInfo.objects.filter(quantity__gt=0).order_by('-name')
+        return {
+            'Каталог': in_stock[:20],
+            'Каталог магазина': in_stock.filter(shop_id=self.shop.id)[:20],
+            'Каталог категории': in_stock.filter(product__category_id=self.category.id)[:20],
+            'Корзина пользователя': Order.objects.filter(user_id=self.user.id, status='cart').order_by('-dt')[:1],
+            'Заказы пользователя': Order.objects.filter(user_id=self.user.id).exclude(status='cart').order_by('-dt'),
+        }
+
+    def explain_all(self):
+        return {name: queryset.explain(analyze=True) for name, queryset in self.queries().items()}
+
+    def drop_indexes(self):
+        with connection.schema_editor() as editor:
+            for model in (ProductInfo, Order):
+                for index in model._meta.indexes:
+                    editor.remove_index(model, index)
@@ -0,0 +1,47 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand
+from django.db import connections
+from ads.models import ProductImage
+
+
+# Создание вариантов для пачки изображений; ошибки отдельных файлов не прерывают пачку
+def generate_chunk(image_ids, force=False):
+    done, errors = 0, []
+    for image in ProductImage.objects.filter(pk__in=image_ids):
+        try:
+            image.generate_renditions(force=force)
+            done += 1
+        except Exception as ex:
+            errors.append((image.pk, str(ex)))
+    return done, errors
+
+
+# Досоздание вариантов для уже загруженных изображений в нескольких процессах
+class Command(BaseCommand):
+    help = 'Создание вариантов (миниатюры, WebP и т.д.) для существующих изображений товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Количество процессов')
+        parser.add_argument('--chunk-size', type=int, default=50, help='Изображений на одно задание процесса')
+        parser.add_argument('--force', action='store_true', help='Пересоздать уже существующие варианты')
+
+    def handle(self, *args, **options):
+        image_ids = list(ProductImage.objects.order_by('pk').values_list('pk', flat=True))
+        chunk_size = max(options['chunk_size'], 1)
+        chunks = [image_ids[start:start + chunk_size] for start in range(0, len(image_ids), chunk_size)]
+
+        if options['workers'] > 1 and len(chunks) > 1:
+            # Дочерние процессы открывают собственные соединения с базой
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+                futures = [executor.submit(generate_chunk, chunk, options['force']) for chunk in chunks]
+                results = [future.result() for future in as_completed(futures)]
+        else:
+            results = [generate_chunk(chunk, options['force']) for chunk in chunks]
+
+        done = sum(result[0] for result in results)
+        for result in results:
+            for image_id, error in result[1]:
+                self.stderr.write(f'Изображение {image_id}: {error}')
+        self.stdout.write(self.style.SUCCESS(f'Обработано изображений: {done} из {len(image_ids)}'))
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:19
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0003_alter_productimage_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('url', models.URLField(max_length=500, verbose_name='Ссылка на прайс-лист')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершён'), ('failed', 'Ошибка')], default='pending', max_length=20, verbose_name='Статус')),
+                ('phase', models.CharField(blank=True, max_length=40, verbose_name='Этап')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='Обработано позиций')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='Ошибки')),
+                ('stats', models.JSONField(blank=True, default=dict, verbose_name='Статистика')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Импорт каталога',
+                'verbose_name_plural': 'Импорт каталога',
+                'ordering': ('-created_at',),
+            },
+        ),
+    ]
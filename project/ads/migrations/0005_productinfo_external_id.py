@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0004_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='mode',
+            field=models.CharField(choices=[('sync', 'Синхронизация изменений'), ('replace', 'Полная замена')], default='sync', max_length=10, verbose_name='Режим'),
+        ),
+        migrations.AddField(
+            model_name='productinfo',
+            name='external_id',
+            field=models.CharField(blank=True, max_length=50, null=True, verbose_name='Внешний ИД'),
+        ),
+        migrations.AddConstraint(
+            model_name='productinfo',
+            constraint=models.UniqueConstraint(fields=('shop', 'external_id'), name='unique_shop_offer'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0005_productinfo_external_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='importjob',
+            name='status',
+            field=models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершён'), ('not_modified', 'Без изменений'), ('failed', 'Ошибка')], default='pending', max_length=20, verbose_name='Статус'),
+        ),
+        migrations.CreateModel(
+            name='ShopFeed',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=500, verbose_name='Ссылка на прайс-лист')),
+                ('etag', models.CharField(blank=True, max_length=255, verbose_name='ETag')),
+                ('last_modified', models.CharField(blank=True, max_length=64, verbose_name='Last-Modified')),
+                ('content_hash', models.CharField(blank=True, max_length=64, verbose_name='Хэш содержимого')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('shop', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='feed', to='ads.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Прайс-лист магазина',
+                'verbose_name_plural': 'Прайс-листы магазинов',
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:43
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import DatabaseError, migrations, transaction
+
+
+def fill_search_vectors(apps, schema_editor):
+    Product = apps.get_model('ads', 'Product')
+    Product.objects.using(schema_editor.connection.alias).update(search_vector=(
+        SearchVector('name', weight='A', config='russian')
+        + SearchVector('sku', weight='A', config='russian')
+        + SearchVector('description', weight='B', config='russian')
+    ))
+
+
+# Триграммный индекс для поиска с опечатками создаётся, только если доступно расширение pg_trgm
+def create_trigram_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        except DatabaseError:
+            return
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS product_name_trgm_idx ON ads_product USING gin (name gin_trgm_ops)'
+        )
+
+
+def drop_trigram_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS product_name_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0007_catalog_order_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_search_idx'),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
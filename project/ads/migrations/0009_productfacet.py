@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_facets(apps, schema_editor):
+    ProductParameter = apps.get_model('ads', 'ProductParameter')
+    ProductFacet = apps.get_model('ads', 'ProductFacet')
+    db = schema_editor.connection.alias
+    rows = ProductParameter.objects.using(db).values_list('product_info_id', 'parameter_id', 'parameter__name', 'value')
+    ProductFacet.objects.using(db).bulk_create((
+        ProductFacet(product_info_id=offer_id, parameter_id=parameter_id, name=name, value=value)
+        for offer_id, parameter_id, name, value in rows.iterator(chunk_size=5000)
+    ), batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0008_product_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=40, verbose_name='Название параметра')),
+                ('value', models.CharField(max_length=50, verbose_name='Значение')),
+                ('parameter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='ads.parameter', verbose_name='Параметр')),
+                ('product_info', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='ads.productinfo', verbose_name='Информация о продукте')),
+            ],
+            options={
+                'verbose_name': 'Фасет',
+                'verbose_name_plural': 'Индекс фасетов',
+                'indexes': [models.Index(fields=['name', 'value', 'product_info'], name='facet_lookup_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product_info', 'parameter'), name='unique_product_facet')],
+            },
+        ),
+        migrations.RunPython(fill_facets, migrations.RunPython.noop),
+    ]
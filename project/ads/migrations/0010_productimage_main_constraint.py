@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0009_productfacet'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='productimage',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='productimage',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_main', True)), fields=('product',), name='unique_main_product_image'),
+        ),
+    ]
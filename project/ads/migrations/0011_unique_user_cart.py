@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:24
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# Перед созданием ограничения лишние корзины объединяются с самой новой корзиной пользователя:
+# позиции переносятся, если такого товара в ней ещё нет, остальные удаляются вместе с корзинами
+def merge_duplicate_carts(apps, schema_editor):
+    Order = apps.get_model('ads', 'Order')
+    OrderItem = apps.get_model('ads', 'OrderItem')
+    db = schema_editor.connection.alias
+    carts = Order.objects.using(db).filter(status='cart')
+    duplicated = carts.values('user_id').annotate(carts=Count('id')).filter(carts__gt=1).values_list('user_id', flat=True)
+    for user_id in duplicated:
+        keep, *others = carts.filter(user_id=user_id).order_by('-dt', '-id').values_list('id', flat=True)
+        for other in others:
+            existing = OrderItem.objects.using(db).filter(order_id=keep).values('product_id')
+            OrderItem.objects.using(db).filter(order_id=other).exclude(product_id__in=existing).update(order_id=keep)
+        Order.objects.using(db).filter(id__in=others).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0010_productimage_main_constraint'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'cart')), fields=('user',), name='unique_user_cart'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-18 19:40
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+# Цены существующих позиций фиксируются по текущим ценам предложений, суммы заказов — по ним
+def fill_totals(apps, schema_editor):
+    Order = apps.get_model('ads', 'Order')
+    OrderItem = apps.get_model('ads', 'OrderItem')
+    ProductInfo = apps.get_model('ads', 'ProductInfo')
+    db = schema_editor.connection.alias
+    OrderItem.objects.using(db).update(
+        price=Subquery(ProductInfo.objects.filter(id=OuterRef('product_id')).values('price'))
+    )
+    totals = OrderItem.objects.filter(order_id=OuterRef('pk')).values('order_id').annotate(
+        total=Sum(F('quantity') * F('price'))
+    ).values('total')
+    Order.objects.using(db).update(total=Coalesce(Subquery(totals), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0011_unique_user_cart'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.PositiveIntegerField(default=0, verbose_name='Сумма заказа'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='price',
+            field=models.PositiveIntegerField(default=0, verbose_name='Цена'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
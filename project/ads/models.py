@@ -1,27 +1,18 @@
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django_rest_passwordreset.tokens import get_token_generator
 from imagekit.models import ImageSpecField, ProcessedImageField
 from imagekit.processors import ResizeToFill, ResizeToFit, SmartResize, Transpose
-from .imagekit_ import ProductThumbnail, ProductMedium, ProductLarge, ProductWebP, AdminThumbnail
+from .imagekit_ import ProductThumbnail, ProductMedium, ProductLarge, ProductWebP, AdminThumbnail, render_renditions, resolve_variant_urls
 from django.core.validators import FileExtensionValidator
-from PIL import Image
-from io import BytesIO
 from django.core.files.base import ContentFile
-
-def optimize_image(image_field, max_size=(1200, 1200), quality=85):
-    img = Image.open(image_field)
-    
-    if img.width > max_size[0] or img.height > max_size[1]:
-        img.thumbnail(max_size, Image.Resampling.LANCZOS)
-        
-    output = BytesIO()
-    img.save(output, format='JPEG', quality=quality, optimize=True)
-    output.seek(0)
-    
-    return ContentFile(output.read(), image_field.name)
+from django.db.models.fields.files import ImageFieldFile
+from .images import IMAGE_EXTENSIONS, process_image, jpeg_name
+import uuid
 
 STATE_CHOICES = (
     ('cart', 'Корзина'),
@@ -40,6 +31,19 @@ USER_TYPE_CHOICES = (
     ('buyer', 'Покупатель'),
 )
 
+IMPORT_STATUS_CHOICES = (
+    ('pending', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('done', 'Завершён'),
+    ('not_modified', 'Без изменений'),
+    ('failed', 'Ошибка'),
+)
+
+IMPORT_MODE_CHOICES = (
+    ('sync', 'Синхронизация изменений'),
+    ('replace', 'Полная замена'),
+)
+
 CONTACT_TYPE = [
     ('phone', 'телефон'),
     ('email', 'email'),
@@ -107,6 +111,34 @@ class Shop(models.Model):
     def __str__(self):
         return self.name
 
+# Последний успешно импортированный прайс-лист магазина
+class ShopFeed(models.Model):
+    shop = models.OneToOneField(Shop, verbose_name='Магазин', related_name='feed', on_delete=models.CASCADE)
+    url = models.URLField(verbose_name='Ссылка на прайс-лист', max_length=500)
+    etag = models.CharField(verbose_name='ETag', max_length=255, blank=True)
+    last_modified = models.CharField(verbose_name='Last-Modified', max_length=64, blank=True)
+    content_hash = models.CharField(verbose_name='Хэш содержимого', max_length=64, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        verbose_name = 'Прайс-лист магазина'
+        verbose_name_plural = 'Прайс-листы магазинов'
+
+    def __str__(self):
+        return f'{self.shop}: {self.url}'
+
+    # Заголовки условного запроса, если ссылка совпадает с последней загруженной
+    def conditional_headers(self, url):
+        headers = {}
+        if url != self.url:
+            return headers
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
 class ConfirmEmailToken(models.Model):
     user = models.ForeignKey(User, related_name='confirm_email_tokens', on_delete=models.CASCADE, verbose_name=('Пользователь'))
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=('Дата создания'))
@@ -151,7 +183,7 @@ class ProductImage(models.Model):
         format='JPEG',
         options={'quality': 85},
         verbose_name='Оригинальное изображение',
-        validators=[FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png', 'webp'])]
+        validators=[FileExtensionValidator(allowed_extensions=IMAGE_EXTENSIONS)]
     )
     is_main = models.BooleanField(default=False, verbose_name='Гдавное изображение')
     alt_text = models.CharField(max_length=255, blank=True, verbose_name='Описание изображения')
@@ -202,7 +234,10 @@ class ProductImage(models.Model):
         verbose_name = 'Изображение товара'
         verbose_name_plural = 'Изображение товара'
         ordering = ['order', 'created_at']
-        unique_together = ['product', 'is_main']
+        # Главное изображение у товара одно, остальных может быть сколько угодно
+        constraints = [
+            models.UniqueConstraint(fields=['product'], condition=models.Q(is_main=True), name='unique_main_product_image')
+        ]
         
     def __str__(self):
         return f"Изображение для {self.product.name}"
@@ -214,44 +249,63 @@ class ProductImage(models.Model):
                 is_main=True
             ).exclude(pk=self.pk).update(is_main=False)
         
-        if self.image and not self.pk:
-            optimized_image = optimize_image(self.image)
-            self.image.save(self.image.name, optimized_image, save=False)
+        if self.image and not self.image._committed:
+            self.image.seek(0)
+            self.store_image(self.image.name, process_image(self.image.read()))
         
         super().save(*args, **kwargs)
         
+    # Сохранение уже подготовленного JPEG (ads.images.process_image) в хранилище
+    # минуя повторную обработку ProcessedImageField
+    def store_image(self, name, content):
+        ImageFieldFile.save(self.image, jpeg_name(name), ContentFile(content), save=False)
+
+    # Варианты, создаваемые фоновой задачей после сохранения изображения
+    RENDITIONS = (
+        'thumbnail', 'medium', 'large', 'web_optimized', 'admin_thumbnail', 'catalog_preview', 'mobile_optimized'
+    )
+
+    def generate_renditions(self, force=False):
+        render_renditions([getattr(self, name) for name in self.RENDITIONS], force=force)
+
     def get_absolute_url(self):
         from django.urls import reverse
         return reverse('product-image-detail', kwargs={'pk': self.pk})
     
     def get_all_variants(self):
-        return {
-            'original': self.image.url,
-            'thumbnail': self.thumbnail.url if hasattr(self.thumbnail, 'url') else None,
-            'medium': self.medium.url if hasattr(self.medium, 'url') else None,
-            'large': self.large.url if hasattr(self.large, 'url') else None,
-            'web_optimized': self.web_optimized.url if hasattr(self.web_optimized, 'url') else None,
-            'admin_thumbnail': self.admin_thumbnail.url if hasattr(self.admin_thumbnail, 'url') else None,
-            'catalog_preview': self.catalog_preview.url if hasattr(self.catalog_preview, 'url') else None,
-            'mobile_optimized': self.mobile_optimized.url if hasattr(self.mobile_optimized, 'url') else None,
-        }        
-    
+        return resolve_variant_urls([self], self.RENDITIONS).get(self.pk)
+
 # Основная информация о товаре
 class Product(models.Model):
     name = models.CharField(max_length=100, verbose_name='Название продукта')
     category = models.ForeignKey(Category, verbose_name='Категория', related_name='products', blank=True, on_delete=models.CASCADE)
     description = models.TextField(blank=True, verbose_name='Описание')
     sku = models.CharField(max_length=50, unique=True, blank=True, null=True, verbose_name='Артикул')
+    search_vector = SearchVectorField(null=True, editable=False)
     
     class Meta:
         verbose_name = 'Продукт'
         verbose_name_plural = 'Список продуктов'
         ordering = ('-name',)
+        indexes = [
+            GinIndex(fields=['search_vector'], name='product_search_idx'),
+        ]
         
     def __str__(self):
         return self.name
     
+    # Поисковый вектор пересчитывается, если изменились название, артикул или описание
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'name', 'sku', 'description'} & set(update_fields):
+            from ads.search import update_search_vectors
+            update_search_vectors([self.pk])
+    
+    # При загруженных через prefetch_related изображениях дополнительный запрос не выполняется
     def get_main_image(self):
+        if 'images' in getattr(self, '_prefetched_objects_cache', {}):
+            return next((image for image in self.images.all() if image.is_main), None)
         return self.images.filter(is_main=True).first()
 
     def get_image_url(self, size='medium'):
@@ -270,6 +324,7 @@ class Product(models.Model):
 # Конкретные данные товара в магазине (цена, количество) 
 class ProductInfo(models.Model):
     name = models.CharField(max_length=100, verbose_name='Название', blank=True)
+    external_id = models.CharField(max_length=50, verbose_name='Внешний ИД', blank=True, null=True)
     product = models.ForeignKey(Product, verbose_name='Продукт', related_name='product_infos', blank=True, on_delete=models.CASCADE)
     shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='product_infos', blank=True, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(verbose_name='Количество')
@@ -280,6 +335,14 @@ class ProductInfo(models.Model):
         verbose_name = 'Имя продукта'
         verbose_name_plural = 'Список параметров продукта'
         ordering = ('-name',)
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'external_id'], name='unique_shop_offer')
+        ]
+        # Каталог показывает только товары в наличии, отсортированные по названию
+        indexes = [
+            models.Index(fields=['-name'], condition=models.Q(quantity__gt=0), name='productinfo_in_stock_idx'),
+            models.Index(fields=['shop', '-name'], condition=models.Q(quantity__gt=0), name='productinfo_shop_in_stock_idx'),
+        ]
         
     def __str__(self):
         return self.name
@@ -296,6 +359,10 @@ class Parameter(models.Model):
     def __str__(self):
         return self.name
     
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.facets.exclude(name=self.name).update(name=self.name)
+    
     
 class ProductParameter(models.Model):
     product_info = models.ForeignKey(ProductInfo, verbose_name='Информация о продукте', related_name='product_parameters', blank=True, on_delete=models.CASCADE)
@@ -310,17 +377,51 @@ class ProductParameter(models.Model):
         ]
     def __str__(self):
         return f'{self.product_info}:{self.parameter.name}'
+
+
+# Денормализованный индекс параметров для фильтрации каталога и подсчёта фасетов:
+# название параметра хранится рядом со значением, чтобы не соединять таблицы при каждом фильтре
+class ProductFacet(models.Model):
+    product_info = models.ForeignKey(ProductInfo, verbose_name='Информация о продукте', related_name='facets', on_delete=models.CASCADE)
+    parameter = models.ForeignKey(Parameter, verbose_name='Параметр', related_name='facets', on_delete=models.CASCADE)
+    name = models.CharField(verbose_name='Название параметра', max_length=40)
+    value = models.CharField(verbose_name='Значение', max_length=50)
+    
+    class Meta:
+        verbose_name = 'Фасет'
+        verbose_name_plural = 'Индекс фасетов'
+        constraints = [
+            models.UniqueConstraint(fields=['product_info', 'parameter'], name='unique_product_facet')
+        ]
+        indexes = [
+            models.Index(fields=['name', 'value', 'product_info'], name='facet_lookup_idx'),
+        ]
+        
+    def __str__(self):
+        return f'{self.name}: {self.value}'
     
 # Заказы пользователей    
 class Order(models.Model):
     user = models.ForeignKey(User, verbose_name='Пользователь', related_name='orders', blank=True, on_delete=models.CASCADE)
     dt = models.DateTimeField(auto_now_add=True)
     status = models.CharField(verbose_name='Статус', choices=STATE_CHOICES, max_length=20)
+    # Сумма по зафиксированным ценам позиций; пересчитывается при изменении корзины и при оформлении
+    total = models.PositiveIntegerField(verbose_name='Сумма заказа', default=0)
     
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Список заказов'
         ordering = ('-dt',)
+        # Корзина и заказы пользователя ищутся по паре (пользователь, статус)
+        indexes = [
+            models.Index(fields=['user', 'status', '-dt'], name='order_user_status_idx'),
+            # История заказов с фильтром по периоду: диапазон по дате внутри заказов пользователя
+            models.Index(fields=['user', 'dt'], name='order_user_dt_idx'),
+        ]
+        # Корзина у пользователя одна: параллельные get_or_create не создают дубликатов
+        constraints = [
+            models.UniqueConstraint(fields=['user'], condition=models.Q(status='cart'), name='unique_user_cart'),
+        ]
         
     def __str__(self):
         return f'{self.user}: {self.dt}'
@@ -332,6 +433,8 @@ class OrderItem(models.Model):
     product = models.ForeignKey(ProductInfo, verbose_name='Информация о продукте', related_name='order_items', blank=True, on_delete=models.CASCADE)
     shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='order_item', blank=True, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(verbose_name='Кол-во')
+    # Цена предложения на момент добавления в корзину, при оформлении обновляется до текущей
+    price = models.PositiveIntegerField(verbose_name='Цена', default=0)
     
     class Meta:
         verbose_name = 'Заказанная позиция'
@@ -427,3 +530,26 @@ class Contact(models.Model):
         
         super().save(*args, **kwargs)
         
+
+
+# Задания фонового импорта каталога магазина
+class ImportJob(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='import_jobs', on_delete=models.CASCADE)
+    url = models.URLField(verbose_name='Ссылка на прайс-лист', max_length=500)
+    status = models.CharField(verbose_name='Статус', choices=IMPORT_STATUS_CHOICES, max_length=20, default='pending')
+    phase = models.CharField(verbose_name='Этап', max_length=40, blank=True)
+    mode = models.CharField(verbose_name='Режим', choices=IMPORT_MODE_CHOICES, max_length=10, default='sync')
+    processed = models.PositiveIntegerField(verbose_name='Обработано позиций', default=0)
+    errors = models.JSONField(verbose_name='Ошибки', default=list, blank=True)
+    stats = models.JSONField(verbose_name='Статистика', default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        verbose_name = 'Импорт каталога'
+        verbose_name_plural = 'Импорт каталога'
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f'{self.user}: {self.get_status_display()}'
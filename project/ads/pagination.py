@@ -0,0 +1,35 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+PAGINATION_QUERY_PARAM = 'pagination'
+
+
+# Постраничный вывод по курсору: следующая страница выбирается условием по первичному ключу,
+# поэтому время запроса не зависит от глубины страницы, а общее количество не считается
+class IdCursorPagination(CursorPagination):
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+# Постраничный вывод по номеру с размером страницы от клиента (?page_size=, не больше max_page_size)
+class SizedPageNumberPagination(PageNumberPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+# Режим включается параметром ?pagination=cursor, ссылки next/previous уже содержат курсор
+def cursor_pagination_requested(request):
+    return (request.query_params.get(PAGINATION_QUERY_PARAM) == 'cursor'
+            or IdCursorPagination.cursor_query_param in request.query_params)
+
+
+# Для ListAPIView: по запросу клиента постраничный вывод по номеру заменяется курсором
+class OptionalCursorPaginationMixin:
+    cursor_pagination_class = IdCursorPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.cursor_pagination_class and cursor_pagination_requested(self.request):
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
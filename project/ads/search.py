@@ -0,0 +1,49 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db import connections
+from django.db.models import F
+
+
+SEARCH_CONFIG = 'russian'
+
+_trigram_available = {}
+
+
+# Название и артикул весят больше описания
+def product_search_vector():
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('sku', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='B', config=SEARCH_CONFIG)
+    )
+
+
+# Пересчёт поискового вектора одним UPDATE, без загрузки товаров в память
+def update_search_vectors(product_ids=None):
+    from ads.models import Product
+
+    queryset = Product.objects.all() if product_ids is None else Product.objects.filter(id__in=product_ids)
+    return queryset.update(search_vector=product_search_vector())
+
+
+# Расширение pg_trgm может быть не установлено, тогда поиск с опечатками отключается
+def trigram_available(using='default'):
+    if using not in _trigram_available:
+        with connections[using].cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            _trigram_available[using] = cursor.fetchone() is not None
+    return _trigram_available[using]
+
+
+# Полнотекстовый поиск предложений по товару с ранжированием.
+# Если ничего не найдено, ищутся похожие названия по триграммам
+def search_offers(queryset, text):
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+    found = queryset.filter(product__search_vector=query).annotate(
+        rank=SearchRank(F('product__search_vector'), query)
+    ).order_by('-rank', '-id')
+    if found.exists() or not trigram_available(queryset.db):
+        return found
+
+    return queryset.filter(product__name__trigram_word_similar=text).annotate(
+        similarity=TrigramWordSimilarity(text, 'product__name')
+    ).order_by('-similarity', '-id')
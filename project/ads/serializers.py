@@ -1,6 +1,9 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
-from ads.models import Category, Shop, Product, ProductInfo, User, OrderItem, Order, ProductParameter, Contact, ProductImage
+from ads.models import Category, Shop, Product, ProductInfo, User, OrderItem, Order, ProductParameter, Contact, ProductImage, ImportJob
+from ads.imagekit_ import resolve_variant_urls
+from ads.images import responsive_image_url
+from django.db import models
 from social_django.models import UserSocialAuth
 
 class SocialAuthSer(serializers.Serializer):
@@ -99,6 +102,14 @@ class ShopSer(serializers.ModelSerializer):
         model = Shop
         fields = ['id', 'name', 'state']
 
+# Состояние фонового импорта каталога
+class ImportJobSer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ImportJob
+        fields = ['id', 'url', 'mode', 'status', 'phase', 'processed', 'errors', 'stats', 'created_at', 'updated_at']
+        read_only_fields = fields
+
 # Список категорий для навигации
 class CategorySer(serializers.ModelSerializer):
     
@@ -106,12 +117,35 @@ class CategorySer(serializers.ModelSerializer):
         model = Category
         fields = ['id', 'name']
 
+# Адреса вариантов изображений кэшируются в контексте сериализатора: список заполняет их
+# для всей страницы одним вызовом resolve_variant_urls, вложенные сериализаторы только читают
+def resolve_page_variants(context, images):
+    urls = context.setdefault('variant_urls', {})
+    missing = [image for image in images if image.pk not in urls]
+    if missing:
+        urls.update(resolve_variant_urls(missing, ProductImage.RENDITIONS))
+    return urls
+
+
+def variant_urls(context, image):
+    return resolve_page_variants(context, [image]).get(image.pk, {})
+
+
+class VariantUrlsListSer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        resolve_page_variants(self.context, [image for item in items for image in self.child.variant_images(item)])
+        return super().to_representation(items)
+
+
 class ProductImageSer(serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
     thumbnail_url = serializers.SerializerMethodField()
     medium_url = serializers.SerializerMethodField()
     large_url = serializers.SerializerMethodField()
-    web_url = serializers.SerializerMethodField()
+    web_optimized_url = serializers.SerializerMethodField()
+    responsive_url = serializers.SerializerMethodField()
     
     all_variants = serializers.SerializerMethodField()
     
@@ -120,29 +154,36 @@ class ProductImageSer(serializers.ModelSerializer):
         fields = [
             'id', 'product', 'image', 'image_url',
             'thumbnail_url', 'medium_url', 'large_url', 
-            'web_optimized_url', 'all_variants',
+            'web_optimized_url', 'responsive_url', 'all_variants',
             'is_main', 'alt_text', 'order',
-            'created_at', 'updated_at'
+            'created_at', 'update_at'
         ]
-        read_only_fields = ('created_at', 'updated_at')
-        
+        read_only_fields = ('created_at', 'update_at')
+        list_serializer_class = VariantUrlsListSer
+
+    def variant_images(self, obj):
+        return [obj]
+
     def get_image_url(self, obj):
-        return obj.image.url if obj.image else None
+        return variant_urls(self.context, obj).get('original')
     
     def get_thumbnail_url(self, obj):
-        return obj.thumbnail.url if hasattr(obj.thumbnail, 'url') else None
+        return variant_urls(self.context, obj).get('thumbnail')
     
     def get_medium_url(self, obj):
-        return obj.medium.url if hasattr(obj.medium, 'url') else None
+        return variant_urls(self.context, obj).get('medium')
     
     def get_large_url(self, obj):
-        return obj.large.url if hasattr(obj.large, 'url') else None
+        return variant_urls(self.context, obj).get('large')
     
     def get_web_optimized_url(self, obj):
-        return obj.web_optimized.url if hasattr(obj.web_optimized, 'url') else None
+        return variant_urls(self.context, obj).get('web_optimized')
     
+    def get_responsive_url(self, obj):
+        return responsive_image_url(obj) if obj.image else None
+
     def get_all_variants(self, obj):
-        return obj.get_all_variants()
+        return variant_urls(self.context, obj) or None
     
     def validate(self, data):
         if data.get('is_main', False):
@@ -162,20 +203,28 @@ class ProductImageSer(serializers.ModelSerializer):
 # Отображение товара с категорией
 class ProductSer(serializers.ModelSerializer):
     category = serializers.StringRelatedField()
+    main_image_url = serializers.SerializerMethodField()
+    thumbnail_url = serializers.SerializerMethodField()
+    main_image_responsive_url = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
         fields = [
             'id', 'name', 'category', 'description', 'sku',
-            'images', 'main_image_url', 'thumbnail_url'
+            'images', 'main_image_url', 'thumbnail_url', 'main_image_responsive_url'
         ]
     def get_main_image_url(self, obj):
         image = obj.get_main_image()
-        return image.medium.url if image else None
+        return variant_urls(self.context, image).get('medium') if image else None
     
     def get_thumbnail_url(self, obj):
         image = obj.get_main_image()
-        return image.thumbnail.url if image else None
+        return variant_urls(self.context, image).get('thumbnail') if image else None
+
+    # Адрес с выбором формата и ширины (?w=), см. ResponsiveImageView
+    def get_main_image_responsive_url(self, obj):
+        image = obj.get_main_image()
+        return responsive_image_url(image) if image and image.image else None
 
 # Параметры товара        
 class ProductParameterSer(serializers.ModelSerializer):
@@ -186,7 +235,8 @@ class ProductParameterSer(serializers.ModelSerializer):
         fields = ['parameter', 'value']
 
 
-# Детальная информация о товаре с ценами и параметрами
+# Детальная информация о товаре с ценами и параметрами.
+# Изображения и параметры берутся из prefetch_related, см. ProductInfoView
 class ProductInfoSer(serializers.ModelSerializer):
     images = serializers.SerializerMethodField()
     main_image = serializers.SerializerMethodField()
@@ -194,38 +244,43 @@ class ProductInfoSer(serializers.ModelSerializer):
     product = ProductSer(read_only=True)
     parameters = ProductParameterSer(read_only=True, many=True, source='product_parameters')
     shop = ShopSer(read_only=True)
-    images = serializers.SerializerMethodField()
     
     class Meta:
         model = ProductInfo
-        fields = ['id', 'product', 'shop', 'price', 'price_rrc', 'quantity', 'parameters', 'imeges']
-        
+        fields = ['id', 'product', 'shop', 'price', 'price_rrc', 'quantity', 'parameters', 'images', 'main_image']
+        list_serializer_class = VariantUrlsListSer
+
+    def variant_images(self, obj):
+        return obj.product.images.all()
+
+    # Контекст с адресами вариантов передаётся без request, чтобы image остался относительным адресом
     def get_images(self, obj):
-        images = obj.product.images.all().order_by('order', '-is_main')
-        return ProductImageSer(obj.product.images.all(), many=True).data
+        context = {'variant_urls': resolve_page_variants(self.context, obj.product.images.all())}
+        return ProductImageSer(obj.product.images.all(), many=True, context=context).data
     
     def get_main_image(self, obj):
-        main_image = obj.product.images.filter(is_main=True).first()
+        main_image = obj.product.get_main_image()
         if main_image:
+            urls = variant_urls(self.context, main_image)
             return {
-                'thumbnail': main_image.thumbnail.url if hasattr(main_image.thumbnail, 'url') else None,
-                'medium': main_image.medium.url if hasattr(main_image.medium, 'url') else None,
-                'large': main_image.large.url if hasattr(main_image.large, 'url') else None,
+                'thumbnail': urls.get('thumbnail'),
+                'medium': urls.get('medium'),
+                'large': urls.get('large'),
             }
         return None
 
 # Товар в корзине/заказе с расчетом стоимости        
 class OrderItemSer(serializers.ModelSerializer):
-    product_info = ProductInfoSer(read_only=True)
+    product_info = ProductInfoSer(read_only=True, source='product')
     total_price = serializers.SerializerMethodField()
     
     
     class Meta:
         model = OrderItem
-        fields = ['id', 'product_info', 'quantity', 'total_price']
+        fields = ['id', 'product_info', 'quantity', 'price', 'total_price']
     
     def get_total_price(self, obj):
-        return obj.quantity * obj.product_info.price
+        return obj.quantity * obj.price
     
 # Для операций создания/обновления
 class OrderItemCreateSer(OrderItemSer):
@@ -233,10 +288,10 @@ class OrderItemCreateSer(OrderItemSer):
     
     class Meta:
         model = OrderItem
-        fields = ['id', 'product_info', 'quantity', 'total_price']
+        fields = ['id', 'product_info', 'quantity', 'price', 'total_price']
         
     def get_total_price(self, obj):
-        return obj.quantity * obj.product_info.price
+        return obj.quantity * obj.price
 
 
 # Детали заказа с товарами и общей суммой    
@@ -244,11 +299,69 @@ class OrderSer(serializers.ModelSerializer):
     order_items = OrderItemCreateSer(read_only=True, many=True)
     
     total_sum = serializers.SerializerMethodField()
-    contact = ContactSer(read_only=True)
 
     class Meta:
         model = Order
-        fields = ['id', 'order_items', 'status', 'dt', 'total_sum', 'contact']
+        fields = ['id', 'order_items', 'status', 'dt', 'total_sum']
         
+    # Аннотированная во view сумма (например, по позициям одного магазина) или сохранённая сумма заказа
     def get_total_sum(self, obj):
-        return sum(item.quantity*item.product_info.price for item in obj.order_items.all())
+        total_sum = getattr(obj, 'total_sum', None)
+        return obj.total if total_sum is None else total_sum
+
+
+# Позиция в истории заказов: без вложенного каталога, цена — зафиксированная при оформлении
+class OrderHistoryItemSer(serializers.ModelSerializer):
+    name = serializers.CharField(source='product.name', read_only=True)
+    shop = ShopSer(read_only=True)
+    total_price = serializers.SerializerMethodField()
+
+    class Meta:
+        model = OrderItem
+        fields = ['id', 'product', 'name', 'shop', 'quantity', 'price', 'total_price']
+
+    # Поля выбираются при первом обращении, когда вложенный сериализатор уже получил контекст
+    def get_fields(self):
+        fields = super().get_fields()
+        if 'shop' not in self.context.get('embed', ()):
+            fields.pop('shop')
+        return fields
+
+    def get_total_price(self, obj):
+        return obj.quantity * obj.price
+
+
+# История заказов: позиции, магазины и итоги добавляются по ?embed=items,shop,totals.
+# Позиции и магазины берутся из prefetch_related, итоги — из аннотаций запроса
+class OrderHistorySer(serializers.ModelSerializer):
+    total_sum = serializers.IntegerField(source='total', read_only=True)
+    order_items = OrderHistoryItemSer(many=True, read_only=True)
+    shops = serializers.SerializerMethodField()
+    items_count = serializers.IntegerField(read_only=True)
+    total_quantity = serializers.IntegerField(read_only=True)
+
+    EMBED_FIELDS = {
+        'items': ['order_items'],
+        'shop': ['shops'],
+        'totals': ['items_count', 'total_quantity'],
+    }
+
+    class Meta:
+        model = Order
+        fields = ['id', 'status', 'dt', 'total_sum', 'order_items', 'shops', 'items_count', 'total_quantity']
+
+    def get_fields(self):
+        fields = super().get_fields()
+        embed = self.context.get('embed', ())
+        for name, names in self.EMBED_FIELDS.items():
+            if name not in embed:
+                for field in names:
+                    fields.pop(field)
+        # Магазины заказа показываются списком, если позиции не встраиваются
+        if 'items' in embed:
+            fields.pop('shops', None)
+        return fields
+
+    def get_shops(self, obj):
+        shops = {item.shop_id: item.shop for item in obj.order_items.all()}
+        return ShopSer(shops.values(), many=True).data
@@ -1,9 +1,12 @@
 from project.celery import Celery
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives, send_mail
-from .models import Order
+from .models import Order, ImportJob, ShopFeed, ProductImage
+from .importer import CatalogImporter
+from .feeds import download_feed, read_feed
 from celery import shared_task
 from celery import shared_task
+import tempfile
 import sentry_sdk
 
 # Функция отправки писем
@@ -73,4 +76,65 @@ def send_invoice_admin(order_id):
         return f"Invoice sent to admin for order #{order_id}"
     except Exception as ex:
         sentry_sdk.capture_exception(ex)
-        return f"Failed to send invoice: {str(ex)}"
\ No newline at end of file
+        return f"Failed to send invoice: {str(ex)}"
+
+
+# Фоновый импорт прайс-листа магазина
+@shared_task(bind=True)
+def import_catalog(self, job_id):
+    try:
+        job = ImportJob.objects.select_related('user').get(id=job_id)
+    except ImportJob.DoesNotExist:
+        sentry_sdk.capture_message(f"Import job {job_id} not found")
+        return f"Import job {job_id} not found"
+
+    # Импорт идёт в одной транзакции, поэтому ход выполнения пишется в result backend Celery
+    def progress(phase, processed):
+        if not self.request.is_eager:
+            self.update_state(state='PROGRESS', meta={'phase': phase, 'processed': processed})
+
+    # Полная замена каталога выполняется всегда, синхронизация пропускается для неизменённого прайс-листа
+    feed = ShopFeed.objects.filter(shop__user_id=job.user_id).first() if job.mode == 'sync' else None
+    
+    ImportJob.objects.filter(id=job.id).update(status='running', phase='download')
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=settings.CATALOG_FEED_SPOOL_SIZE) as spool:
+            response, content_hash = download_feed(job.url, spool, headers=feed.conditional_headers(job.url) if feed else None)
+            if feed and (response.status_code == 304 or feed.content_hash == content_hash):
+                job.status = 'not_modified'
+                job.phase = 'done'
+                job.save(update_fields=['status', 'phase', 'updated_at'])
+                return f"Import job {job_id}: feed not modified"
+            
+            entries = read_feed(spool, job.url, response.headers.get('Content-Type', ''))
+            importer = CatalogImporter(job.user, progress=progress, mode=job.mode)
+            stats = importer.run_stream(entries)
+        
+        ShopFeed.objects.update_or_create(shop=importer.shop, defaults={
+            'url': job.url,
+            'etag': response.headers.get('ETag', ''),
+            'last_modified': response.headers.get('Last-Modified', ''),
+            'content_hash': content_hash,
+        })
+    except Exception as ex:
+        sentry_sdk.capture_exception(ex)
+        job.status = 'failed'
+        job.errors = [{'error': str(ex)}]
+        job.save(update_fields=['status', 'errors', 'updated_at'])
+        return f"Import job {job_id} failed: {str(ex)}"
+
+    job.status = 'done'
+    job.phase = 'done'
+    job.processed = stats['counts'].get('goods', 0)
+    job.errors = stats['errors']
+    job.stats = stats
+    job.save(update_fields=['status', 'phase', 'processed', 'errors', 'stats', 'updated_at'])
+    return stats
+
+
+# Создание вариантов изображения товара после его сохранения
+@shared_task(ignore_result=True)
+def generate_image_renditions(image_id, force=False):
+    image = ProductImage.objects.filter(pk=image_id).first()
+    if image is not None:
+        image.generate_renditions(force=force)
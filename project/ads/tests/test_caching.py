@@ -0,0 +1,289 @@
+import hashlib
+import json
+import threading
+from unittest.mock import patch
+import time
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase, APIRequestFactory
+from ads.caching import LOCK_TIMEOUT, make_key, get_or_set, cache_query, bump_generation, CachedQuerySet
+from ads.importer import CatalogImporter
+from ads.models import User, Shop, Category, Product, ProductImage
+from ads.tests.test_catalog import MEDIA_ROOT, make_image
+from ads.views import CategoryView, ProductInfoView
+
+
+calls = []
+
+
+@cache_query(models=[Category])
+def category_names(prefix):
+    calls.append(prefix)
+    return sorted(Category.objects.filter(name__startswith=prefix).values_list('name', flat=True))
+
+
+class QueryCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        calls.clear()
+
+    def test_make_key_is_stable(self):
+        category = Category.objects.create(name='Ноутбуки')
+        same = Category.objects.get(pk=category.pk)
+
+        self.assertEqual(make_key('test', category, a=1, b=[1, 2]), make_key('test', same, b=[1, 2], a=1))
+        self.assertEqual(
+            make_key('test', Category.objects.filter(name='x')),
+            make_key('test', Category.objects.filter(name='x'))
+        )
+        self.assertNotEqual(
+            make_key('test', Category.objects.filter(name='x')),
+            make_key('test', Category.objects.filter(name='y'))
+        )
+
+    def test_cache_query_is_invalidated_on_save_and_delete(self):
+        category = Category.objects.create(name='Ноутбуки')
+        self.assertEqual(category_names('Н'), ['Ноутбуки'])
+        self.assertEqual(category_names('Н'), ['Ноутбуки'])
+        self.assertEqual(len(calls), 1)
+
+        category.name = 'Нетбуки'
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+        self.assertEqual(category_names('Н'), ['Нетбуки'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            category.delete()
+        self.assertEqual(category_names('Н'), [])
+        self.assertEqual(len(calls), 3)
+
+    def test_cached_queryset(self):
+        Category.objects.create(name='Ноутбуки')
+        queryset = CachedQuerySet(model=Category).filter(name='Ноутбуки')
+        self.assertEqual(len(queryset.get_from_cache()), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Ноутбуки')
+        self.assertEqual(len(CachedQuerySet(model=Category).filter(name='Ноутбуки').get_from_cache()), 2)
+
+    def test_concurrent_misses_are_computed_once(self):
+        computed = []
+
+        def compute():
+            computed.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(get_or_set('dogpile', compute))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(len(computed), 1)
+
+    def test_waiters_do_not_sleep_when_result_is_not_cached(self):
+        computed = []
+
+        def compute():
+            computed.append(1)
+            time.sleep(0.2)
+            return 'error'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(get_or_set('uncached', compute, should_cache=lambda value: False)))
+            for _ in range(5)
+        ]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['error'] * 5)
+        self.assertEqual(len(computed), 5)
+        self.assertLess(time.monotonic() - started, LOCK_TIMEOUT / 2)
+
+
+class ResponseCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        Category.objects.create(name='Смартфоны')
+
+    def list_categories(self, **headers):
+        request = APIRequestFactory().get(reverse('categories'), headers=headers)
+        with CaptureQueriesContext(connection) as context:
+            response = CategoryView.as_view()(request)
+        return response, len(context.captured_queries)
+
+    def test_category_list_is_served_from_cache(self):
+        response, queries = self.list_categories()
+        self.assertGreater(queries, 0)
+        self.assertEqual([item['name'] for item in json.loads(response.content)['results']], ['Смартфоны'])
+
+        cached, queries = self.list_categories()
+        self.assertEqual(queries, 0)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Аксессуары')
+        response, _ = self.list_categories()
+        self.assertEqual(json.loads(response.content)['count'], 2)
+
+    def test_category_list_etag(self):
+        response, _ = self.list_categories()
+        etag = response['ETag']
+        self.assertEqual(etag, f'"{hashlib.sha256(response.content).hexdigest()}"')
+
+        response, queries = self.list_categories(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(queries, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Аксессуары')
+        response, _ = self.list_categories(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(ALLOWED_HOSTS=['internal', 'shop.example.com'])
+    def test_pagination_links_follow_request_host(self):
+        Category.objects.bulk_create([Category(name=f'Категория {index}') for index in range(20)])
+
+        def next_link(**extra):
+            request = APIRequestFactory().get(reverse('categories'), **extra)
+            return json.loads(CategoryView.as_view()(request).content)['next']
+
+        self.assertTrue(next_link(HTTP_HOST='internal').startswith('http://internal/'))
+        self.assertTrue(next_link(HTTP_HOST='shop.example.com', secure=True).startswith('https://shop.example.com/'))
+
+    def test_browsable_api_is_not_cached(self):
+        response, _ = self.list_categories(accept='text/html')
+        self.assertNotIn('ETag', response)
+        self.assertIn(b'<html', response.rendered_content)
+
+    def test_shop_list_is_invalidated_by_state_update(self):
+        Shop.objects.create(name='Открытый')
+        self.assertEqual(self.client.get(reverse('shops')).json()['count'], 1)
+
+        Shop.objects.update(state=False)
+        self.assertEqual(self.client.get(reverse('shops')).json()['count'], 1)
+        bump_generation(Shop)
+        self.assertEqual(self.client.get(reverse('shops')).json()['count'], 0)
+
+    def test_product_list_is_invalidated_by_import(self):
+        user = User.objects.create_user(email='cache@example.com', password='password123', type='shop')
+        self.client.force_authenticate(user)
+        feed = {
+            'shop': 'Cache Shop',
+            'categories': [{'id': 9, 'name': 'Планшеты'}],
+            'goods': [{'id': 1, 'category': 9, 'name': 'Планшет', 'price': 10, 'price_rrc': 12, 'quantity': 1}],
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            CatalogImporter(user).run(feed)
+        self.assertEqual(self.client.get(reverse('product-list')).data['results'][0]['price'], 10)
+
+        feed['goods'][0]['price'] = 20
+        with self.captureOnCommitCallbacks(execute=True):
+            CatalogImporter(user).run(feed)
+        self.assertEqual(self.client.get(reverse('product-list')).data['results'][0]['price'], 20)
+
+
+class CatalogTagCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.feeds = {}
+        self.users = {}
+        for name in ('first', 'second'):
+            self.users[name] = User.objects.create_user(email=f'{name}@example.com', password='password123', type='shop')
+            self.feeds[name] = {
+                'shop': name,
+                'categories': [{'id': 1, 'name': 'Смартфоны'}, {'id': 2, 'name': 'Планшеты'}],
+                'goods': [
+                    {'id': 1, 'category': 1, 'name': f'{name} 1', 'price': 10, 'price_rrc': 12, 'quantity': 1},
+                    {'id': 2, 'category': 2, 'name': f'{name} 2', 'price': 10, 'price_rrc': 12, 'quantity': 1},
+                ],
+            }
+            self.run_import(name)
+        self.shops = {name: Shop.objects.get(user=user).id for name, user in self.users.items()}
+
+    def run_import(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            CatalogImporter(self.users[name]).run(self.feeds[name])
+
+    def list_products(self, **params):
+        request = APIRequestFactory().get(reverse('product-list'), params)
+        request.user = self.users['first']
+        with CaptureQueriesContext(connection) as context:
+            response = ProductInfoView.as_view()(request)
+        return response, len(context.captured_queries)
+
+    def test_import_invalidates_only_its_shop_and_categories(self):
+        for params in ({'shop_id': self.shops['first']}, {'shop_id': self.shops['second']}, {'category_id': 1}, {'category_id': 2}, {}):
+            self.list_products(**params)
+
+        self.feeds['first']['goods'][0]['price'] = 20
+        self.run_import('first')
+
+        self.assertEqual(self.list_products(shop_id=self.shops['second'])[1], 0)
+        self.assertEqual(self.list_products(category_id=2)[1], 0)
+        for params in ({'shop_id': self.shops['first']}, {'category_id': 1}, {}):
+            response, queries = self.list_products(**params)
+            self.assertGreater(queries, 0)
+            self.assertIn(20, [offer['price'] for offer in response.data['results']])
+
+    def test_unchanged_import_keeps_cache(self):
+        self.list_products(shop_id=self.shops['first'])
+        self.run_import('first')
+        self.assertEqual(self.list_products(shop_id=self.shops['first'])[1], 0)
+
+    def test_shop_state_change_invalidates_shop(self):
+        self.list_products(shop_id=self.shops['first'])
+        self.list_products(shop_id=self.shops['second'])
+
+        self.client.force_authenticate(self.users['first'])
+        with patch('ads.views.PartnerState.throttle_classes', []), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('partner-state'), {'state': 'false'})
+
+        response, queries = self.list_products(shop_id=self.shops['first'])
+        self.assertFalse(response.data['results'][0]['shop']['state'])
+        self.assertEqual(self.list_products(shop_id=self.shops['second'])[1], 0)
+
+    @override_settings(MEDIA_ROOT=MEDIA_ROOT)
+    @patch('ads.tasks.generate_image_renditions.delay')
+    def test_product_change_invalidates_only_its_offers(self, mock_delay):
+        for params in ({'shop_id': self.shops['first']}, {'shop_id': self.shops['second']}, {'category_id': 1}, {'category_id': 2}):
+            self.list_products(**params)
+
+        product = Product.objects.get(name='first 1')
+        product.description = 'Новое описание'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+            ProductImage.objects.create(product=product, image=make_image())
+
+        self.assertEqual(self.list_products(shop_id=self.shops['second'])[1], 0)
+        self.assertEqual(self.list_products(category_id=2)[1], 0)
+        self.assertGreater(self.list_products(shop_id=self.shops['first'])[1], 0)
+        self.assertGreater(self.list_products(category_id=1)[1], 0)
+
+    def test_moved_product_invalidates_previous_category(self):
+        self.list_products(category_id=1)
+
+        product = Product.objects.get(name='first 1')
+        product.category_id = 2
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+        response, queries = self.list_products(category_id=1)
+        self.assertGreater(queries, 0)
+        self.assertNotIn('first 1', [offer['product']['name'] for offer in response.data['results']])
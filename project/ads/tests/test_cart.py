@@ -0,0 +1,314 @@
+import json
+import threading
+from unittest.mock import patch
+from django.db import IntegrityError, connection, transaction
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient, APIRequestFactory, force_authenticate
+from cachalot.api import cachalot_disabled
+from ads.models import User, Shop, Category, Product, ProductInfo, Order, OrderItem
+from ads.checkout import InsufficientStock, checkout, reserve_stock
+from ads.views import CartView
+
+
+class CartBulkTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='cart@example.com', password='password123')
+        shop = Shop.objects.create(name='Cart Shop')
+        category = Category.objects.create(name='Смартфоны')
+        self.offers = []
+        for index in range(60):
+            product = Product.objects.create(name=f'Товар {index}', category=category)
+            self.offers.append(ProductInfo.objects.create(
+                product=product, shop=shop, name=product.name, price=100, price_rrc=120, quantity=10
+            ))
+
+        patcher = patch('ads.views.CartView.throttle_classes', [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def call(self, method, items):
+        items = items if isinstance(items, str) else json.dumps(items)
+        request = getattr(APIRequestFactory(), method)(reverse('cart'), {'items': items}, format='json')
+        force_authenticate(request, self.user)
+        with cachalot_disabled(), CaptureQueriesContext(connection) as context:
+            response = CartView.as_view()(request)
+        return response, len([query for query in context.captured_queries if not query['sql'].startswith('EXPLAIN')])
+
+    def add(self, offers, quantity=1):
+        return self.call('post', [{'product_id': offer.id, 'quantity': quantity} for offer in offers])
+
+    def test_post_query_count_does_not_depend_on_items(self):
+        self.add(self.offers[:1])
+        _, few = self.add(self.offers[:2])
+        _, many = self.add(self.offers, quantity=3)
+
+        self.assertEqual(few, many)
+        cart = Order.objects.get(user=self.user, status='cart')
+        self.assertEqual(cart.order_items.count(), 60)
+        self.assertEqual(set(cart.order_items.values_list('quantity', flat=True)), {3})
+
+    def test_post_upserts_existing_items(self):
+        self.add(self.offers[:2])
+        response, _ = self.call('post', [
+            {'product_id': self.offers[0].id, 'quantity': 5},
+            {'product_id': self.offers[2].id, 'quantity': 1},
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        quantities = dict(OrderItem.objects.values_list('product_id', 'quantity'))
+        self.assertEqual(quantities, {self.offers[0].id: 5, self.offers[1].id: 1, self.offers[2].id: 1})
+
+    def test_post_rejects_unknown_products_without_writes(self):
+        response, _ = self.call('post', [
+            {'product_id': self.offers[0].id, 'quantity': 1},
+            {'product_id': 0, 'quantity': 1},
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(json.loads(self.call('post', [{'product_id': self.offers[0].id}])[0].content)['Errors'], 'Invalid item format')
+
+    def test_put_updates_in_one_query(self):
+        self.add(self.offers)
+        items = [{'id': offer.id, 'quantity': index + 1} for index, offer in enumerate(self.offers)]
+
+        _, few = self.call('put', items[:1])
+        response, many = self.call('put', items)
+
+        self.assertEqual(few, many)
+        self.assertEqual(json.loads(response.content)['Objects_update'], 60)
+        self.assertEqual(OrderItem.objects.get(product=self.offers[9]).quantity, 10)
+
+    def test_delete_items(self):
+        self.add(self.offers[:3])
+        item_ids = list(OrderItem.objects.order_by('id').values_list('id', flat=True))
+
+        response, _ = self.call('delete', f'{item_ids[0]},{item_ids[2]}')
+
+        self.assertEqual(json.loads(response.content)['Objects_deleted'], 2)
+        self.assertEqual(list(OrderItem.objects.values_list('id', flat=True)), [item_ids[1]])
+
+
+class CheckoutTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='checkout@example.com', password='password123')
+        shop = Shop.objects.create(name='Checkout Shop')
+        product = Product.objects.create(name='Телефон', category=Category.objects.create(name='Смартфоны'))
+        self.offer = ProductInfo.objects.create(product=product, shop=shop, name='Телефон', price=100, price_rrc=120, quantity=3)
+        self.cart = Order.objects.create(user=self.user, status='cart')
+        self.client.force_authenticate(self.user)
+        for target in ('ads.views.OrderView.throttle_classes', 'ads.views.CartView.throttle_classes'):
+            patcher = patch(target, [])
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for task in ('send_order_confirmation', 'send_invoice_admin'):
+            patcher = patch(f'ads.views.{task}.delay')
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_second_cart_is_rejected(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.objects.create(user=self.user, status='cart')
+        Order.objects.create(user=self.user, status='new')
+
+    def test_checkout_reserves_stock(self):
+        OrderItem.objects.create(order=self.cart, product=self.offer, shop=self.offer.shop, quantity=2)
+
+        response = self.client.post(reverse('orders'), {'id': self.cart.id})
+
+        self.assertTrue(response.json()['Status'])
+        self.cart.refresh_from_db()
+        self.offer.refresh_from_db()
+        self.assertEqual((self.cart.status, self.offer.quantity), ('new', 1))
+        self.assertEqual(self.client.post(reverse('orders'), {'id': self.cart.id}).json()['Errors'], 'Order not found')
+
+    def test_checkout_reports_shortages(self):
+        OrderItem.objects.create(order=self.cart, product=self.offer, shop=self.offer.shop, quantity=5)
+
+        response = self.client.post(reverse('orders'), {'id': self.cart.id})
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.json()['Shortages'], [{'product_id': self.offer.id, 'requested': 5, 'available': 3}])
+        self.cart.refresh_from_db()
+        self.offer.refresh_from_db()
+        self.assertEqual((self.cart.status, self.offer.quantity), ('cart', 3))
+
+    def test_partial_shortage_reserves_nothing(self):
+        other = ProductInfo.objects.create(
+            product=self.offer.product, shop=Shop.objects.create(name='Other Shop'), name='Телефон',
+            price=90, price_rrc=120, quantity=10
+        )
+        OrderItem.objects.create(order=self.cart, product=other, shop=other.shop, quantity=4)
+        OrderItem.objects.create(order=self.cart, product=self.offer, shop=self.offer.shop, quantity=4)
+
+        with self.assertRaises(InsufficientStock) as raised:
+            reserve_stock(self.cart)
+
+        self.assertEqual(raised.exception.shortages, [{'product_id': self.offer.id, 'requested': 4, 'available': 3}])
+        self.assertEqual(dict(ProductInfo.objects.values_list('id', 'quantity')), {self.offer.id: 3, other.id: 10})
+
+    def test_empty_cart_checkout(self):
+        response = self.client.post(reverse('orders'), {'id': self.cart.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# Нагрузочный тест: запросы из многих потоков к реальной базе, каждый поток со своим соединением
+class CartConcurrencyTests(TransactionTestCase):
+    threads = 12
+
+    def setUp(self):
+        shop = Shop.objects.create(name='Flash Shop')
+        product = Product.objects.create(name='Телефон', category=Category.objects.create(name='Смартфоны'))
+        self.stock = 5
+        self.offer = ProductInfo.objects.create(
+            product=product, shop=shop, name='Телефон', price=100, price_rrc=120, quantity=self.stock
+        )
+        self.users = [
+            User.objects.create_user(email=f'load{index}@example.com', password='password123')
+            for index in range(self.threads)
+        ]
+        for target in ('ads.views.OrderView.throttle_classes', 'ads.views.CartView.throttle_classes'):
+            patcher = patch(target, [])
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for task in ('send_order_confirmation', 'send_invoice_admin'):
+            patcher = patch(f'ads.views.{task}.delay')
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def hammer(self, requests):
+        barrier = threading.Barrier(len(requests))
+        responses = [None] * len(requests)
+
+        def worker(index, user, method, url, data):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                responses[index] = getattr(client, method)(url, data, format='json')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(index, *request)) for index, request in enumerate(requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_parallel_cart_writes_create_one_cart(self):
+        user = self.users[0]
+        items = json.dumps([{'product_id': self.offer.id, 'quantity': 1}])
+        responses = self.hammer([(user, 'post', reverse('cart'), {'items': items})] * self.threads)
+
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_201_CREATED] * self.threads)
+        self.assertEqual(Order.objects.filter(user=user, status='cart').count(), 1)
+        self.assertEqual(OrderItem.objects.filter(order__user=user).count(), 1)
+
+    def test_parallel_cart_writes_keep_total(self):
+        user = self.users[0]
+        offers = [
+            ProductInfo.objects.create(
+                product=self.offer.product, shop=self.offer.shop, name='Телефон',
+                price=10 * (index + 1), price_rrc=500, quantity=10
+            ) for index in range(self.threads)
+        ]
+        responses = self.hammer([
+            (user, 'post', reverse('cart'), {'items': json.dumps([{'product_id': offer.id, 'quantity': 2}])})
+            for offer in offers
+        ])
+
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_201_CREATED] * self.threads)
+        cart = Order.objects.get(user=user, status='cart')
+        self.assertEqual(cart.order_items.count(), self.threads)
+        self.assertEqual(cart.total, sum(2 * offer.price for offer in offers))
+
+    def test_parallel_checkouts_do_not_oversell(self):
+        carts = {}
+        for user in self.users:
+            carts[user] = Order.objects.create(user=user, status='cart')
+            OrderItem.objects.create(order=carts[user], product=self.offer, shop=self.offer.shop, quantity=1)
+
+        responses = self.hammer([(user, 'post', reverse('orders'), {'id': carts[user].id}) for user in self.users])
+
+        succeeded = [response for response in responses if response.status_code == status.HTTP_200_OK]
+        self.assertEqual(len(succeeded), self.stock)
+        self.assertEqual(
+            [response.status_code for response in responses if response not in succeeded],
+            [status.HTTP_409_CONFLICT] * (self.threads - self.stock)
+        )
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.quantity, 0)
+        self.assertEqual(Order.objects.filter(status='new').count(), self.stock)
+
+    def test_overlapping_multi_item_checkouts(self):
+        offers = [self.offer] + [
+            ProductInfo.objects.create(
+                product=self.offer.product, shop=Shop.objects.create(name=f'Shop {index}'), name='Телефон',
+                price=100, price_rrc=120, quantity=self.threads
+            ) for index in range(3)
+        ]
+        ProductInfo.objects.filter(id=self.offer.id).update(quantity=self.threads)
+        carts = {}
+        for index, user in enumerate(self.users):
+            carts[user] = Order.objects.create(user=user, status='cart')
+            # Разный порядок позиций в заказах провоцирует взаимоблокировки
+            for offer in (offers if index % 2 else offers[::-1]):
+                OrderItem.objects.create(order=carts[user], product=offer, shop=offer.shop, quantity=1)
+
+        responses = self.hammer([(user, 'post', reverse('orders'), {'id': carts[user].id}) for user in self.users])
+
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_200_OK] * self.threads)
+        self.assertEqual(set(ProductInfo.objects.values_list('quantity', flat=True)), {0})
+
+    def test_reservation_does_not_block_other_offers(self):
+        other = ProductInfo.objects.create(
+            product=self.offer.product, shop=Shop.objects.create(name='Other Shop'), name='Телефон',
+            price=100, price_rrc=120, quantity=1
+        )
+        carts = [Order.objects.create(user=user, status='cart') for user in self.users[:2]]
+        OrderItem.objects.create(order=carts[0], product=self.offer, shop=self.offer.shop, quantity=1)
+        OrderItem.objects.create(order=carts[1], product=other, shop=other.shop, quantity=1)
+        reserved, release = threading.Event(), threading.Event()
+
+        def hold():
+            try:
+                with transaction.atomic():
+                    reserve_stock(carts[0])
+                    reserved.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        try:
+            self.assertTrue(reserved.wait(10))
+            with connection.cursor() as cursor:
+                cursor.execute("SET lock_timeout = '2s'")
+            try:
+                checkout(self.users[1].id, carts[1].id)
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute('RESET lock_timeout')
+        finally:
+            release.set()
+            holder.join()
+
+        self.assertEqual(dict(ProductInfo.objects.values_list('id', 'quantity')), {self.offer.id: self.stock - 1, other.id: 0})
+
+    def test_repeated_checkout_is_applied_once(self):
+        user = self.users[0]
+        cart = Order.objects.create(user=user, status='cart')
+        OrderItem.objects.create(order=cart, product=self.offer, shop=self.offer.shop, quantity=1)
+
+        responses = self.hammer([(user, 'post', reverse('orders'), {'id': cart.id})] * self.threads)
+
+        self.assertEqual(sum(response.json()['Status'] for response in responses), 1)
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.quantity, self.stock - 1)
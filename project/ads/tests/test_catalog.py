@@ -0,0 +1,262 @@
+import shutil
+import tempfile
+from io import BytesIO
+from PIL import Image
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate
+from cachalot.api import cachalot_disabled
+from ads.views import ProductInfoView
+from ads.importer import CatalogImporter
+from ads.search import trigram_available
+from ads.models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, ProductImage
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def make_image(name='image.jpg'):
+    output = BytesIO()
+    Image.new('RGB', (40, 30), 'red').save(output, format='JPEG')
+    return SimpleUploadedFile(name, output.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ProductInfoViewTests(APITestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='buyer@example.com', password='password123')
+        self.client.force_authenticate(self.user)
+        self.shop = Shop.objects.create(name='Catalog Shop')
+        self.category = Category.objects.create(name='Смартфоны')
+        self.color = Parameter.objects.create(name='Цвет')
+        self.memory = Parameter.objects.create(name='Память')
+
+    # Кэш каталога сбрасывается после фиксации, поэтому колбэки выполняются сразу
+    def create_offers(self, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            for index in range(count):
+                product = Product.objects.create(name=f'Товар {index}', category=self.category)
+                ProductImage.objects.create(product=product, image=make_image(), is_main=True)
+                offer = ProductInfo.objects.create(
+                    product=product, shop=self.shop, name=product.name,
+                    price=100, price_rrc=120, quantity=5
+                )
+                ProductParameter.objects.create(product_info=offer, parameter=self.color, value='черный')
+                ProductParameter.objects.create(product_info=offer, parameter=self.memory, value='64')
+
+    def test_product_list_serializes_prefetched_data(self):
+        self.create_offers(1)
+
+        response = self.client.get(reverse('product-list'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        offer = response.data['results'][0]
+        self.assertEqual(offer['product']['category'], 'Смартфоны')
+        self.assertEqual({item['parameter'] for item in offer['parameters']}, {'Цвет', 'Память'})
+        self.assertEqual(len(offer['images']), 1)
+        self.assertIsNotNone(offer['main_image']['thumbnail'])
+
+    def test_cursor_pagination_walks_catalog_without_count(self):
+        self.create_offers(5)
+        ProductInfo.objects.filter(product__name='Товар 2').update(quantity=0)
+
+        ids = []
+        url = reverse('product-list') + '?pagination=cursor&page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            self.assertLessEqual(len(response.data['results']), 2)
+            ids.extend(offer['id'] for offer in response.data['results'])
+            url = response.data['next']
+
+        expected = list(ProductInfo.objects.filter(quantity__gt=0).order_by('-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_cursor_pagination_rejects_invalid_cursor(self):
+        response = self.client.get(reverse('product-list') + '?cursor=invalid')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    # Запросы EXPLAIN, которые добавляет silk, не учитываются.
+    # Представление вызывается напрямую, чтобы не учитывать запросы middleware
+    def list_products(self, query=''):
+        request = APIRequestFactory().get(reverse('product-list') + query)
+        force_authenticate(request, self.user)
+        with cachalot_disabled(), CaptureQueriesContext(connection) as context:
+            response = ProductInfoView.as_view()(request)
+        queries = [query for query in context.captured_queries if not query['sql'].startswith('EXPLAIN')]
+        return response, len(queries)
+
+    # Счётчик, список предложений, изображения и параметры — независимо от размера страницы
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.create_offers(2)
+        response, queries = self.list_products()
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(queries, 4)
+
+        self.create_offers(10)
+        response, queries = self.list_products()
+        self.assertEqual(len(response.data['results']), 12)
+        self.assertEqual(queries, 4)
+
+    def test_cursor_pagination_does_not_count(self):
+        self.create_offers(3)
+        response, queries = self.list_products('?pagination=cursor')
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(queries, 3)
+
+
+class ProductSearchTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='search@example.com', password='password123')
+        self.client.force_authenticate(self.user)
+        self.shop = Shop.objects.create(name='Search Shop')
+        self.category = Category.objects.create(name='Смартфоны')
+
+    def create_offer(self, name, description='', sku=None, quantity=5):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name=name, description=description, sku=sku, category=self.category)
+            return ProductInfo.objects.create(
+                product=product, shop=self.shop, name=name, price=100, price_rrc=120, quantity=quantity
+            )
+
+    def search(self, query):
+        return self.client.get(reverse('product-search'), {'q': query})
+
+    def test_search_ranks_name_above_description(self):
+        in_description = self.create_offer('Чехол', description='Подходит для смартфонов Apple')
+        in_name = self.create_offer('Смартфон Apple iPhone 12')
+        self.create_offer('Смартфон Apple iPhone 11', quantity=0)
+        self.create_offer('Наушники')
+
+        response = self.search('смартфоны apple')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([offer['id'] for offer in response.data['results']], [in_name.id, in_description.id])
+
+    def test_search_by_sku_and_updated_name(self):
+        offer = self.create_offer('Телефон', sku='XZ-2000')
+        self.assertEqual([item['id'] for item in self.search('XZ-2000').data['results']], [offer.id])
+
+        offer.product.name = 'Планшет'
+        offer.product.save()
+        self.assertEqual([item['id'] for item in self.search('планшет').data['results']], [offer.id])
+
+    def test_imported_products_are_searchable(self):
+        shop_user = User.objects.create_user(email='shop@example.com', password='password123', type='shop')
+        CatalogImporter(shop_user).run({
+            'shop': 'Imported',
+            'categories': [{'id': 7, 'name': 'Телевизоры'}],
+            'goods': [{'id': 1, 'category': 7, 'name': 'Телевизор Samsung', 'price': 1, 'price_rrc': 2, 'quantity': 3}],
+        })
+
+        response = self.search('телевизоры')
+        self.assertEqual([offer['product']['name'] for offer in response.data['results']], ['Телевизор Samsung'])
+
+    def test_search_requires_query(self):
+        response = self.search(' ')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_falls_back_to_trigrams(self):
+        if not trigram_available():
+            self.skipTest('Расширение pg_trgm не установлено')
+        offer = self.create_offer('Смартфон Samsung Galaxy')
+
+        response = self.search('Samsunq')
+        self.assertEqual([item['id'] for item in response.data['results']], [offer.id])
+
+
+class ProductFacetTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='facets@example.com', password='password123', type='shop')
+        self.client.force_authenticate(self.user)
+        self.feed = {
+            'shop': 'Facet Shop',
+            'categories': [{'id': 3, 'name': 'Телевизоры'}],
+            'goods': [
+                {'id': 1, 'category': 3, 'name': 'TV 1', 'price': 1, 'price_rrc': 2, 'quantity': 3,
+                 'parameters': {'Цвет': 'черный', 'Диагональ': 55}},
+                {'id': 2, 'category': 3, 'name': 'TV 2', 'price': 1, 'price_rrc': 2, 'quantity': 3,
+                 'parameters': {'Цвет': 'белый', 'Диагональ': 55}},
+                {'id': 3, 'category': 3, 'name': 'TV 3', 'price': 1, 'price_rrc': 2, 'quantity': 3,
+                 'parameters': {'Цвет': 'черный', 'Диагональ': 65}},
+                {'id': 4, 'category': 3, 'name': 'TV 4', 'price': 1, 'price_rrc': 2, 'quantity': 0,
+                 'parameters': {'Цвет': 'черный', 'Диагональ': 65}},
+            ],
+        }
+        CatalogImporter(self.user).run(self.feed)
+
+    def products(self, *params, facets=True):
+        query = {'param': list(params)}
+        if facets:
+            query['facets'] = 'true'
+        response = self.client.get(reverse('product-list'), query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(offer['product']['name'] for offer in response.data['results']), response.data.get('facets')
+
+    def test_facet_counts_for_in_stock_offers(self):
+        names, facets = self.products()
+        self.assertEqual(names, ['TV 1', 'TV 2', 'TV 3'])
+        self.assertEqual(facets, {'Диагональ': {'55': 2, '65': 1}, 'Цвет': {'черный': 2, 'белый': 1}})
+
+    def test_filters_combine_values_and_parameters(self):
+        names, facets = self.products('Цвет:черный', 'Цвет:белый', 'Диагональ:55')
+        self.assertEqual(names, ['TV 1', 'TV 2'])
+        self.assertEqual(facets['Цвет'], {'белый': 1, 'черный': 1})
+
+        names, _ = self.products('Цвет:черный', 'Диагональ:55', facets=False)
+        self.assertEqual(names, ['TV 1'])
+
+    def test_selected_parameter_keeps_its_other_values(self):
+        names, facets = self.products('Цвет:черный')
+        self.assertEqual(names, ['TV 1', 'TV 3'])
+        self.assertEqual(facets, {'Диагональ': {'55': 1, '65': 1}, 'Цвет': {'черный': 2, 'белый': 1}})
+
+        names, facets = self.products('Цвет:черный', 'Цвет:белый')
+        self.assertEqual(names, ['TV 1', 'TV 2', 'TV 3'])
+        self.assertEqual(facets['Цвет'], {'черный': 2, 'белый': 1})
+
+        names, facets = self.products('Цвет:белый', 'Диагональ:65')
+        self.assertEqual(names, [])
+        self.assertEqual(facets, {'Диагональ': {'55': 1}, 'Цвет': {'черный': 1}})
+
+    def test_queryset_delete_updates_facets(self):
+        ProductParameter.objects.filter(product_info__name='TV 3', parameter__name='Цвет').delete()
+
+        names, facets = self.products('Цвет:черный')
+        self.assertEqual(names, ['TV 1'])
+        self.assertEqual(facets['Цвет'], {'черный': 1, 'белый': 1})
+
+    def test_facets_follow_catalog_changes(self):
+        self.feed['goods'][1]['parameters']['Цвет'] = 'черный'
+        with self.captureOnCommitCallbacks(execute=True):
+            CatalogImporter(self.user).run(self.feed)
+        self.assertEqual(self.products('Цвет:черный')[0], ['TV 1', 'TV 2', 'TV 3'])
+
+        parameter = ProductParameter.objects.get(product_info__name='TV 3', parameter__name='Цвет')
+        parameter.value = 'серый'
+        with self.captureOnCommitCallbacks(execute=True):
+            parameter.save()
+        self.assertEqual(self.products('Цвет:серый')[0], ['TV 3'])
+
+        color = Parameter.objects.get(name='Цвет')
+        color.name = 'Окраска'
+        with self.captureOnCommitCallbacks(execute=True):
+            color.save()
+        self.assertEqual(self.products('Окраска:серый')[0], ['TV 3'])
@@ -0,0 +1,21 @@
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from ads.models import Order, ProductInfo
+
+
+class BenchmarkIndexesCommandTests(TestCase):
+
+    def test_benchmark_prints_plans_and_rolls_back(self):
+        out = StringIO()
+        call_command('benchmark_indexes', offers=40, orders=20, stdout=out)
+
+        output = out.getvalue()
+        self.assertIn('Корзина пользователя', output)
+        self.assertIn('Execution Time', output)
+        self.assertFalse(ProductInfo.objects.exists())
+        self.assertFalse(Order.objects.exists())
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Order._meta.db_table)
+        self.assertIn('order_user_status_idx', constraints)
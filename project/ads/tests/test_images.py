@@ -0,0 +1,324 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from PIL import Image
+from django.core.files.uploadedfile import SimpleUploadedFile
+from unittest.mock import patch
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from ads.models import User, Shop, Category, Product, ProductInfo, ProductImage
+from ads.imagekit_ import resolve_variant_urls
+from ads.images import RESPONSIVE_WIDTHS, negotiate_format, responsive_image_url, responsive_name, snap_width, supported_formats
+from ads.tasks import generate_image_renditions
+from ads.tests.test_catalog import make_image
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def tearDownModule():
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ProductImageCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        delay = patch('ads.tasks.generate_image_renditions.delay')
+        delay.start()
+        self.addCleanup(delay.stop)
+        category = Category.objects.create(name='Смартфоны')
+        self.product = Product.objects.create(name='Смартфон', category=category)
+        self.owner = User.objects.create_user(email='owner@example.com', password='password123', type='shop')
+        self.other = User.objects.create_user(email='other@example.com', password='password123', type='shop')
+        for user in (self.owner, self.other):
+            Shop.objects.create(name=user.email, user=user)
+        ProductInfo.objects.create(
+            product=self.product, shop=self.owner.shop, name='Смартфон', price=100, price_rrc=120, quantity=1
+        )
+        self.image = ProductImage.objects.create(product=self.product, image=make_image(), is_main=True)
+        self.list_url = reverse('product-images', args=[self.product.id])
+        self.detail_url = reverse('product-image-detail', args=[self.product.id, self.image.id])
+
+    def get(self, url, user):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        return response, [query for query in context.captured_queries if not query['sql'].startswith('EXPLAIN')]
+
+    def test_detail_is_scoped_to_user(self):
+        self.assertEqual(self.get(self.detail_url, self.owner)[0].status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get(self.detail_url, self.other)[0].status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_is_cached_and_invalidated_on_upload_and_delete(self):
+        response, _ = self.get(self.list_url, self.other)
+        self.assertEqual(len(response.data), 1)
+        _, cached_queries = self.get(self.list_url, self.other)
+        self.assertFalse([query for query in cached_queries if 'ads_productimage' in query['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second = ProductImage.objects.create(product=self.product, image=make_image(), is_main=True)
+        response, _ = self.get(self.list_url, self.other)
+        self.assertEqual([image['id'] for image in response.data], [second.id, self.image.id])
+        self.assertEqual([image['is_main'] for image in response.data], [True, False])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        response, _ = self.get(self.list_url, self.other)
+        self.assertEqual([image['id'] for image in response.data], [self.image.id])
+
+    def test_main_image_change_updates_detail(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            second = ProductImage.objects.create(product=self.product, image=make_image(), is_main=True)
+        self.assertFalse(self.get(self.detail_url, self.owner)[0].data['is_main'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('set-main-image', args=[self.product.id]), {'image_id': self.image.id})
+        self.assertTrue(self.get(self.detail_url, self.owner)[0].data['is_main'])
+        second.refresh_from_db()
+        self.assertFalse(second.is_main)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImageRenditionTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Смартфоны')
+        self.product = Product.objects.create(name='Смартфон', category=category)
+
+    def rendition_exists(self, image, name):
+        rendition = getattr(image, name)
+        return rendition.storage.exists(rendition.name)
+
+    @patch('ads.tasks.generate_image_renditions.delay')
+    def test_renditions_are_scheduled_once_after_commit(self, delay):
+        with self.captureOnCommitCallbacks() as callbacks:
+            image = ProductImage.objects.create(product=self.product, image=make_image())
+        delay.assert_not_called()
+
+        for callback in callbacks:
+            callback()
+        delay.assert_called_once_with(image.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image.is_main = True
+            image.save()
+        delay.assert_called_once()
+
+    @patch('ads.tasks.generate_image_renditions.delay')
+    def test_url_does_not_generate_rendition(self, delay):
+        image = ProductImage.objects.create(product=self.product, image=make_image())
+
+        self.assertTrue(image.thumbnail.url.endswith('.jpg'))
+        self.assertFalse(self.rendition_exists(image, 'thumbnail'))
+
+        generate_image_renditions(image.pk)
+        image = ProductImage.objects.get(pk=image.pk)
+        for name in ProductImage.RENDITIONS:
+            self.assertTrue(self.rendition_exists(image, name), name)
+
+    @patch('ads.tasks.generate_image_renditions.delay')
+    def test_renditions_are_rendered_from_single_decode(self, delay):
+        output = BytesIO()
+        Image.new('RGB', (1200, 900), 'green').save(output, format='JPEG')
+        image = ProductImage.objects.create(
+            product=self.product, image=SimpleUploadedFile('photo.jpg', output.getvalue(), content_type='image/jpeg')
+        )
+        expected = {spec: getattr(image, spec).generator.generate() for spec in ProductImage.RENDITIONS}
+
+        with patch('ads.imagekit_.Image.open', wraps=Image.open) as image_open:
+            image.generate_renditions()
+        self.assertEqual(image_open.call_count, 1)
+
+        image = ProductImage.objects.get(pk=image.pk)
+        for name, reference in expected.items():
+            rendition = getattr(image, name)
+            with Image.open(reference) as reference_image, rendition.storage.open(rendition.name) as stored:
+                with Image.open(stored) as stored_image:
+                    self.assertEqual(
+                        (stored_image.format, stored_image.size), (reference_image.format, reference_image.size), name
+                    )
+
+    @patch('ads.tasks.generate_image_renditions.delay')
+    def test_backfill_command(self, delay):
+        images = [ProductImage.objects.create(product=self.product, image=make_image()) for _ in range(3)]
+
+        out = StringIO()
+        call_command('generate_image_renditions', workers=1, chunk_size=2, stdout=out)
+
+        self.assertIn('3 из 3', out.getvalue())
+        for image in images:
+            self.assertTrue(self.rendition_exists(image, 'web_optimized'))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ProductImageBulkUploadTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Смартфоны')
+        self.product = Product.objects.create(name='Смартфон', category=category)
+        self.user = User.objects.create_user(email='bulk@example.com', password='password123', type='shop')
+        shop = Shop.objects.create(name='Bulk Shop', user=self.user)
+        ProductInfo.objects.create(product=self.product, shop=shop, name='Смартфон', price=100, price_rrc=120, quantity=1)
+        self.client.force_authenticate(self.user)
+        self.url = reverse('product-images-bulk', args=[self.product.id])
+
+    @patch('ads.tasks.generate_image_renditions.delay')
+    def test_bulk_upload_reports_per_file_results(self, delay):
+        output = BytesIO()
+        Image.new('RGBA', (2400, 600), 'blue').save(output, format='PNG')
+        files = [
+            make_image('first.jpg'),
+            SimpleUploadedFile('wide.png', output.getvalue(), content_type='image/png'),
+            SimpleUploadedFile('broken.jpg', b'not an image', content_type='image/jpeg'),
+            SimpleUploadedFile('notes.txt', b'text', content_type='text/plain'),
+        ]
+
+        response = self.client.post(self.url, {'images': files}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        results = response.data['results']
+        self.assertEqual([result['file'] for result in results], ['first.jpg', 'wide.png', 'broken.jpg', 'notes.txt'])
+        self.assertEqual([result['Status'] for result in results], [True, True, False, False])
+
+        wide = ProductImage.objects.get(pk=results[1]['id'])
+        self.assertTrue(wide.image.name.endswith('.jpg'))
+        with Image.open(wide.image.path) as stored:
+            self.assertEqual((stored.format, stored.size), ('JPEG', (1200, 300)))
+        self.assertEqual(self.product.images.count(), 2)
+
+    def test_bulk_upload_requires_owner(self):
+        other = User.objects.create_user(email='stranger@example.com', password='password123', type='shop')
+        self.client.force_authenticate(other)
+        response = self.client.post(self.url, {'images': [make_image()]}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class VariantUrlTests(APITestCase):
+
+    @patch('ads.tasks.generate_image_renditions.delay')
+    def setUp(self, delay):
+        cache.clear()
+        self.user = User.objects.create_user(email='variants@example.com', password='password123')
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Смартфоны')
+        shop = Shop.objects.create(name='Variant Shop')
+        self.images = []
+        for index in range(3):
+            product = Product.objects.create(name=f'Товар {index}', category=category)
+            ProductInfo.objects.create(product=product, shop=shop, name=product.name, price=100, price_rrc=120, quantity=1)
+            self.images += [
+                ProductImage.objects.create(product=product, image=make_image(), is_main=is_main) for is_main in (True, False)
+            ]
+
+    def test_urls_match_imagekit(self):
+        image = self.images[0]
+        urls = resolve_variant_urls([image], ProductImage.RENDITIONS)[image.pk]
+        self.assertEqual(urls['original'], image.image.url)
+        for name in ProductImage.RENDITIONS:
+            self.assertEqual(urls[name], getattr(ProductImage.objects.get(pk=image.pk), name).url)
+
+    def test_product_list_resolves_page_in_one_pass(self):
+        storage = self.images[0].image.storage
+        with patch('ads.serializers.resolve_variant_urls', wraps=resolve_variant_urls) as resolve, \
+                patch.object(storage, 'exists', wraps=storage.exists) as exists:
+            response = self.client.get(reverse('product-list'))
+
+        self.assertEqual(resolve.call_count, 1)
+        self.assertEqual(len(resolve.call_args.args[0]), len(self.images))
+        exists.assert_not_called()
+
+        main = {image.product_id: image for image in self.images if image.is_main}
+        for offer in response.data['results']:
+            image = main[offer['product']['id']]
+            self.assertEqual(offer['main_image']['thumbnail'], image.thumbnail.url)
+            self.assertEqual(offer['product']['main_image_url'], image.medium.url)
+            self.assertEqual(len(offer['images']), 2)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ResponsiveImageTests(APITestCase):
+
+    @patch('ads.tasks.generate_image_renditions.delay')
+    def setUp(self, delay):
+        category = Category.objects.create(name='Смартфоны')
+        product = Product.objects.create(name='Смартфон', category=category)
+        output = BytesIO()
+        Image.new('RGB', (1200, 900), 'green').save(output, format='JPEG')
+        self.image = ProductImage.objects.create(
+            product=product, image=SimpleUploadedFile('photo.jpg', output.getvalue(), content_type='image/jpeg')
+        )
+
+    def test_width_ladder_and_format_negotiation(self):
+        self.assertEqual(snap_width(500), 640)
+        self.assertEqual(snap_width(5000), RESPONSIVE_WIDTHS[-1])
+        self.assertEqual(negotiate_format('image/webp,*/*')[1], 'WEBP')
+        self.assertEqual(negotiate_format('image/webp;q=0, image/jpeg')[1], 'JPEG')
+        expected = 'AVIF' if 'AVIF' in [item[1] for item in supported_formats()] else 'WEBP'
+        self.assertEqual(negotiate_format('image/avif,image/webp,*/*')[1], expected)
+
+    def test_image_is_negotiated_and_cached_on_disk(self):
+        url = responsive_image_url(self.image, 500)
+        response = self.client.get(url, HTTP_ACCEPT='image/webp,*/*')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('Accept', response['Vary'])
+        with Image.open(BytesIO(response.content)) as rendered:
+            self.assertEqual((rendered.format, rendered.size), ('WEBP', (640, 480)))
+
+        with patch('ads.views.render_responsive') as render:
+            cached = self.client.get(url, HTTP_ACCEPT='image/webp,*/*')
+            self.assertEqual(b''.join(cached.streaming_content), response.content)
+            render.assert_not_called()
+
+        jpeg = self.client.get(url, HTTP_ACCEPT='image/jpeg')
+        self.assertEqual(jpeg['Content-Type'], 'image/jpeg')
+
+    def test_concurrent_miss_leaves_no_orphans(self):
+        url = responsive_image_url(self.image, 500)
+        name = responsive_name(self.image.image.name, 640, 'jpg')
+        storage = self.image.image.storage
+
+        # Другой запрос сохраняет вариант, пока этот рендерит
+        def render_and_race(*args):
+            os.makedirs(os.path.dirname(storage.path(name)), exist_ok=True)
+            with open(storage.path(name), 'wb') as other:
+                other.write(b'other')
+            return b'rendered'
+
+        with patch('ads.views.render_responsive', side_effect=render_and_race):
+            self.assertEqual(self.client.get(url, HTTP_ACCEPT='image/jpeg').content, b'rendered')
+        # Другой запрос сохраняет вариант между повторной проверкой и записью: обе проверки
+        # представления видят пустое место, а хранилище сохраняет копию под другим именем
+        storage.delete(name)
+        exists, checks = storage.exists, []
+
+        def missing_for_view(path):
+            checks.append(path)
+            return False if checks.count(name) <= 2 and path == name else exists(path)
+
+        with patch('ads.views.render_responsive', side_effect=render_and_race), \
+                patch.object(storage, 'exists', side_effect=missing_for_view):
+            self.client.get(url, HTTP_ACCEPT='image/jpeg')
+
+        self.assertEqual(storage.listdir(os.path.dirname(name))[1], [os.path.basename(name)])
+        with storage.open(name) as stored:
+            self.assertEqual(stored.read(), b'other')
+
+    def test_outdated_version_redirects(self):
+        url = reverse('responsive-image', args=[self.image.pk, 'outdated'])
+        response = self.client.get(url, {'w': 100})
+        self.assertRedirects(response, responsive_image_url(self.image, 160), fetch_redirect_response=False)
@@ -0,0 +1,270 @@
+import io
+import json
+import yaml
+from unittest.mock import patch
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from cachalot.api import cachalot_disabled
+from ads.models import ImportJob, User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem
+from ads.importer import CatalogImporter
+from ads.feeds import JsonFeedReader, read_feed
+
+
+def make_feed(goods_count, shop='Import Shop'):
+    return {
+        'shop': shop,
+        'categories': [
+            {'id': 224, 'name': 'Смартфоны'},
+            {'id': 15, 'name': 'Аксессуары'},
+        ],
+        'goods': [
+            {
+                'id': 1000 + index,
+                'category': 224 if index % 2 else 15,
+                'model': f'model/{index}',
+                'name': f'Товар {index}',
+                'price': 100 + index,
+                'price_rrc': 150 + index,
+                'quantity': index % 5,
+                'parameters': {'Цвет': 'черный', 'Память': index},
+            } for index in range(goods_count)
+        ],
+    }
+
+
+class CatalogImporterTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='importer@example.com',
+            password='password123',
+            type='shop'
+        )
+
+    def test_import_creates_catalog(self):
+        stats = CatalogImporter(self.user, batch_size=4).run(make_feed(10))
+
+        shop = Shop.objects.get(user=self.user)
+        self.assertEqual(stats['shop'], 'Import Shop')
+        self.assertEqual(stats['counts']['offers'], 10)
+        self.assertEqual(stats['counts']['offer_parameters'], 20)
+        self.assertEqual(ProductInfo.objects.filter(shop=shop).count(), 10)
+        self.assertEqual(Product.objects.count(), 10)
+        self.assertEqual(Parameter.objects.count(), 2)
+        self.assertEqual(set(Category.objects.filter(shops=shop).values_list('id', flat=True)), {224, 15})
+        self.assertEqual(
+            ProductParameter.objects.get(product_info__name='Товар 3', parameter__name='Память').value, '3'
+        )
+        self.assertIn('offers', stats['timings'])
+
+    def test_reimport_reuses_products_and_parameters(self):
+        CatalogImporter(self.user).run(make_feed(6))
+        stats = CatalogImporter(self.user).run(make_feed(6))
+
+        self.assertEqual(stats['counts']['products_created'], 0)
+        self.assertEqual(stats['counts'].get('parameters_created', 0), 0)
+        self.assertEqual(ProductInfo.objects.count(), 6)
+        self.assertEqual(Product.objects.count(), 6)
+
+    def test_query_count_does_not_depend_on_feed_size(self):
+        CatalogImporter(self.user).run(make_feed(1, shop='Warmup'))
+
+        with cachalot_disabled():
+            with CaptureQueriesContext(connection) as small:
+                CatalogImporter(self.user).run(make_feed(5, shop='Warmup'))
+            with CaptureQueriesContext(connection) as large:
+                CatalogImporter(self.user).run(make_feed(50, shop='Warmup'))
+
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+
+class CatalogSyncTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='sync@example.com',
+            password='password123',
+            type='shop'
+        )
+        CatalogImporter(self.user).run(make_feed(6))
+
+    def test_unchanged_feed_writes_nothing(self):
+        with CaptureQueriesContext(connection) as queries:
+            stats = CatalogImporter(self.user).run(make_feed(6))
+
+        writes = [query['sql'] for query in queries.captured_queries
+                  if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(writes, [])
+        self.assertEqual(stats['diff']['unchanged'], 6)
+
+    def test_sync_applies_only_differences(self):
+        offer_ids = dict(ProductInfo.objects.values_list('external_id', 'id'))
+        feed = make_feed(6)
+        feed['goods'][0]['price'] = 999
+        feed['goods'][1]['parameters']['Цвет'] = 'белый'
+        del feed['goods'][2]
+        feed['goods'].append(dict(feed['goods'][0], id=2000, name='Новый товар'))
+
+        stats = CatalogImporter(self.user).run(feed)
+
+        self.assertEqual(stats['diff'], {
+            'created': 1, 'updated': 1, 'unchanged': 3, 'parameters_updated': 1, 'deleted': 1, 'delisted': 0
+        })
+        self.assertEqual(ProductInfo.objects.get(external_id='1000').price, 999)
+        self.assertEqual(ProductInfo.objects.get(external_id='1000').id, offer_ids['1000'])
+        self.assertFalse(ProductInfo.objects.filter(external_id='1002').exists())
+        self.assertEqual(
+            ProductParameter.objects.get(product_info__external_id='1001', parameter__name='Цвет').value, 'белый'
+        )
+
+    def test_ordered_offers_are_delisted(self):
+        offer = ProductInfo.objects.get(external_id='1001')
+        order = Order.objects.create(user=self.user, status='new')
+        OrderItem.objects.create(order=order, product=offer, shop=offer.shop, quantity=1)
+        feed = make_feed(6)
+        del feed['goods'][1]
+
+        stats = CatalogImporter(self.user).run(feed)
+
+        self.assertEqual(stats['diff']['delisted'], 1)
+        offer.refresh_from_db()
+        self.assertEqual(offer.quantity, 0)
+        self.assertTrue(OrderItem.objects.filter(order=order).exists())
+
+    def test_invalid_item_keeps_existing_offer(self):
+        feed = make_feed(6)
+        feed['goods'][0]['price'] = 'бесплатно'
+
+        stats = CatalogImporter(self.user).run(feed)
+
+        self.assertEqual(stats['counts']['skipped'], 1)
+        self.assertEqual(stats['diff']['deleted'], 0)
+        self.assertEqual(ProductInfo.objects.get(external_id='1000').price, 100)
+
+    def test_overlong_values_are_skipped(self):
+        feed = make_feed(6)
+        feed['goods'][0]['name'] = 'Т' * 101
+        feed['goods'][1]['id'] = '1' * 51
+        feed['goods'][2]['parameters'] = {'П' * 41: 'черный'}
+        feed['goods'][3]['parameters'] = {'Цвет': 'ч' * 51}
+
+        stats = CatalogImporter(self.user).run(feed)
+
+        self.assertEqual(stats['counts']['skipped'], 4)
+        self.assertEqual(len(stats['errors']), 4)
+        self.assertEqual(stats['diff']['deleted'], 1)
+        self.assertFalse(ProductInfo.objects.filter(external_id='1001').exists())
+        self.assertEqual(ProductInfo.objects.get(external_id='1000').name, 'Товар 0')
+        self.assertEqual(
+            dict(ProductParameter.objects.filter(product_info__external_id='1002').values_list('parameter__name', 'value')),
+            {'Цвет': 'черный', 'Память': '2'}
+        )
+        self.assertEqual(
+            ProductParameter.objects.get(product_info__external_id='1003', parameter__name='Цвет').value, 'черный'
+        )
+
+    def test_replace_mode_recreates_offers(self):
+        stats = CatalogImporter(self.user, mode='replace').run(make_feed(6))
+
+        self.assertEqual(stats['diff']['deleted'], 6)
+        self.assertEqual(stats['diff']['created'], 6)
+        self.assertEqual(ProductInfo.objects.count(), 6)
+
+
+class FeedReaderTests(TestCase):
+
+    def read(self, content, **kwargs):
+        entries = []
+        for key, value in read_feed(io.BytesIO(content), chunk_size=7, **kwargs):
+            entries.append((key, list(value) if key == 'goods' else value))
+        return entries
+
+    def test_yaml_and_json_yield_same_entries(self):
+        feed = make_feed(5)
+        expected = [(key, feed[key]) for key in ('shop', 'categories', 'goods')]
+
+        yaml_content = yaml.safe_dump(feed, allow_unicode=True, sort_keys=False).encode()
+        json_content = json.dumps(feed, ensure_ascii=False, indent=1).encode()
+
+        self.assertEqual(self.read(yaml_content), expected)
+        self.assertEqual(self.read(json_content), expected)
+        self.assertEqual(self.read(json_content, url='http://example.com/feed.json'), expected)
+
+    def test_goods_are_read_lazily(self):
+        content = json.dumps(make_feed(3)).encode() + b'garbage'
+        entries = read_feed(io.BytesIO(content), chunk_size=16)
+
+        self.assertEqual(next(entries)[0], 'shop')
+        self.assertEqual(next(entries)[0], 'categories')
+        key, goods = next(entries)
+        self.assertEqual(next(goods)['id'], 1000)
+
+    def test_truncated_json_value_is_not_buffered_whole(self):
+        content = b'{"shop": "x", "goods": [{"id": 1, "name": "' + b'a' * 10000
+        fp = io.BytesIO(content)
+        entries = JsonFeedReader(fp, chunk_size=64, max_value_size=256).entries()
+
+        with self.assertRaises(ValueError):
+            for key, value in entries:
+                list(value) if key == 'goods' else value
+        self.assertLess(fp.tell(), 1024)
+
+    def test_streamed_import(self):
+        content = yaml.safe_dump(make_feed(7), allow_unicode=True, sort_keys=False).encode()
+        user = User.objects.create_user(email='stream@example.com', password='password123', type='shop')
+
+        stats = CatalogImporter(user, batch_size=3).run_stream(read_feed(io.BytesIO(content)))
+
+        self.assertEqual(stats['counts']['offers'], 7)
+        self.assertEqual(ProductInfo.objects.filter(shop__user=user).count(), 7)
+
+
+class PartnerUpdateJobTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='jobs@example.com',
+            password='password123',
+            type='shop'
+        )
+        self.client.force_authenticate(self.user)
+
+    @patch('ads.views.PartnerUpdate.throttle_classes', [])
+    @patch('ads.views.import_catalog.apply_async')
+    def test_update_returns_job_id(self, mock_apply):
+        response = self.client.post(reverse('partner-update'), {'url': 'http://example.com/shop.yaml'})
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = ImportJob.objects.get(id=response.json()['Job'])
+        self.assertEqual(job.status, 'pending')
+        mock_apply.assert_called_once_with(args=[str(job.id)], task_id=str(job.id))
+
+    @patch('ads.views.PartnerUpdate.throttle_classes', [])
+    @patch('ads.views.import_catalog.apply_async', side_effect=ConnectionError('broker is down'))
+    def test_update_fails_job_when_queue_is_unavailable(self, mock_apply):
+        response = self.client.post(reverse('partner-update'), {'url': 'http://example.com/shop.yaml'})
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        job = ImportJob.objects.get(id=response.json()['Job'])
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.errors, [{'error': 'Import queue is unavailable'}])
+
+    def test_status_endpoint(self):
+        job = ImportJob.objects.create(user=self.user, url='http://example.com/shop.yaml',
+                                       status='done', phase='done', processed=10)
+        other = ImportJob.objects.create(
+            user=User.objects.create_user(email='other@example.com', password='password123', type='shop'),
+            url='http://example.com/other.yaml'
+        )
+
+        response = self.client.get(reverse('partner-update-status', kwargs={'job_id': job.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['processed'], 10)
+        self.assertEqual(response.json()['status'], 'done')
+
+        response = self.client.get(reverse('partner-update-status', kwargs={'job_id': other.id}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
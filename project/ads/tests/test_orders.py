@@ -0,0 +1,275 @@
+import json
+from datetime import datetime, timezone
+from unittest.mock import patch
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate
+from cachalot.api import cachalot_disabled
+from ads.models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, ProductImage, Order, OrderItem
+from ads.tests.test_catalog import MEDIA_ROOT, make_image
+from ads.views import PartnerOrders
+
+
+class OrderListPaginationTests(APITestCase):
+
+    def setUp(self):
+        self.buyer = User.objects.create_user(email='buyer@example.com', password='password123')
+        self.partner = User.objects.create_user(email='partner@example.com', password='password123', type='shop')
+        self.shop = Shop.objects.create(name='Order Shop', user=self.partner)
+        category = Category.objects.create(name='Смартфоны')
+        product = Product.objects.create(name='Телефон', category=category)
+        self.offer = ProductInfo.objects.create(
+            product=product, shop=self.shop, name='Телефон', price=100, price_rrc=120, quantity=50
+        )
+        self.orders = []
+        for _ in range(5):
+            order = Order.objects.create(user=self.buyer, status='new')
+            OrderItem.objects.create(order=order, product=self.offer, shop=self.shop, quantity=2)
+            self.orders.append(order.id)
+        Order.objects.create(user=self.buyer, status='cart')
+
+        for view in ('ads.views.OrderView', 'ads.views.PartnerOrders'):
+            patcher = patch(f'{view}.throttle_classes', [])
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids.extend(order['id'] for order in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_order_list_default_response(self):
+        self.client.force_authenticate(self.buyer)
+        response = self.client.get(reverse('orders'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual([order['id'] for order in response.data['results']], sorted(self.orders, reverse=True))
+
+    def test_order_list_cursor_pagination(self):
+        self.client.force_authenticate(self.buyer)
+        ids = self.walk(reverse('orders') + '?pagination=cursor&page_size=2')
+        self.assertEqual(ids, sorted(self.orders, reverse=True))
+
+    def test_partner_orders_cursor_pagination(self):
+        self.client.force_authenticate(self.partner)
+        ids = self.walk(reverse('partner-orders') + '?pagination=cursor&page_size=3')
+        self.assertEqual(ids, sorted(self.orders, reverse=True))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class PartnerOrdersQueryTests(APITestCase):
+
+    def setUp(self):
+        self.buyer = User.objects.create_user(email='buyer@example.com', password='password123')
+        self.partner = User.objects.create_user(email='partner@example.com', password='password123', type='shop')
+        self.shop = Shop.objects.create(name='Order Shop', user=self.partner)
+        self.category = Category.objects.create(name='Смартфоны')
+        self.color = Parameter.objects.create(name='Цвет')
+
+    def create_order(self, lines):
+        order = Order.objects.create(user=self.buyer, status='new')
+        for index in range(lines):
+            product = Product.objects.create(name=f'Телефон {order.id}.{index}', category=self.category)
+            with patch('ads.tasks.generate_image_renditions.delay'):
+                ProductImage.objects.create(product=product, image=make_image(), is_main=True)
+            offer = ProductInfo.objects.create(
+                product=product, shop=self.shop, name=product.name, price=100, price_rrc=120, quantity=5
+            )
+            ProductParameter.objects.create(product_info=offer, parameter=self.color, value='черный')
+            OrderItem.objects.create(order=order, product=offer, shop=self.shop, quantity=1, price=100)
+
+    # Представление вызывается напрямую, чтобы не учитывать запросы middleware
+    def partner_orders(self):
+        request = APIRequestFactory().get(reverse('partner-orders'))
+        force_authenticate(request, self.partner)
+        with patch('ads.views.PartnerOrders.throttle_classes', []), cachalot_disabled():
+            return PartnerOrders.as_view()(request)
+
+    # Заказы, позиции с предложениями, товарами, категориями и магазинами, изображения, параметры
+    def test_order_lines_do_not_add_queries(self):
+        self.create_order(2)
+        self.create_order(3)
+
+        with self.assertNumQueries(4):
+            response = self.partner_orders()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = [item for order in response.data for item in order['order_items']]
+        self.assertEqual(len(lines), 5)
+        offer = lines[0]['product_info']
+        self.assertEqual(offer['product']['category'], 'Смартфоны')
+        self.assertEqual(offer['shop']['name'], 'Order Shop')
+        self.assertEqual(offer['parameters'], [{'parameter': 'Цвет', 'value': 'черный'}])
+        self.assertEqual(len(offer['images']), 1)
+
+
+class OrderTotalsTests(APITestCase):
+
+    def setUp(self):
+        self.buyer = User.objects.create_user(email='totals@example.com', password='password123')
+        self.partner = User.objects.create_user(email='totals-partner@example.com', password='password123', type='shop')
+        self.shop = Shop.objects.create(name='Totals Shop', user=self.partner)
+        other_shop = Shop.objects.create(name='Other Shop')
+        product = Product.objects.create(name='Телефон', category=Category.objects.create(name='Смартфоны'))
+        self.offer = ProductInfo.objects.create(
+            product=product, shop=self.shop, name='Телефон', price=100, price_rrc=120, quantity=50
+        )
+        self.other = ProductInfo.objects.create(
+            product=product, shop=other_shop, name='Телефон', price=30, price_rrc=40, quantity=50
+        )
+        self.client.force_authenticate(self.buyer)
+
+        for view in ('OrderView', 'PartnerOrders', 'CartView'):
+            patcher = patch(f'ads.views.{view}.throttle_classes', [])
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for task in ('send_order_confirmation', 'send_invoice_admin'):
+            patcher = patch(f'ads.views.{task}.delay')
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def cart_total(self):
+        return Order.objects.get(user=self.buyer, status='cart').total
+
+    def checkout(self):
+        self.client.post(reverse('cart'), {'items': json.dumps([
+            {'product_id': self.offer.id, 'quantity': 2}, {'product_id': self.other.id, 'quantity': 1},
+        ])})
+        cart = Order.objects.get(user=self.buyer, status='cart')
+        self.assertTrue(self.client.post(reverse('orders'), {'id': cart.id}).json()['Status'])
+        return cart
+
+    def test_cart_edits_maintain_total(self):
+        self.client.post(reverse('cart'), {'items': json.dumps([{'product_id': self.offer.id, 'quantity': 2}])})
+        self.assertEqual(self.cart_total(), 200)
+
+        self.client.post(reverse('cart'), {'items': json.dumps([{'product_id': self.other.id, 'quantity': 1}])})
+        self.assertEqual(self.cart_total(), 230)
+
+        self.client.put(reverse('cart'), {'items': json.dumps([{'id': self.offer.id, 'quantity': 3}])})
+        self.assertEqual(self.cart_total(), 330)
+
+        item = OrderItem.objects.get(product=self.offer)
+        self.client.delete(reverse('cart'), {'items': str(item.id)})
+        self.assertEqual(self.cart_total(), 30)
+
+    def test_checkout_stores_current_prices(self):
+        self.client.post(reverse('cart'), {'items': json.dumps([{'product_id': self.offer.id, 'quantity': 2}])})
+        ProductInfo.objects.filter(id=self.offer.id).update(price=150)
+        cart = Order.objects.get(user=self.buyer, status='cart')
+
+        self.client.post(reverse('orders'), {'id': cart.id})
+
+        cart.refresh_from_db()
+        self.assertEqual((cart.status, cart.total), ('new', 300))
+        ProductInfo.objects.filter(id=self.offer.id).update(price=500)
+        self.assertEqual(OrderItem.objects.get(order=cart).price, 150)
+
+    def test_order_list_does_not_touch_offers(self):
+        cart = self.checkout()
+
+        with cachalot_disabled(), CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('orders'))
+
+        order = response.json()['results'][0]
+        self.assertEqual(order, {'id': cart.id, 'status': 'new', 'dt': order['dt'], 'total_sum': 230})
+        queries = [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('SELECT') and '"ads_order"' in query['sql']
+        ]
+        # Количество для постраничного вывода и сама страница
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn('ads_productinfo', ''.join(queries))
+
+    def test_partner_orders_total_covers_partner_items(self):
+        cart = self.checkout()
+        ProductInfo.objects.update(price=1)
+        self.client.force_authenticate(self.partner)
+
+        response = self.client.get(reverse('partner-orders'))
+
+        self.assertEqual([(order['id'], order['total_sum']) for order in response.json()], [(cart.id, 200)])
+        self.assertEqual(
+            sorted(item['total_price'] for item in response.json()[0]['order_items']), [30, 200]
+        )
+
+
+class OrderHistoryTests(APITestCase):
+
+    def setUp(self):
+        self.buyer = User.objects.create_user(email='history@example.com', password='password123')
+        shops = [Shop.objects.create(name=f'History Shop {index}') for index in range(2)]
+        category = Category.objects.create(name='Смартфоны')
+        self.offers = [
+            ProductInfo.objects.create(
+                product=Product.objects.create(name=f'Телефон {index}', category=category),
+                shop=shops[index % 2], name=f'Телефон {index}', price=10, price_rrc=12, quantity=50
+            ) for index in range(4)
+        ]
+        self.client.force_authenticate(self.buyer)
+
+        patcher = patch('ads.views.OrderView.throttle_classes', [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_orders(self, count, day=1):
+        for _ in range(count):
+            order = Order.objects.create(user=self.buyer, status='new', total=30)
+            Order.objects.filter(id=order.id).update(dt=datetime(2026, 3, day, 12, tzinfo=timezone.utc))
+            for offer in self.offers[:2]:
+                OrderItem.objects.create(order=order, product=offer, shop=offer.shop, quantity=1 + offer.id % 2, price=10)
+
+    def get(self, query):
+        with cachalot_disabled(), CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('orders') + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json(), len([
+            query for query in context.captured_queries
+            if query['sql'].startswith('SELECT') and '"ads_order' in query['sql']
+        ])
+
+    def test_embedded_history_uses_constant_queries(self):
+        self.create_orders(2)
+        _, few = self.get('?embed=items,shop,totals')
+        self.create_orders(30)
+        data, many = self.get('?embed=items,shop,totals&page_size=50')
+
+        self.assertEqual(few, many)
+        self.assertEqual(data['count'], 32)
+        order = data['results'][0]
+        self.assertEqual((order['items_count'], order['total_quantity'], order['total_sum']), (2, 3, 30))
+        self.assertEqual(
+            [(item['name'], item['shop']['name'], item['total_price']) for item in order['order_items']],
+            [(offer.name, offer.shop.name, 10 * (1 + offer.id % 2)) for offer in self.offers[:2]]
+        )
+
+    def test_shops_without_items(self):
+        self.create_orders(1)
+        data, _ = self.get('?embed=shop')
+
+        order = data['results'][0]
+        self.assertNotIn('order_items', order)
+        self.assertEqual(sorted(shop['name'] for shop in order['shops']), ['History Shop 0', 'History Shop 1'])
+
+    def test_date_range(self):
+        for day in (1, 2, 3):
+            self.create_orders(1, day=day)
+
+        data, _ = self.get('?date_from=2026-03-02&date_to=2026-03-02')
+        self.assertEqual([order['dt'][:10] for order in data['results']], ['2026-03-02'])
+
+        data, _ = self.get('?date_from=2026-03-02T00:00:00Z')
+        self.assertEqual([order['dt'][:10] for order in data['results']], ['2026-03-03', '2026-03-02'])
+
+    def test_invalid_parameters(self):
+        for query in ('?date_from=yesterday', '?embed=payments'):
+            response = self.client.get(reverse('orders') + query)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
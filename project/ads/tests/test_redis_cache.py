@@ -0,0 +1,78 @@
+import os
+import unittest
+import redis
+from django.core.cache import caches
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from ads.caching import get_or_set, bump_generation, generations
+from ads.models import Category
+from project.cache_profiles import redis_caches
+
+try:
+    from fakeredis import FakeRedisConnection
+except ImportError:
+    FakeRedisConnection = None
+
+
+REDIS_URL = os.getenv('REDIS_CACHE_URL', 'redis://localhost:6379')
+
+
+# Настоящий Redis используется, если он доступен, иначе fakeredis
+def redis_test_caches():
+    try:
+        redis.Redis.from_url(f'{REDIS_URL}/1', socket_connect_timeout=0.2).ping()
+        return redis_caches(REDIS_URL, key_prefix='diplom-test')
+    except redis.RedisError:
+        if FakeRedisConnection is None:
+            return None
+        return redis_caches(REDIS_URL, connection_class=FakeRedisConnection, key_prefix='diplom-test')
+
+
+REDIS_CACHES = redis_test_caches()
+
+
+@unittest.skipIf(REDIS_CACHES is None, 'Нет ни Redis, ни fakeredis')
+@override_settings(CACHES=REDIS_CACHES, SESSION_ENGINE='django.contrib.sessions.backends.cached_db', SESSION_CACHE_ALIAS='sessions')
+class RedisCacheProfileTests(APITestCase):
+
+    def setUp(self):
+        for alias in REDIS_CACHES:
+            caches[alias].delete_pattern('*')
+
+    def test_caches_use_separate_databases(self):
+        caches['default'].set('key', 'default')
+        caches['cachalot'].set('key', 'cachalot')
+
+        self.assertEqual(caches['default'].get('key'), 'default')
+        self.assertEqual(caches['cachalot'].get('key'), 'cachalot')
+        self.assertIsNone(caches['imagekit'].get('key'))
+
+    def test_large_values_are_compressed(self):
+        value = ['Смартфон'] * 1000
+        caches['default'].set('large', value)
+
+        client = caches['default'].client.get_client()
+        raw = client.get(caches['default'].make_key('large'))
+        self.assertLess(len(raw), 1000)
+        self.assertEqual(caches['default'].get('large'), value)
+
+    def test_generations_and_response_cache(self):
+        before = generations([Category])
+        bump_generation(Category)
+        self.assertNotEqual(generations([Category]), before)
+        self.assertEqual(get_or_set('redis-value', lambda: 42), 42)
+        self.assertEqual(get_or_set('redis-value', lambda: 0), 42)
+
+        Category.objects.create(name='Смартфоны')
+        self.assertEqual(self.client.get(reverse('categories')).json()['count'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Аксессуары')
+        self.assertEqual(self.client.get(reverse('categories')).json()['count'], 2)
+
+    def test_sessions_are_cached(self):
+        session = self.client.session
+        session['cart'] = 1
+        session.save()
+
+        self.assertIsNotNone(caches['sessions'].get(f'django.contrib.sessions.cached_db{session.session_key}'))
@@ -1,7 +1,8 @@
 from django.test import TestCase, override_settings
 from django.core import mail
-from ads.models import User, Order, Shop, Category, Product, ProductInfo
-from ..tasks import send_email, send_order_confirmation, send_invoice_admin
+from unittest.mock import patch, MagicMock
+from ads.models import User, Order, Shop, Category, Product, ProductInfo, ImportJob, ShopFeed
+from ..tasks import send_email, send_order_confirmation, send_invoice_admin, import_catalog
 
 
 @override_settings(
@@ -70,4 +71,77 @@ class CeleryTaskTests(TestCase):
 
         self.assertEqual(len(mail.outbox), 1)
         email = mail.outbox[0]
-        self.assertIn('Новая накладная', email.subject)
\ No newline at end of file
+        self.assertIn('Новая накладная', email.subject)
+    
+    def feed_response(self, content, headers=None, status_code=200):
+        response = MagicMock(status_code=status_code, headers=headers or {})
+        response.__enter__.return_value = response
+        response.iter_content.return_value = [content[:50], content[50:]]
+        return response
+    
+    @patch('ads.feeds.get')
+    def test_import_catalog_task(self, mock_get):
+        mock_get.return_value = self.feed_response('''
+shop: Task Shop
+categories:
+  - id: 7
+    name: Телефоны
+goods:
+  - id: 1
+    category: 7
+    name: Телефон
+    price: 100
+    price_rrc: 120
+    quantity: 3
+    parameters:
+      Цвет: белый
+  - id: 2
+    category: 999
+    name: Без категории
+    price: 100
+    price_rrc: 120
+    quantity: 1
+'''.encode())
+        job = ImportJob.objects.create(user=self.user, url='http://example.com/shop.yaml')
+        
+        import_catalog.apply(args=[str(job.id)])
+        
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.processed, 1)
+        self.assertEqual(len(job.errors), 1)
+        self.assertTrue(ProductInfo.objects.filter(shop__name='Task Shop', name='Телефон').exists())
+    
+    @patch('ads.feeds.get', side_effect=ConnectionError('unreachable'))
+    def test_import_catalog_task_failure(self, mock_get):
+        job = ImportJob.objects.create(user=self.user, url='http://example.com/shop.yaml')
+        
+        import_catalog.apply(args=[str(job.id)])
+        
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('unreachable', job.errors[0]['error'])
+    
+    @patch('ads.feeds.get')
+    def test_import_catalog_skips_unchanged_feed(self, mock_get):
+        content = b'shop: Hash Shop\ncategories: []\ngoods: []\n'
+        url = 'http://example.com/hash.yaml'
+        mock_get.return_value = self.feed_response(content, headers={'ETag': '"v1"'})
+        first = ImportJob.objects.create(user=self.user, url=url)
+        import_catalog.apply(args=[str(first.id)])
+        
+        feed = ShopFeed.objects.get(shop__user=self.user)
+        self.assertEqual(feed.etag, '"v1"')
+        
+        mock_get.return_value = self.feed_response(content)
+        second = ImportJob.objects.create(user=self.user, url=url)
+        import_catalog.apply(args=[str(second.id)])
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'not_modified')
+        self.assertEqual(mock_get.call_args.kwargs['headers'], {'If-None-Match': '"v1"'})
+        
+        mock_get.return_value = self.feed_response(b'', status_code=304)
+        third = ImportJob.objects.create(user=self.user, url=url)
+        import_catalog.apply(args=[str(third.id)])
+        third.refresh_from_db()
+        self.assertEqual(third.status, 'not_modified')
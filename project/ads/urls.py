@@ -1,11 +1,11 @@
 from django.urls import path
 from .views import (RegisterUser, EmailConfirmUser, LoginUser,
-                    ProductInfoView, CategoryView, ShopView,
+                    ProductInfoView, ProductSearchView, CategoryView, ShopView,
                     CartView, PartnerState, PartnerOrders,
-                    PartnerUpdate, ContactView, OrderView, SocialLoginCallbackView, social_auth, SentryView, PerformanceView)
+                    PartnerUpdate, PartnerUpdateStatus, ContactView, OrderView, SocialLoginCallbackView, social_auth, SentryView, PerformanceView)
 from django.views.generic import TemplateView
 from rest_framework.authtoken.views import obtain_auth_token
-from .views import ProductImageView, ProductMainImageView
+from .views import ProductImageView, ProductImageBulkView, ProductMainImageView, ResponsiveImageView
 
 urlpatterns = [
     # Регистрация пользователя
@@ -23,6 +23,7 @@ urlpatterns = [
     
     # Список товаров, категорий, магазинов
     path('products/', ProductInfoView.as_view(), name='product-list'),
+    path('products/search/', ProductSearchView.as_view(), name='product-search'),
     path('categories/', CategoryView.as_view(), name='category-list'),
     path('shops/', ShopView.as_view(), name='shop-list'),
     
@@ -41,8 +42,11 @@ urlpatterns = [
     path('partner/state/', PartnerState.as_view(), name='partner-state'),
     path('partner/orders/', PartnerOrders.as_view(), name='partner-orders'),
     path('partner/update/', PartnerUpdate.as_view(), name='partner-update'),
+    path('partner/update/<uuid:job_id>/', PartnerUpdateStatus.as_view(), name='partner-update-status'),
     path('products/<int:product_id>/images/', ProductImageView.as_view(), name='product-images'),
+    path('products/<int:product_id>/images/bulk/', ProductImageBulkView.as_view(), name='product-images-bulk'),
     path('products/<int:product_id>/images/<int:pk>/', ProductImageView.as_view(), name='product-image-detail'),
     path('products/<int:product_id>/set-main-image/', ProductMainImageView.as_view(), name='set-main-image'),
+    path('images/<int:pk>/<str:version>/', ResponsiveImageView.as_view(), name='responsive-image'),
 ]
 
@@ -6,30 +6,43 @@ from rest_framework.request import Request
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
-from django.core.validators import URLValidator
+from django.core.validators import URLValidator, FileExtensionValidator
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import IntegrityError
-from django.db.models import Q, F, Sum
-from django.http import JsonResponse
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum, Count, Prefetch, Case, When, Value
+from django.db.models.functions import Coalesce
+from django.core.files.base import ContentFile
+from django.http import JsonResponse, HttpResponse, FileResponse
+from django.shortcuts import redirect
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware
+from django.views import View
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from requests import get
 from rest_framework.authtoken.models import Token
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import status, permissions
 from rest_framework.parsers import MultiPartParser, FormParser
-from ads.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, Contact, ConfirmEmailToken, User, ProductImage
-from ads.serializers import UserSer, CategorySer, ShopSer, ProductInfoSer, OrderItemSer, OrderSer, ContactSer, ProductImageSer
-import yaml
-from .tasks import send_email, send_order_confirmation, send_invoice_admin
+from ads.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, Contact, ConfirmEmailToken, User, ProductImage, ImportJob
+from ads.serializers import UserSer, CategorySer, ShopSer, ProductInfoSer, OrderItemSer, OrderSer, OrderHistorySer, ContactSer, ProductImageSer, ImportJobSer
+from .tasks import send_email, send_order_confirmation, send_invoice_admin, import_catalog
+from .importer import IMPORT_MODES
+from .checkout import checkout, update_order_total, EmptyCart, InsufficientStock
+from .search import search_offers
+from .images import (IMAGE_EXTENSIONS, process_images, snap_width, negotiate_format, source_version,
+                     responsive_name, responsive_image_url, render_responsive)
+from .facets import parse_facet_filters, filter_by_facets, facet_counts
+from .caching import cache_response, RenderedResponseCacheMixin, get_or_set, make_key, product_images_tag, bump_generation, catalog_read_tags, invalidate_shop_catalog
+from .pagination import IdCursorPagination, SizedPageNumberPagination, OptionalCursorPaginationMixin, cursor_pagination_requested
 from social_django.utils import psa
 from social_django.models import UserSocialAuth
 from rest_framework.decorators import api_view, permission_classes
 import logging
-from django.views.decorators.cache import cache_page
-from django.utils.decorators import method_decorator
+import sentry_sdk
 import time
+from datetime import datetime, timedelta
 from .throttling import (
     RegistrationThrottle, LoginThrottle, PartnerThrottle, ProductUpdateTrhottle,
     SocialAuthThrottle, BurstRateThrottle, SustainedRateThrottle
@@ -354,17 +367,31 @@ class ProductImageView(APIView):
     parser_classes = [MultiPartParser, FormParser]
     throttle_classes = [BurstRateThrottle]
     
-    @method_decorator(cache_page(60*15))
+    # Сериализованные изображения кэшируются по товару и сбрасываются при изменении
+    # или удалении любого его изображения. Права на отдельное изображение проверяются
+    # при каждом запросе, из кэша берутся только данные
     def get(self, request, product_id=None, pk=None):
         if pk:
-            image = get_object_or_404(ProductImage, pk=pk, product__product_infos__shop__user=request.user)
-            serializer = ProductImageSer(image)
-            return Response(serializer.data)
-        
-        product = get_object_or_404(Product, pk=product_id)
-        images = product.images.all().order_by('order', '-is_main', 'created_at')
-        serializer = ProductImageSer(images, many=True)
-        return Response(serializer.data)        
+            image = get_object_or_404(
+                ProductImage.objects.distinct(), pk=pk, product_id=product_id, product__product_infos__shop__user=request.user
+            )
+            data = get_or_set(
+                make_key('product_image', product_id, pk),
+                lambda: ProductImageSer(image).data,
+                timeout=60 * 15, tags=[product_images_tag(product_id)],
+            )
+            return Response(data)
+
+        def list_images():
+            product = get_object_or_404(Product, pk=product_id)
+            images = product.images.all().order_by('order', '-is_main', 'created_at')
+            return ProductImageSer(images, many=True).data
+
+        data = get_or_set(
+            make_key('product_images', product_id), list_images,
+            timeout=60 * 15, tags=[product_images_tag(product_id)],
+        )
+        return Response(data)
 
     def post(self, request, product_id):
         product = get_object_or_404(Product, pk=product_id)
@@ -402,6 +429,97 @@ class ProductImageView(APIView):
         image.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+# Массовая загрузка изображений товара: файлы обрабатываются параллельно в пуле процессов,
+# результат возвращается по каждому файлу в порядке загрузки
+class ProductImageBulkView(APIView):
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser, FormParser]
+    throttle_classes = [BurstRateThrottle]
+
+    def post(self, request, product_id):
+        product = get_object_or_404(Product, pk=product_id)
+        if request.user.type != 'shop':
+            return Response({'Error': 'Только магазины могут загружать изображения'}, status=status.HTTP_403_FORBIDDEN)
+        if not product.product_infos.filter(shop__user=request.user).exists():
+            return Response(
+                {'Error': 'У вас нет прав на редактирование этого товара'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        files = request.FILES.getlist('images')
+        if not files:
+            return Response({'Error': 'Не переданы изображения'}, status=status.HTTP_400_BAD_REQUEST)
+
+        validator = FileExtensionValidator(allowed_extensions=IMAGE_EXTENSIONS)
+        results, accepted = [], []
+        for upload in files:
+            result = {'file': upload.name}
+            try:
+                validator(upload)
+            except ValidationError as err:
+                result.update({'Status': False, 'Error': ' '.join(err.messages)})
+            else:
+                accepted.append((result, upload.read()))
+            results.append(result)
+
+        processed = process_images([data for _, data in accepted])
+        with transaction.atomic():
+            for (result, _), (content, error) in zip(accepted, processed):
+                if error:
+                    result.update({'Status': False, 'Error': f'Не удалось обработать изображение: {error}'})
+                    continue
+                image = ProductImage(product=product)
+                image.store_image(result['file'], content)
+                image.save()
+                result.update({'Status': True, 'id': image.id})
+
+        created = any(result['Status'] for result in results)
+        return Response(
+            {'results': results},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST
+        )
+
+
+RESPONSIVE_MAX_AGE = 60 * 60 * 24 * 365
+
+
+# Адаптивное изображение: формат по Accept (AVIF/WebP/JPEG), ширина ?w= приводится к лестнице
+# RESPONSIVE_WIDTHS. Обычное представление Django, так как согласование DRF отклонило бы
+# Accept: image/*. Результат хранится на диске рядом с вариантами imagekit; в адресе есть версия
+# исходника, поэтому ответ помечается неизменяемым
+class ResponsiveImageView(View):
+
+    def get(self, request, pk, version):
+        image = get_object_or_404(ProductImage.objects.exclude(image=''), pk=pk)
+        try:
+            width = snap_width(int(request.GET.get('w') or 0))
+        except ValueError:
+            return JsonResponse({'Status': False, 'Error': 'Invalid width'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if version != source_version(image.image.name):
+            return redirect(responsive_image_url(image, width))
+
+        media_type, image_format, extension, options = negotiate_format(request.headers.get('Accept'))
+        name = responsive_name(image.image.name, width, extension)
+        storage = image.image.storage
+        if storage.exists(name):
+            response = FileResponse(storage.open(name, 'rb'), content_type=media_type)
+        else:
+            with image.image.open('rb') as source:
+                content = render_responsive(source, width, image_format, options)
+            # Параллельный запрос мог сохранить тот же вариант, пока этот рендерил; копия с другим
+            # именем (хранилище добавляет суффикс) никогда не читается, поэтому удаляется
+            if not storage.exists(name):
+                saved = storage.save(name, ContentFile(content))
+                if saved != name:
+                    storage.delete(saved)
+            response = HttpResponse(content, content_type=media_type)
+
+        patch_cache_control(response, public=True, max_age=RESPONSIVE_MAX_AGE, immutable=True)
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+
 class ProductMainImageView(APIView):
     permission_classes = [IsAuthenticated]
     throttle_classes = [BurstRateThrottle]
@@ -434,15 +552,31 @@ class ProductMainImageView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
 
+# Общие для всех магазинов данные каталога; предложения магазинов, их товары
+# и изображения сбрасываются по тегам магазинов и категорий
+CATALOG_CACHE_MODELS = (Category, Parameter)
+
+
+def catalog_cache_tags(view, request):
+    return catalog_read_tags(request.query_params.get('shop_id'), request.query_params.get('category_id'))
+
+
 # Каталог товаров        
-class ProductInfoView(ListAPIView):
+class ProductInfoView(OptionalCursorPaginationMixin, ListAPIView):
     permission_classes = [IsAuthenticated]
     
-    queryset = ProductInfo.objects.filter(quantity__gt=0).select_related('product', 'shop')
+    # Изображения, параметры и их названия загружаются отдельными запросами на всю страницу
+    queryset = ProductInfo.objects.filter(quantity__gt=0).select_related(
+        'product__category', 'shop'
+    ).prefetch_related(
+        Prefetch('product__images', queryset=ProductImage.objects.order_by('order', '-is_main')),
+        Prefetch('product_parameters', queryset=ProductParameter.objects.select_related('parameter')),
+    )
     serializer_class = ProductInfoSer
     filter_fields = ['shop', 'product_category']
     
-    def get_queryset(self):
+    # Каталог без фильтров по параметрам: от него считаются фасеты
+    def get_catalog_queryset(self):
         queryset = super().get_queryset()
         shop_id = self.request.query_params.get('shop_id')
         category_id = self.request.query_params.get('category_id')
@@ -454,19 +588,90 @@ class ProductInfoView(ListAPIView):
         
         return queryset
 
+    def get_queryset(self):
+        return filter_by_facets(self.get_catalog_queryset(), parse_facet_filters(self.request.query_params))
+    
+    # С параметром ?facets=true в ответ добавляется количество предложений по значениям параметров
+    @cache_response(models=CATALOG_CACHE_MODELS, tags=catalog_cache_tags)
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get('facets', '').lower() in ('1', 'true', 'yes'):
+            response.data['facets'] = facet_counts(
+                self.filter_queryset(self.get_catalog_queryset()), parse_facet_filters(request.query_params)
+            )
+        return response
+
+
+# Поиск товаров в наличии по названию, артикулу и описанию: ?q=...
+# Результаты упорядочены по релевантности, поэтому постраничный вывод только по номеру
+class ProductSearchView(ProductInfoView):
+    cursor_pagination_class = None
+    
+    def list(self, request, *args, **kwargs):
+        if not request.query_params.get('q', '').strip():
+            return JsonResponse({'Status': False, 'Errors': 'Search query is required'}, status=status.HTTP_400_BAD_REQUEST)
+        return super().list(request, *args, **kwargs)
+    
+    def get_catalog_queryset(self):
+        return search_offers(super().get_catalog_queryset(), self.request.query_params['q'].strip())
+
 
 # Список категорий    
-class CategoryView(ListAPIView):
+class CategoryView(RenderedResponseCacheMixin, ListAPIView):
     permission_classes = [AllowAny]
     queryset = Category.objects.all()
     serializer_class = CategorySer
+    response_cache_timeout = 60 * 60
+    response_cache_models = [Category]
 
 
 # Список магазинов
-class ShopView(ListAPIView):
+class ShopView(RenderedResponseCacheMixin, ListAPIView):
     permission_classes = [AllowAny]
     queryset = Shop.objects.filter(state=True)
     serializer_class = ShopSer
+    response_cache_timeout = 60 * 60
+    response_cache_models = [Shop]
+
+
+# Количество по каждому предложению из списка позиций; при повторе предложения берётся последнее.
+# None, если позиция не содержит предложения или положительного количества
+def cart_quantities(items):
+    quantities = {}
+    for item in items:
+        try:
+            product_id, quantity = int(item['product_id']), int(item['quantity'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if quantity < 1:
+            return None
+        quantities[product_id] = quantity
+    return quantities
+
+
+# Границы периода для истории заказов: ?date_from= и ?date_to= (дата или дата со временем).
+# Дата в date_to включает весь день
+def order_date_range(query_params):
+    bounds = []
+    for name in ('date_from', 'date_to'):
+        value = query_params.get(name)
+        if not value:
+            bounds.append(None)
+            continue
+        try:
+            day, moment = parse_date(value), parse_datetime(value)
+        except ValueError:
+            day = moment = None
+        if day is not None:
+            if name == 'date_to':
+                day += timedelta(days=1)
+            moment = datetime.combine(day, datetime.min.time())
+        elif moment is None:
+            raise ValueError(f'Invalid date: {name}={value}')
+        elif name == 'date_to':
+            moment += timedelta(microseconds=1)
+        bounds.append(make_aware(moment) if is_naive(moment) else moment)
+    return bounds
 
 
 # Работа с корзиной покупок
@@ -492,6 +697,10 @@ class CartView(APIView):
         except Exception as e:
             return JsonResponse({'Status': False, 'Error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
+    # Позиции корзины записываются пачкой: предложения загружаются одним запросом id__in,
+    # позиции вставляются или обновляются одним INSERT ... ON CONFLICT по unique_order_item.
+    # Число запросов не зависит от количества позиций. Корзина блокируется до записи позиций,
+    # чтобы параллельные изменения не теряли пересчёт суммы (во всех методах корзины)
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Login required'}, status=status.HTTP_403_FORBIDDEN)
@@ -503,31 +712,45 @@ class CartView(APIView):
             except ValueError as err:
                 return JsonResponse({'Status': False, 'Errors': f'Invalid request{err}'})
             else:
-                cart, _= Order.objects.get_or_create(user_id=request.user.id,status='cart')
-                
-                objects_create = 0
-                for item_data in items_dict:
-                    try:
-                        product = ProductInfo.objects.get(id=item_data['product_id'])
-                        order_item, created = OrderItem.objects.get_or_create(
-                            order=cart,
-                            product=product,
-                            shop=product.shop,
-                            defaults={'quantity': item_data['quantity']}
+                quantities = cart_quantities(items_dict)
+                if quantities is None:
+                    return JsonResponse({'Status': False, 'Errors': 'Invalid item format'})
+
+                offers = {
+                    offer_id: (shop_id, price)
+                    for offer_id, shop_id, price in ProductInfo.objects.filter(id__in=quantities).values_list('id', 'shop_id', 'price')
+                }
+                missing = sorted(set(quantities) - set(offers))
+                if missing:
+                    return JsonResponse(
+                        {'Status': False, 'Errors': f'Products not found: {missing}'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+
+                try:
+                    with transaction.atomic():
+                        cart, _ = Order.objects.select_for_update().get_or_create(user_id=request.user.id, status='cart')
+                        OrderItem.objects.bulk_create(
+                            [
+                                OrderItem(
+                                    order=cart, product_id=product_id, shop_id=offers[product_id][0],
+                                    price=offers[product_id][1], quantity=quantity
+                                )
+                                for product_id, quantity in quantities.items()
+                            ],
+                            update_conflicts=True,
+                            unique_fields=['order', 'product'],
+                            update_fields=['quantity', 'price'],
                         )
-                        if not created:
-                            order_item.quantity = item_data['quantity']
-                            order_item.save()
-                        objects_create += 1
-                    except IntegrityError as err:
-                        return JsonResponse({'Status': False, 'Errors': str(err)})                            
-                    except KeyError:
-                        return JsonResponse({'Status': False, 'Errors': 'Invalid item format'})
-                        
-                return JsonResponse({'Status': True, 'Objects_create': objects_create,}, status=status.HTTP_201_CREATED)
+                        update_order_total(cart.id)
+                except IntegrityError as err:
+                    return JsonResponse({'Status': False, 'Errors': str(err)})
+
+                return JsonResponse({'Status': True, 'Objects_create': len(quantities),}, status=status.HTTP_201_CREATED)
             
         return JsonResponse({'Status': False, 'Errors': 'All arguments are not specifed'}, status=status.HTTP_400_BAD_REQUEST)
     
+    # Количества обновляются одним UPDATE с CASE по предложениям
     def put(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Login required'}, status=status.HTTP_403_FORBIDDEN)
@@ -539,15 +762,21 @@ class CartView(APIView):
             except ValueError as err:
                 return JsonResponse({'Status': False, 'Errors': f'Invalid request{err}'})
             else:
-                cart, _ = Order.objects.get_or_create(user_id=request.user.id, status='cart')
-                
+                quantities = {
+                    order_item['id']: order_item['quantity'] for order_item in items_list
+                    if isinstance(order_item.get('id'), int) and isinstance(order_item.get('quantity'), int)
+                }
                 objects_update = 0
-                for order_item in items_list:
-                    if isinstance(order_item.get('id'), int) and isinstance(order_item.get('quantity'), int):
-                        updated = OrderItem.objects.filter(
-                            order_id = cart.id,
-                            product_id=order_item['id']).update(quantity=order_item['quantity'])
-                        objects_update += updated
+                with transaction.atomic():
+                    cart, _ = Order.objects.select_for_update().get_or_create(user_id=request.user.id, status='cart')
+                    if quantities:
+                        objects_update = OrderItem.objects.filter(order_id=cart.id, product_id__in=quantities).update(
+                            quantity=Case(*[
+                                When(product_id=product_id, then=Value(quantity))
+                                for product_id, quantity in quantities.items()
+                            ])
+                        )
+                        update_order_total(cart.id)
                         
                 return JsonResponse({'Status': True, 'Objects_update': objects_update})
             
@@ -560,17 +789,13 @@ class CartView(APIView):
         items = request.data.get('items')
         if items:
             items_list = items.split(',') if isinstance(items, str) else items
-            cart, _ = Order.objects.get_or_create(user_id=request.user.id, status='cart')
-            query = Q()
-            objects_deleted = False
-            
-            for order_item_id in items_list:
-                if order_item_id.isdigit():
-                    query = query | Q(order_id=cart.id, id=int(order_item_id))
-                    objects_deleted = True
+            item_ids = [int(order_item_id) for order_item_id in items_list if str(order_item_id).strip().isdigit()]
                     
-            if objects_deleted:
-                deleted_count = OrderItem.objects.filter(query).delete()[0]
+            if item_ids:
+                with transaction.atomic():
+                    cart, _ = Order.objects.select_for_update().get_or_create(user_id=request.user.id, status='cart')
+                    deleted_count = OrderItem.objects.filter(order_id=cart.id, id__in=item_ids).delete()[0]
+                    update_order_total(cart.id)
                 return JsonResponse({'Status': True, 'Objects_deleted': deleted_count}, status=status.HTTP_200_OK)
             
         return JsonResponse({'Status': False, 'Error': 'Arguments are not specified'}, status=status.HTTP_400_BAD_REQUEST)
@@ -596,6 +821,9 @@ class PartnerState(APIView):
         if state:
             try:
                 Shop.objects.filter(user_id=request.user.id).update(state=strtobool(state))
+                bump_generation(Shop)
+                for shop_id in Shop.objects.filter(user_id=request.user.id).values_list('id', flat=True):
+                    invalidate_shop_catalog(shop_id)
                 return JsonResponse({'Status': True}, status=status.HTTP_200_OK)
             except ValueError as err:
                 return JsonResponse({'Status': False, 'Errors': str(err)})
@@ -611,10 +839,22 @@ class PartnerOrders(APIView):
         if not request.user.is_authenticated or request.user.type != 'shop':
             return JsonResponse({'Status': False, 'Error': 'For only shops'}, status=status.HTTP_403_FORBIDDEN)
         
+        # Сумма только по позициям магазина партнёра, по зафиксированным при оформлении ценам.
+        # Предложения позиций загружаются так же, как в ProductInfoView: отдельными запросами на всю страницу
         order = Order.objects.filter(
-            order_items__product__shop__user_id = request.user.id).exclude(status='cart').prefetch_related(
-                'order_items__product').select_related('contact').annotate(
-                    total_sum=Sum(F('order_items__quantity')* F('order_items__product__price'))).distinct()
+            order_items__shop__user_id = request.user.id).exclude(status='cart').prefetch_related(
+                Prefetch('order_items', queryset=OrderItem.objects.select_related(
+                    'product__product__category', 'product__shop'
+                ).prefetch_related(
+                    Prefetch('product__product__images', queryset=ProductImage.objects.order_by('order', '-is_main')),
+                    Prefetch('product__product_parameters', queryset=ProductParameter.objects.select_related('parameter')),
+                ))).annotate(
+                    total_sum=Sum(F('order_items__quantity')* F('order_items__price'))).distinct()
+        
+        paginator = None
+        if cursor_pagination_requested(request):
+            paginator = IdCursorPagination()
+            order = paginator.paginate_queryset(order, request, view=self)
                 
         serializer = OrderSer(order, many=True)
         from django.core.mail import send_mail
@@ -625,6 +865,8 @@ class PartnerOrders(APIView):
         [request.user.email],
         fail_silently=False,
         )
+        if paginator:
+            return paginator.get_paginated_response(serializer.data)
         return Response(serializer.data)    
     
 
@@ -646,35 +888,43 @@ class PartnerUpdate(APIView):
             except ValidationError as err:
                 return JsonResponse({'Status': False, 'Error': str(err)})
             else:
-                stream = get(url).content
-                data = yaml.safe_load(stream)
-
-                shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=request.user.id)
+                mode = request.data.get('mode', 'sync')
+                if mode not in IMPORT_MODES:
+                    return JsonResponse({'Status': False, 'Error': f'Unknown mode: {mode}'}, status=status.HTTP_400_BAD_REQUEST)
                 
-                for category in data['categories']:
-                    category_object,_ = Category.objects.get_or_create(id=category['id'], name=category['name'])
-                    category_object.shops.add(shop.id)
-                    category_object.save()
-                ProductInfo.objects.filter(shop_id=shop.id).delete()
-                for item in data['goods']:
-                    product, _ =Product.objects.get_or_create(name=item['name'], category_id=item['category'])
-                    product_info = ProductInfo.objects.create(
-                        product_id=product.id,
-                        name=item.get('name', ''),
-                        price=item['price'],
-                        price_rrc=item['price_rrc'],
-                        quantity=item['quantity'],
-                        shop_id=shop.id)
-                    
-                    for name, value in item.get('parameters', {}).items():
-                        parameter_objects, _ = Parameter.objects.get_or_create(name=name)
-                        ProductParameter.objects.create(product_info_id=product_info.id,
-                                                        parameter_id=parameter_objects.id,
-                                                        value=value)
-                        
-                return JsonResponse({'Status': True}, status=status.HTTP_200_OK)
+                job = ImportJob.objects.create(user=request.user, url=url, mode=mode)
+                try:
+                    import_catalog.apply_async(args=[str(job.id)], task_id=str(job.id))
+                except Exception as ex:
+                    # Брокер недоступен: задача не поставлена, и задание не должно остаться в очереди
+                    logger.warning('Could not schedule import job %s: %s', job.id, ex)
+                    sentry_sdk.capture_exception(ex)
+                    job.status = 'failed'
+                    job.errors = [{'error': 'Import queue is unavailable'}]
+                    job.save(update_fields=['status', 'errors', 'updated_at'])
+                    return JsonResponse(
+                        {'Status': False, 'Error': 'Import queue is unavailable', 'Job': str(job.id)},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE
+                    )
+                return JsonResponse({'Status': True, 'Job': str(job.id)}, status=status.HTTP_202_ACCEPTED)
             
         return JsonResponse({'Status': False, 'Errors': 'not specified'}, status=status.HTTP_400_BAD_REQUEST)       
+
+
+# Ход выполнения импорта каталога
+class PartnerUpdateStatus(APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [BurstRateThrottle]
+    def get(self, request, job_id, *args, **kwargs):
+        job = get_object_or_404(ImportJob, id=job_id, user_id=request.user.id)
+        data = ImportJobSer(job).data
+        
+        if job.status == 'running':
+            progress = import_catalog.AsyncResult(str(job.id))
+            if progress.state == 'PROGRESS' and isinstance(progress.info, dict):
+                data.update(progress.info)
+        
+        return Response(data)
      
 
 # Контакты пользователя     
@@ -750,42 +1000,50 @@ class OrderView(APIView):
                     'id': order.id,
                     'status': order.status,
                     'dt': order.dt,
+                    'total_sum': order.total,
                     'message': 'Order details'
                 })
             except Order.DoesNotExist:
                 return JsonResponse({'Status': False, 'Errors': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
         else:
-
+            embed = set(filter(None, request.query_params.get('embed', '').split(',')))
+            unknown = sorted(embed - set(OrderHistorySer.EMBED_FIELDS))
+            if unknown:
+                return JsonResponse({'Status': False, 'Errors': f'Unknown embed: {unknown}'}, status=status.HTTP_400_BAD_REQUEST)
             try:
-                orders = Order.objects.filter(user_id=request.user.id).exclude(status='cart').order_by('-dt')
-                orders_data = []
-                for order in orders:
-                    orders_data.append({
-                        'id': order.id,
-                        'status': order.status,
-                        'dt': order.dt
-                    })
-                return Response(orders_data)
-            except Exception as e:
-                return JsonResponse({'Status': False, 'Error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                date_from, date_to = order_date_range(request.query_params)
+            except ValueError as err:
+                return JsonResponse({'Status': False, 'Errors': str(err)}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Период отбирается по индексу (пользователь, дата)
+            orders = Order.objects.filter(user_id=request.user.id).exclude(status='cart').order_by('-dt', '-id')
+            if date_from:
+                orders = orders.filter(dt__gte=date_from)
+            if date_to:
+                orders = orders.filter(dt__lt=date_to)
+            # Позиции и магазины всей страницы загружаются одним дополнительным запросом
+            if embed & {'items', 'shop'}:
+                orders = orders.prefetch_related(
+                    Prefetch('order_items', queryset=OrderItem.objects.select_related('product', 'shop').order_by('id'))
+                )
+            if 'totals' in embed:
+                orders = orders.annotate(
+                    items_count=Count('order_items'), total_quantity=Coalesce(Sum('order_items__quantity'), 0)
+                )
+
+            paginator = IdCursorPagination() if cursor_pagination_requested(request) else SizedPageNumberPagination()
+            page = paginator.paginate_queryset(orders, request, view=self)
+            serializer = OrderHistorySer(page, many=True, context={'request': request, 'embed': embed})
+            return paginator.get_paginated_response(serializer.data)
     
+    # Оформление заказа: корзина блокируется, остатки резервируются в той же транзакции,
+    # письма отправляются только после её фиксации
     def post(self, request, *args, **kwargs):
         if {'id'}.issubset(request.data):
             try:
-                order = Order.objects.get(
-                    user_id=request.user.id, 
-                    id=request.data['id'],
-                    status='cart'
-                )
-
-                order.status = 'new'
-                order.save()
-                
-                confirmation_result = send_order_confirmation.delay(order.id)
-                print(f"Order confirmation: {confirmation_result}")
-                
-                invoice_result = send_invoice_admin.delay(order.id)
-                print(f"Invoice to admin: {invoice_result}")
+                order = checkout(request.user.id, request.data['id'])
+                transaction.on_commit(lambda: send_order_confirmation.delay(order.id))
+                transaction.on_commit(lambda: send_invoice_admin.delay(order.id))
                 
                 return JsonResponse({
                     'Status': True,
@@ -794,8 +1052,17 @@ class OrderView(APIView):
                 
             except Order.DoesNotExist:
                 return JsonResponse({'Status': False, 'Errors': 'Order not found'})
+
+            except EmptyCart as err:
+                return JsonResponse({'Status': False, 'Errors': str(err)}, status=status.HTTP_400_BAD_REQUEST)
+
+            except InsufficientStock as err:
+                return JsonResponse(
+                    {'Status': False, 'Errors': str(err), 'Shortages': err.shortages},
+                    status=status.HTTP_409_CONFLICT
+                )
             
-            except IntegrityError as err:
+            except (IntegrityError, ValueError) as err:
                 return JsonResponse({'Status': False, 'Errors': f'Argument incorrectly{err}'}, status=status.HTTP_400_BAD_REQUEST)
             
         return JsonResponse({'Status': False, 'Errors': 'Required fields are not specified'}, status=status.HTTP_400_BAD_REQUEST)
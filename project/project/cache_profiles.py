@@ -0,0 +1,33 @@
+from django.utils.module_loading import import_string
+
+
+# Номера баз Redis для отдельных кэшей; база 0 занята брокером Celery
+REDIS_CACHE_DATABASES = {
+    'default': 1,
+    'cachalot': 2,
+    'imagekit': 3,
+    'sessions': 4,
+}
+
+
+# Общий для всех процессов кэш в Redis: пул соединений на процесс, сжатие значений zlib.
+# connection_class позволяет подставить fakeredis.FakeRedisConnection в тестах
+def redis_caches(url, connection_class=None, max_connections=50, key_prefix='diplom'):
+    pool_kwargs = {'max_connections': max_connections, 'retry_on_timeout': True}
+    if connection_class:
+        pool_kwargs['connection_class'] = import_string(connection_class) if isinstance(connection_class, str) else connection_class
+
+    return {
+        alias: {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': f'{url.rstrip("/")}/{database}',
+            'KEY_PREFIX': key_prefix,
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+                'COMPRESSOR': 'django_redis.compressors.zlib.ZlibCompressor',
+                'CONNECTION_POOL_KWARGS': dict(pool_kwargs),
+                'SOCKET_CONNECT_TIMEOUT': 2,
+                'SOCKET_TIMEOUT': 2,
+            },
+        } for alias, database in REDIS_CACHE_DATABASES.items()
+    }
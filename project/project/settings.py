@@ -16,6 +16,7 @@ import sentry_sdk
 from sentry_sdk.integrations.django import DjangoIntegration
 from sentry_sdk.integrations.celery import CeleryIntegration
 from sentry_sdk.integrations.redis import RedisIntegration
+from .cache_profiles import redis_caches
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.sites',
+    'django.contrib.postgres',
     
     'django_rest_passwordreset',
     'rest_framework',
@@ -259,6 +261,9 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
+CATALOG_IMPORT_BATCH_SIZE = 1000
+CATALOG_FEED_SPOOL_SIZE = 8 * 1024 * 1024
+
 EMAIL_CONFIRMATION_SUBJECT = 'Подтверждение регистрации'
 ORDER_CONFIRMATION_SUBJECT = 'Подтверждение заказа'
 
@@ -332,6 +337,19 @@ CACHES = {
     }
 }
 
+# Профиль для production: CACHE_PROFILE=redis, кэши и сессии общие для всех воркеров
+CACHE_PROFILE = os.getenv('CACHE_PROFILE', 'local')
+REDIS_CACHE_URL = os.getenv('REDIS_CACHE_URL', 'redis://localhost:6379')
+
+if CACHE_PROFILE == 'redis':
+    CACHES = redis_caches(
+        REDIS_CACHE_URL,
+        connection_class=os.getenv('REDIS_CACHE_CONNECTION_CLASS'),
+        max_connections=int(os.getenv('REDIS_CACHE_MAX_CONNECTIONS', 50)),
+    )
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+    SESSION_CACHE_ALIAS = 'sessions'
+
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 
@@ -346,6 +364,7 @@ CACHALOT_ONLY_CACHABLE_TABLES = {
     'ads_productinfo',
     'ads_parameter',
     'ads_productparameter',
+    'ads_productfacet',
 }
 
 CACHALOT_UNCACHABLE_TABLES = {
@@ -372,7 +391,7 @@ DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
 IMAGEKIT_CACHEFILE_DIR = 'CACHE/images'
 IMAGEKIT_SPEC_CACHEFILE_NAMER = 'imagekit.cachefiles.namers.source_name_dot_hash'
 IMAGEKIT_DEFAULT_CACHEFILE_BACKEND = 'imagekit.cachefiles.backends.Simple'
-IMAGEKIT_DEFAULT_CACHEFILE_STRATEGY = 'imagekit.cachefiles.strategies.JustInTime'
+IMAGEKIT_DEFAULT_CACHEFILE_STRATEGY = 'ads.imagekit_.Background'
 
 IMAGEKIT_DEFAULT_IMAGE_QUALITY = 85
 IMAGEKIT_DEFAULT_IMAGE_FORMAT = 'JPEG'
@@ -389,7 +408,9 @@ SILKY_INTERCEPT_PERCENT = 100
 SILKY_MAX_RECORDED_REQUESTS = 10**4
 SILKY_MAX_RECORDED_REQUESTS_CHECK_PERCENT = 10
 
-SILKY_ANALYZE_QUERIES = True
+# EXPLAIN ANALYZE повторно выполняет запрос: UPDATE списания остатков и пересчёта суммы заказа
+# сработали бы дважды, поэтому silk строит только план без выполнения
+SILKY_ANALYZE_QUERIES = False
 SILKY_EXPLAIN_FLAGS = {
     'verbose': True,
     'costs': True,